@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'blogging_platform_api.settings')
+#Read endpoints run natively async under ASGI (see posts.async_views)
+os.environ.setdefault('DJANGO_ASYNC_READ_VIEWS', '1')
 
 application = get_asgi_application()
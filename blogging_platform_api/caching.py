@@ -0,0 +1,59 @@
+#Cross-process state in the default cache.
+#Token snapshots, version counters, the feed watermark, read-your-writes pins and
+#stampede locks are only correct when every worker process sees the same cache: Redis
+#(settings.CACHES), Memcached or the database backend. A process-local backend
+#(LocMemCache, Django's default when CACHES is unset, or DummyCache) would let each
+#worker keep its own copy, so every user of this state asks is_shared_cache() and falls
+#back to something safe without it. `manage.py check --deploy` warns about it.
+import time
+
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+#How long a version counter lives in a process-local cache: the longest another
+#process's change can go unnoticed
+LOCAL_VERSION_TIMEOUT = 5
+
+
+def is_shared_cache(alias=DEFAULT_CACHE_ALIAS):
+  return not isinstance(caches[alias], PROCESS_LOCAL_BACKENDS)
+
+
+def new_version():
+  #Counters start from the clock, so one that was evicted never repeats an earlier value
+  return time.time_ns() // 1000
+
+
+def get_version(key):
+  """
+  Current value of the version counter stored under `key`. Every change bumps it,
+  which retires whatever was cached under the previous value.
+  """
+  version = cache.get(key)
+  if version is None:
+    cache.add(key, new_version(), None if is_shared_cache() else LOCAL_VERSION_TIMEOUT)
+    version = cache.get(key)
+  return new_version() if version is None else version
+
+
+def bump_version(key):
+  try:
+    cache.incr(key)
+  except ValueError:
+    cache.set(key, new_version(), None if is_shared_cache() else LOCAL_VERSION_TIMEOUT)
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+  if is_shared_cache():
+    return []
+  return [checks.Warning(
+    'The default cache is process-local, so worker processes cannot share token '
+    'revocations, read-your-writes pins, cached responses or feed validators.',
+    hint='Point CACHES at Redis (REDIS_URL) or Memcached.',
+    id='blogging_platform_api.W001',
+  )]
@@ -0,0 +1,240 @@
+#Primary/replica database routing.
+#During GET/HEAD/OPTIONS requests, reads of the posts and users apps go to a healthy
+#replica. Everything else uses the primary: writes, every query of unsafe requests,
+#reads inside transactions and reads outside requests (Celery, commands).
+#A client that wrote is pinned to the primary for PIN_SECONDS, so it always reads its
+#own likes, drafts and comments while the replicas catch up. The pin is kept in the
+#shared cache (under its credential, for every worker to see) and in a signed cookie.
+#Nothing changes unless DATABASE_REPLICAS names at least one alias.
+import hashlib
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from threading import Lock
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from blogging_platform_api import caching
+
+
+REPLICAS = getattr(settings, 'DATABASE_REPLICAS', [])
+ROUTED_APPS = {'posts', 'users'}
+PIN_SECONDS = getattr(settings, 'DATABASE_PIN_SECONDS', 10)
+#Replicas further behind than this (seconds) take no reads
+MAX_REPLICA_LAG = getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5)
+#How long a health probe result is trusted
+HEALTH_CHECK_INTERVAL = 5
+PIN_COOKIE = 'db_pinned'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_state = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+  """
+  Routing for the current request: whether reads may use a replica and whether
+  the request has written (after which its reads stay on the primary).
+  """
+  def __init__(self, use_replicas):
+    self.use_replicas = use_replicas
+    self.wrote = False
+
+  def __call__(self, execute, sql, params, many, context):
+    #execute_wrapper on the primary. Writes are detected from the SQL, as db_for_write()
+    #is also consulted when unsaved instances are merely assigned to relations.
+    if not self.wrote and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+      self.wrote = True
+    return execute(sql, params, many, context)
+
+
+def get_replica_lag(alias):
+  """
+  Seconds the replica is behind its primary; None when replication is stopped.
+  Databases that don't report it (SQLite, a plain MySQL server) count as current.
+  """
+  connection = connections[alias]
+  with connection.cursor() as cursor:
+    if connection.vendor != 'mysql':
+      cursor.execute('SELECT 1')
+      return 0
+    cursor.execute('SHOW REPLICA STATUS')
+    row = cursor.fetchone()
+    if row is None:
+      return 0
+    columns = [column[0] for column in cursor.description]
+    for name in ('Seconds_Behind_Source', 'Seconds_Behind_Master'):
+      if name in columns:
+        return row[columns.index(name)]
+    return 0
+
+
+class ReplicaHealth:
+  """
+  This process's view of which replicas can take reads. A replica is probed at most
+  every `interval` seconds; one that fails the probe or lags more than `max_lag`
+  seconds is skipped until its next probe.
+  """
+  def __init__(self, interval=HEALTH_CHECK_INTERVAL, max_lag=MAX_REPLICA_LAG):
+    self.interval = interval
+    self.max_lag = max_lag
+    self._status = {}
+    self._lock = Lock()
+
+  def is_healthy(self, alias):
+    now = time.monotonic()
+    with self._lock:
+      status = self._status.get(alias)
+    if status is not None and status[0] > now:
+      return status[1]
+
+    healthy = self.probe(alias)
+    with self._lock:
+      self._status[alias] = (now + self.interval, healthy)
+    return healthy
+
+  def probe(self, alias):
+    try:
+      lag = get_replica_lag(alias)
+    except DatabaseError:
+      return False
+    return lag is not None and lag <= self.max_lag
+
+  def reset(self):
+    with self._lock:
+      self._status.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+  """
+  DATABASE_ROUTERS entry implementing the rules above. The primary is the default
+  alias; replicas get their schema through replication, never through migrate.
+  """
+  def __init__(self, replicas=None, health=None):
+    self.replicas = list(REPLICAS if replicas is None else replicas)
+    self.health = health or replica_health
+
+  def db_for_read(self, model, **hints):
+    if not self.replicas or model._meta.app_label not in ROUTED_APPS:
+      return None
+    state = _state.get()
+    if state is None or not state.use_replicas or state.wrote:
+      return DEFAULT_DB_ALIAS
+    #Reads in a transaction must see its uncommitted writes
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+      return DEFAULT_DB_ALIAS
+    return self.choose_replica()
+
+  def db_for_write(self, model, **hints):
+    return DEFAULT_DB_ALIAS
+
+  def choose_replica(self):
+    healthy = [alias for alias in self.replicas if self.health.is_healthy(alias)]
+    return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+  def allow_relation(self, obj1, obj2, **hints):
+    #Every alias holds the same data
+    aliases = {DEFAULT_DB_ALIAS, *self.replicas}
+    if obj1._state.db in aliases and obj2._state.db in aliases:
+      return True
+    return None
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):
+    if db in self.replicas:
+      return False
+    return None
+
+
+def get_pin_key(request):
+  #Token or session clients are pinned in the shared cache, so every worker sees it.
+  #A process-local cache would only pin them on the worker that handled the write.
+  if not caching.is_shared_cache():
+    return None
+  credential = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+  if not credential:
+    return None
+  return f"db:pinned:{hashlib.sha256(credential.encode('utf-8')).hexdigest()}"
+
+
+def pin_client(request, response):
+  key = get_pin_key(request)
+  if key is not None:
+    cache.set(key, 1, PIN_SECONDS)
+  #Every client also carries the pin itself; it is signed and timestamped, so it can be
+  #neither forged nor replayed after PIN_SECONDS
+  response.set_signed_cookie(PIN_COOKIE, '1', salt=PIN_COOKIE, max_age=PIN_SECONDS, httponly=True, samesite='Lax')
+
+
+def has_pin_cookie(request):
+  return request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_COOKIE, max_age=PIN_SECONDS) is not None
+
+
+def wrap_primary(stack, state):
+  stack.enter_context(connections[DEFAULT_DB_ALIAS].execute_wrapper(state))
+
+
+class ReplicaRoutingMiddleware:
+  """
+  Sets up RoutingState for each request, and pins the client to the primary after
+  an unsafe request that wrote.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = iscoroutinefunction(get_response)
+    if self.is_async:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    if not REPLICAS:
+      return self.get_response(request)
+
+    key = get_pin_key(request)
+    pinned = key is not None and cache.get(key) is not None
+    state = self.start(request, pinned)
+    token = _state.set(state)
+    try:
+      with connections[DEFAULT_DB_ALIAS].execute_wrapper(state):
+        response = self.get_response(request)
+    finally:
+      _state.reset(token)
+    return self.finish(request, response, state)
+
+  async def __acall__(self, request):
+    if not REPLICAS:
+      return await self.get_response(request)
+
+    key = get_pin_key(request)
+    pinned = key is not None and await cache.aget(key) is not None
+    state = self.start(request, pinned)
+    token = _state.set(state)
+    stack = ExitStack()
+    try:
+      #Connections are per thread: the wrapper goes on the thread that runs this request's ORM calls
+      await sync_to_async(wrap_primary)(stack, state)
+      response = await self.get_response(request)
+    finally:
+      await sync_to_async(stack.close)()
+      _state.reset(token)
+    return self.finish(request, response, state)
+
+  def start(self, request, pinned):
+    safe = request.method in SAFE_METHODS
+    return RoutingState(use_replicas=safe and not pinned and not has_pin_cookie(request))
+
+  def finish(self, request, response, state):
+    #Only unsafe requests pin: reads never write
+    if state.wrote and request.method not in SAFE_METHODS:
+      pin_client(request, response)
+    return response
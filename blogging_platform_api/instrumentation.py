@@ -0,0 +1,285 @@
+#Per-request performance instrumentation.
+#InstrumentationMiddleware measures every request: SQL query count and time (through
+#connection.execute_wrapper), serializer time, markdown/bleach render time and cache
+#hits/misses. The numbers go out in a Server-Timing header and into per-route histograms,
+#which MetricsView exposes in the Prometheus text format.
+#The work per request is a few perf_counter() calls and one short lock, so it stays on.
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+
+ENABLED = getattr(settings, 'INSTRUMENTATION_ENABLED', True)
+SERVER_TIMING = getattr(settings, 'SERVER_TIMING_HEADER', True)
+
+#Histogram buckets (seconds / queries), Prometheus-style upper bounds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+UNMATCHED_ROUTE = 'unmatched'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+  """
+  What one request spent where. Timers are keyed by name ('serialize', 'render');
+  nested timers with the same name only count once.
+  """
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.queries = 0
+    self.db_time = 0.0
+    self.timers = {}
+    self.active = set()
+    self.cache_hits = 0
+    self.cache_misses = 0
+
+  def __call__(self, execute, sql, params, many, context):
+    #connection.execute_wrapper hook
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.db_time += time.perf_counter() - start
+      self.queries += 1
+
+  def server_timing(self, total):
+    entries = [f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"']
+    for name, seconds in sorted(self.timers.items()):
+      entries.append(f'{name};dur={seconds * 1000:.1f}')
+    if self.cache_hits or self.cache_misses:
+      entries.append(f'cache;desc="{self.cache_hits} hit {self.cache_misses} miss"')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def get_current_metrics():
+  return _current.get()
+
+
+@contextmanager
+def timer(name):
+  """
+  Adds the time spent in the block to the current request's `name` timer.
+  Outside a request (commands, Celery) it does nothing.
+  """
+  metrics = _current.get()
+  if metrics is None or name in metrics.active:
+    yield
+    return
+
+  metrics.active.add(name)
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    metrics.timers[name] = metrics.timers.get(name, 0.0) + time.perf_counter() - start
+    metrics.active.discard(name)
+
+
+def record_cache(cache_name, hit):
+  #Counts a lookup in one of the project's caches for the current request and the totals
+  metrics = _current.get()
+  if metrics is not None:
+    if hit:
+      metrics.cache_hits += 1
+    else:
+      metrics.cache_misses += 1
+  registry.increment('blog_cache_requests_total', {'cache': cache_name, 'result': 'hit' if hit else 'miss'})
+
+
+class TimedSerializerMixin:
+  #Counts to_representation() towards the request's 'serialize' timer
+  def to_representation(self, instance):
+    with timer('serialize'):
+      return super().to_representation(instance)
+
+
+class Histogram:
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+
+class MetricsRegistry:
+  """
+  In-process histograms and counters keyed by (name, labels). Each worker process
+  keeps its own; Prometheus scrapes and sums them per instance.
+  """
+  HELP = {
+    'blog_request_duration_seconds': 'Time spent handling the request.',
+    'blog_db_queries': 'SQL queries per request.',
+    'blog_db_duration_seconds': 'Time spent in SQL per request.',
+    'blog_serialize_duration_seconds': 'Time spent in serializers per request.',
+    'blog_render_duration_seconds': 'Time spent rendering markdown per request.',
+    'blog_requests_total': 'Requests handled.',
+    'blog_cache_requests_total': 'Cache lookups.',
+  }
+
+  def __init__(self):
+    self._lock = Lock()
+    self.histograms = {}
+    self.counters = {}
+
+  def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      histogram = self.histograms.get(key)
+      if histogram is None:
+        histogram = self.histograms[key] = Histogram(buckets)
+      histogram.observe(value)
+
+  def increment(self, name, labels, amount=1):
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      self.counters[key] = self.counters.get(key, 0) + amount
+
+  def observe_request(self, route, method, status_code, metrics, total):
+    labels = {'route': route, 'method': method}
+    self.observe('blog_request_duration_seconds', labels, total)
+    self.observe('blog_db_queries', labels, metrics.queries, QUERY_BUCKETS)
+    self.observe('blog_db_duration_seconds', labels, metrics.db_time)
+    self.observe('blog_serialize_duration_seconds', labels, metrics.timers.get('serialize', 0.0))
+    self.observe('blog_render_duration_seconds', labels, metrics.timers.get('render', 0.0))
+    self.increment('blog_requests_total', {**labels, 'status': str(status_code)})
+
+  def reset(self):
+    with self._lock:
+      self.histograms.clear()
+      self.counters.clear()
+
+  def render(self):
+    #Prometheus text exposition format 0.0.4
+    with self._lock:
+      histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self.histograms.items()}
+      counters = dict(self.counters)
+
+    lines = []
+    described = set()
+
+    def describe(name, kind):
+      if name not in described:
+        described.add(name)
+        lines.append(f'# HELP {name} {self.HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+      describe(name, 'histogram')
+      cumulative = 0
+      for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{format_labels(labels, le=format_value(bound))} {cumulative}')
+      lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {count}')
+      lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+      lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+    for (name, labels), value in sorted(counters.items()):
+      describe(name, 'counter')
+      lines.append(f'{name}{format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape_label(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, **extra):
+  pairs = list(labels) + list(extra.items())
+  if not pairs:
+    return ''
+  return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def get_route(request):
+  #The URL pattern, not the path, so /api/posts/1/ and /api/posts/2/ share a histogram
+  match = getattr(request, 'resolver_match', None)
+  return match.route if match is not None and match.route else UNMATCHED_ROUTE
+
+
+def wrap_connections(stack, metrics):
+  for alias in connections:
+    stack.enter_context(connections[alias].execute_wrapper(metrics))
+
+
+class InstrumentationMiddleware:
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = iscoroutinefunction(get_response)
+    if self.is_async:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    if not ENABLED:
+      return self.get_response(request)
+
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+      with ExitStack() as stack:
+        wrap_connections(stack, metrics)
+        response = self.get_response(request)
+    finally:
+      _current.reset(token)
+    return self.finish(request, response, metrics)
+
+  async def __acall__(self, request):
+    if not ENABLED:
+      return await self.get_response(request)
+
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    stack = ExitStack()
+    try:
+      #Connections are per thread: the wrapper goes on the thread that runs this request's ORM calls
+      await sync_to_async(wrap_connections)(stack, metrics)
+      response = await self.get_response(request)
+    finally:
+      await sync_to_async(stack.close)()
+      _current.reset(token)
+    return self.finish(request, response, metrics)
+
+  def finish(self, request, response, metrics):
+    total = time.perf_counter() - metrics.started
+    registry.observe_request(get_route(request), request.method, response.status_code, metrics, total)
+    if SERVER_TIMING:
+      response['Server-Timing'] = metrics.server_timing(total)
+    return response
+
+
+class MetricsView(APIView):
+  """
+  Staff-only Prometheus scrape target with the per-route histograms.
+  """
+  permission_classes = [permissions.IsAdminUser]
+
+  def get(self, request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    #First, so the Server-Timing total covers the whole stack
+    'blogging_platform_api.instrumentation.InstrumentationMiddleware',
+    #Before anything that queries, so those queries are routed for this request
+    'blogging_platform_api.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,13 +62,13 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': (
       'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'posts.pagination.StandardPagination',
     'PAGE_SIZE': 10
 }
 
@@ -155,11 +160,60 @@ STATIC_URL = 'static/'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = 'notifications@blogapi.com'
 
-CELERY_BROKEN_URL = 'redis://localhost:6379/0'
-CELERY_TASK_ALWAYS_EAGER = True
+CELERY_BROKER_URL = 'redis://localhost:6379/0'
+
+#Shared by every worker process: token revocations, version counters, feed validators,
+#read-your-writes pins and cached responses must be seen by all of them (see
+#blogging_platform_api.caching). Django's default, a per-process LocMemCache, is not enough.
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/1'),
+  }
+}
+#Tasks always run on a worker; requests only record outbox events (see posts.outbox)
+CELERY_TASK_ALWAYS_EAGER = False
+
+#Periodic jobs (run with: celery -A blogging_platform_api beat)
+CELERY_BEAT_SCHEDULE = {
+  'refresh-leaderboards': {
+    'task': 'posts.tasks.refresh_leaderboards',
+    'schedule': 300.0, #Every 5 minutes
+  },
+  'drain-outbox': {
+    'task': 'posts.tasks.drain_outbox',
+    'schedule': 5.0,
+  },
+  'trim-timelines': {
+    'task': 'posts.tasks.trim_timelines',
+    'schedule': 3600.0, #Hourly
+  },
+}
 
 # Profile ImageFied settings
-import os
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+#Serve the hot read endpoints with native async views (posts.async_views).
+#asgi.py turns this on; under WSGI the sync views are faster.
+ASYNC_READ_VIEWS = os.environ.get('DJANGO_ASYNC_READ_VIEWS') == '1'
+
+#Local SQLite: DB_SQLITE=path runs the primary on a SQLite file instead of MySQL, and
+#DB_SQLITE_REPLICA=path adds a 'replica' alias on a second file, a copy of the primary
+#(e.g. sqlite3 db.sqlite3 ".backup replica.sqlite3"), to try the routing locally.
+if os.environ.get('DB_SQLITE'):
+  DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.environ['DB_SQLITE']}
+if os.environ.get('DB_SQLITE_REPLICA'):
+  #Tests get a separate test database for it (replicas are not migrated, so a test copies the schema)
+  DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.environ['DB_SQLITE_REPLICA']}
+
+#Read replicas: DB_REPLICA_HOSTS=host1,host2 adds replica1, replica2, ... as copies of
+#the default alias on those hosts. Reads are routed to them by blogging_platform_api.db_router.
+for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+  #Tests run against the primary's test database
+  DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['blogging_platform_api.db_router.PrimaryReplicaRouter']
+#Seconds a client that wrote keeps reading from the primary
+DATABASE_PIN_SECONDS = 10
@@ -1,10 +1,13 @@
 from django.contrib import admin
-from .models import Post, Category
+from .models import Post, Category, OutboxEvent
 
 # Register your models here.
 @admin.action(description="Mark selected posts as Published")
 def make_published(modeladmin, _request, queryset):
-    queryset.update(status='PB')
+    #save() each post so publish side effects (category counts, timelines) run
+    for post in queryset.exclude(status='PB'):
+        post.status = 'PB'
+        post.save()
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -16,4 +19,11 @@ class PostAdmin(admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-  list_display = ('name',)
\ No newline at end of file
+  list_display = ('name',)
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+  #Events that ran out of attempts stay unprocessed here with their last error
+  list_display = ('topic', 'created_at', 'attempts', 'processed_at', 'available_at')
+  list_filter = ('topic',)
+  readonly_fields = ('topic', 'payload', 'created_at', 'attempts', 'last_error', 'processed_at')
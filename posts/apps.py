@@ -7,3 +7,4 @@ class PostsConfig(AppConfig):
 
     def ready(self):
         import posts.signals #This triggers the connection
+        import posts.tasks #Registers the outbox handlers
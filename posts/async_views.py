@@ -0,0 +1,229 @@
+#Native async implementations of the hot read endpoints, for ASGI deployments.
+#The GET requests they cover are served on the event loop through the async ORM, which
+#stays free for other requests while one waits on the database. The queries themselves
+#are not concurrent: the async ORM runs each request's queries one at a time on that
+#request's thread, as its connection belongs to it. Everything else (writes,
+#searches, the browsable API, HEAD/OPTIONS) goes to the sync DRF view the class
+#mirrors, so responses are the same either way. posts/urls.py mounts these views
+#when ASYNC_READ_VIEWS is set, which asgi.py does.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import Post, Comment
+from .serializers import PostSerializer, PostSummarySerializer, apreload_engagement
+from .pagination import FeedPagination
+from .rendering import compute_content_hash, ensure_rendered
+from .conditional import get_feed_validators, get_post_validators, compute_etag, get_timestamp, add_validator_headers
+from .response_cache import acached_response_data
+from .directory import resolve_category_id
+from .timeline import get_timeline_feed
+from .views import GlobalFeedView, UserFeedView, PostDetailView, CategoryPostListView
+
+
+async def aprepare_posts(posts, context):
+  """
+  Loads everything serialization would otherwise need: stale renders are redone
+  in memory (rare and CPU-bound, so on a worker thread) and the user's engagement is preloaded.
+  """
+  stale = [post for post in posts if post.content_hash != compute_content_hash(post.content)]
+  if stale:
+    await sync_to_async(lambda: [ensure_rendered(post) for post in stale])()
+  return await apreload_engagement(context, posts)
+
+
+class AsyncReadView(View):
+  """
+  Base for async read views. Subclasses implement `aget()` and name the DRF view
+  they mirror in `sync_view_class`; requests outside `async_query_params` are
+  handed to it.
+  """
+  sync_view_class = None
+  async_query_params = frozenset()
+  renderer = JSONRenderer()
+
+  @classonlymethod
+  def as_view(cls, **initkwargs):
+    view = super().as_view(**initkwargs)
+    #drf-spectacular documents the route from the DRF view it mirrors
+    view.cls = cls.sync_view_class
+    view.initkwargs = {}
+    return csrf_exempt(view)
+
+  @classmethod
+  def get_sync_view(cls):
+    if '_sync_view' not in cls.__dict__:
+      cls._sync_view = cls.sync_view_class.as_view()
+    return cls._sync_view
+
+  def is_async_request(self, request):
+    return (
+      request.method == 'GET'
+      and set(request.GET) <= self.async_query_params
+      and 'text/html' not in request.headers.get('Accept', '')
+    )
+
+  async def dispatch(self, request, *args, **kwargs):
+    if not self.is_async_request(request):
+      return await sync_to_async(self.get_sync_view())(request, *args, **kwargs)
+    try:
+      return await self.get(request, *args, **kwargs)
+    except exceptions.APIException as exc:
+      return self.handle_exception(exc)
+
+  async def get(self, request, *args, **kwargs):
+    drf_request = Request(request)
+    drf_request.user, drf_request.auth = await self.authenticate(request)
+    return await self.aget(drf_request, *args, **kwargs)
+
+  async def aget(self, request, *args, **kwargs):
+    raise NotImplementedError('Async read views must implement aget()')
+
+  async def authenticate(self, request):
+    #APIClient.force_authenticate(), honoured the way DRF's Request does
+    if getattr(request, '_force_auth_user', None) is not None:
+      return request._force_auth_user, getattr(request, '_force_auth_token', None)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+      authenticator = authentication_class()
+      if hasattr(authenticator, 'aauthenticate'):
+        result = await authenticator.aauthenticate(request)
+      else:
+        result = await sync_to_async(authenticator.authenticate)(request)
+      if result is not None:
+        return result
+    return AnonymousUser(), None
+
+  def render(self, data, status=200):
+    response = HttpResponse(self.renderer.render(data), status=status, content_type='application/json')
+    #Like a DRF Response, so callers and tests can read the data back
+    response.data = data
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+  def handle_exception(self, exc):
+    #Same bodies and status codes as DRF's exception handler
+    response = self.render({'detail': exc.detail}, status=exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+      response['WWW-Authenticate'] = 'Token'
+    return response
+
+  async def conditional(self, request, validators, build):
+    #ConditionalGetMixin.get() for async views; `build` returns the full response
+    if validators is None:
+      return await build()
+
+    version, last_modified = validators
+    etag = compute_etag(version, request.user, request.get_full_path())
+    timestamp = get_timestamp(last_modified)
+    response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+    if response is None:
+      response = await build()
+    return add_validator_headers(response, etag, timestamp)
+
+
+class AsyncPostListView(AsyncReadView):
+  """
+  Paginated post listings (page numbers or keyset cursors, as in FeedPagination)
+  serialized with PostSummarySerializer.
+  """
+  pagination_class = FeedPagination
+  async_query_params = frozenset({'page', 'page_size', 'cursor', 'pagination'})
+  cursor_ordering = ('-published_at', '-id')
+  cache_anonymous = False
+
+  async def get_queryset(self, request):
+    raise NotImplementedError('Async list views must implement get_queryset()')
+
+  async def get_page(self, request, paginator):
+    queryset = await self.get_queryset(request)
+    return await paginator.apaginate_queryset(queryset, request, view=self)
+
+  async def list_data(self, request):
+    paginator = self.pagination_class()
+    page = await self.get_page(request, paginator)
+    context = await aprepare_posts(page, {'request': request, 'view': self})
+    data = PostSummarySerializer(page, many=True, context=context).data
+    return paginator.get_paginated_response(data).data
+
+  async def list(self, request):
+    if self.cache_anonymous:
+      data = await acached_response_data(request, lambda: self.list_data(request))
+    else:
+      data = await self.list_data(request)
+    return self.render(data)
+
+
+class AsyncGlobalFeedView(AsyncPostListView):
+  sync_view_class = GlobalFeedView
+  cache_anonymous = True
+
+  async def get_queryset(self, request):
+    return Post.objects.filter(status=Post.Status.PUBLISHED).select_related('author', 'category').prefetch_related('tags').order_by('-published_at', '-id')
+
+  async def aget(self, request):
+    validators = await sync_to_async(get_feed_validators)()
+    return await self.conditional(request, validators, lambda: self.list(request))
+
+
+class AsyncUserFeedView(AsyncPostListView):
+  sync_view_class = UserFeedView
+
+  async def get_queryset(self, request):
+    return Post.objects.filter(status='PB').order_by('-published_at', '-id')
+
+  async def get_page(self, request, paginator):
+    if request.user.is_superuser:
+      return await super().get_page(request, paginator)
+    #The timeline is merged with the hot-source pulls in Python (see TimelineFeed):
+    #the page is read in one trip to the request's thread, like the engagement after it
+    return await sync_to_async(
+      lambda: paginator.paginate_queryset(get_timeline_feed(request.user), request, view=self)
+    )()
+
+  async def aget(self, request):
+    if not request.user.is_authenticated:
+      raise exceptions.NotAuthenticated()
+    return await self.list(request)
+
+
+class AsyncCategoryPostListView(AsyncPostListView):
+  sync_view_class = CategoryPostListView
+  cache_anonymous = True
+
+  async def get_queryset(self, request):
+    category_id = await sync_to_async(resolve_category_id)(self.kwargs['category_name'])
+    if category_id is None:
+      return Post.objects.none()
+    return Post.objects.filter(
+      category_id=category_id, status='PB'
+    ).select_related('author', 'category').prefetch_related('tags').order_by('-published_at', '-id')
+
+  async def aget(self, request, category_name):
+    return await self.list(request)
+
+
+class AsyncPostDetailView(AsyncReadView):
+  sync_view_class = PostDetailView
+
+  async def retrieve(self, request, pk):
+    post = await Post.objects.select_related('author', 'category').prefetch_related(
+      'tags', Prefetch('comments', queryset=Comment.objects.select_related('author'))
+    ).filter(pk=pk).afirst()
+    if post is None:
+      raise exceptions.NotFound('No Post matches the given query.')
+
+    context = await aprepare_posts([post], {'request': request, 'view': self})
+    return self.render(PostSerializer(post, context=context).data)
+
+  async def aget(self, request, pk):
+    validators = await sync_to_async(get_post_validators)(pk)
+    return await self.conditional(request, validators, lambda: self.retrieve(request, pk))
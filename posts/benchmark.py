@@ -0,0 +1,512 @@
+#Endpoint benchmark: seeds a synthetic dataset with bulk_create and drives every
+#route of posts/urls.py and users/urls.py through the test client, reporting latency
+#percentiles, query counts, SQL time and response size per route as JSON.
+#Used by `manage.py benchmark`, which runs it inside a throwaway test database.
+#run_concurrency_benchmark() compares the sync and async read views under concurrent
+#load instead (`manage.py benchmark_concurrency`).
+import asyncio
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+
+import django
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, resolve, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from users.models import Profile, Follow
+from users.counters import reconcile_follow_counts
+from .models import Post, Category, Tag, Rating, Comment, CategorySubscription
+from .rendering import refresh_render
+from .counters import reconcile_post_counters, reconcile_category_counts
+from .search import rebuild_index
+from .timeline import rebuild_timeline
+from .leaderboards import refresh_all_leaderboards
+from .views import GlobalFeedView, UserFeedView, PostDetailView, CategoryPostListView
+from .async_views import AsyncGlobalFeedView, AsyncUserFeedView, AsyncPostDetailView, AsyncCategoryPostListView
+
+
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'benchmark-password'
+BATCH_SIZE = 1000
+
+DEFAULT_SIZES = {
+  'users': 200,
+  'posts': 2000,
+  'categories': 10,
+  'tags': 50,
+  'follows_per_user': 20,
+  'likes_per_post': 10,
+  'ratings_per_post': 5,
+  'comments_per_post': 3,
+}
+
+MARKDOWN_TEMPLATES = [
+  "# {title}\n\nSome *introductory* text about {topic}.\n\n- first point\n- second point\n- third point\n\n"
+  "```python\nprint('{topic}')\n```\n\nRead more at [the docs](https://example.com/{topic}).",
+  "## {title}\n\n![cover](https://example.com/{topic}.png)\n\n{topic} in practice. " + "Lorem ipsum dolor sit amet. " * 40,
+  "{title}\n\n> A quote about {topic}.\n\n1. step one\n2. step two\n\n| a | b |\n|---|---|\n| 1 | 2 |\n\n" + "More words here. " * 120,
+]
+
+
+def seed_dataset(sizes=None, seed=1):
+  """
+  Creates the synthetic dataset with bulk writes, then derives counters, the
+  search index, timelines and leaderboards exactly as production code would.
+  Returns the sizes used.
+  """
+  sizes = {**DEFAULT_SIZES, **(sizes or {})}
+  rng = random.Random(seed)
+  now = timezone.now()
+
+  password = make_password(PASSWORD)
+  User.objects.bulk_create([
+    User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password)
+    for i in range(sizes['users'])
+  ], batch_size=BATCH_SIZE)
+  user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('pk', flat=True))
+  #bulk_create skips the post_save signal that creates profiles
+  Profile.objects.bulk_create([Profile(user_id=pk) for pk in user_ids], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+  Follow.objects.bulk_create([
+    Follow(follower_id=follower, followed_user_id=followed)
+    for follower in user_ids
+    for followed in rng.sample(user_ids, min(sizes['follows_per_user'] + 1, len(user_ids)))
+    if followed != follower
+  ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+  Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(sizes['categories'])], ignore_conflicts=True)
+  Tag.objects.bulk_create([Tag(name=f'tag{i}') for i in range(sizes['tags'])], ignore_conflicts=True)
+  category_ids = list(Category.objects.values_list('pk', flat=True))
+  tag_ids = list(Tag.objects.values_list('pk', flat=True))
+
+  CategorySubscription.objects.bulk_create([
+    CategorySubscription(user_id=user_id, category_id=rng.choice(category_ids)) for user_id in user_ids
+  ], ignore_conflicts=True)
+
+  posts = []
+  for i in range(sizes['posts']):
+    topic = f'topic{rng.randrange(100)}'
+    published = rng.random() < 0.9
+    post = Post(
+      title=f'Benchmark post {i} about {topic}',
+      content=rng.choice(MARKDOWN_TEMPLATES).format(title=f'Post {i}', topic=topic),
+      author_id=rng.choice(user_ids),
+      category_id=rng.choice(category_ids) if category_ids else None,
+      status=Post.Status.PUBLISHED if published else Post.Status.DRAFT,
+      published_at=now - timedelta(minutes=rng.randrange(60 * 24 * 60)) if published else None,
+    )
+    refresh_render(post) #Store the render up front, as Post.save() would
+    posts.append(post)
+  Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+  post_ids = list(Post.objects.values_list('pk', flat=True))
+
+  PostTag = Post.tags.through
+  PostTag.objects.bulk_create([
+    PostTag(post_id=post_id, tag_id=tag_id)
+    for post_id in post_ids
+    for tag_id in rng.sample(tag_ids, min(3, len(tag_ids)))
+  ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+  PostLike = Post.likes.through
+  PostLike.objects.bulk_create([
+    PostLike(post_id=post_id, user_id=user_id)
+    for post_id in post_ids
+    for user_id in rng.sample(user_ids, min(rng.randrange(sizes['likes_per_post'] * 2 + 1), len(user_ids)))
+  ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+  Rating.objects.bulk_create([
+    Rating(post_id=post_id, user_id=user_id, score=rng.randint(1, 5))
+    for post_id in post_ids
+    for user_id in rng.sample(user_ids, min(rng.randrange(sizes['ratings_per_post'] * 2 + 1), len(user_ids)))
+  ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+  Comment.objects.bulk_create([
+    Comment(post_id=post_id, author_id=rng.choice(user_ids), content=f'Comment {n} on post {post_id}')
+    for post_id in post_ids
+    for n in range(rng.randrange(sizes['comments_per_post'] * 2 + 1))
+  ], batch_size=BATCH_SIZE)
+
+  #Derived data, built by the same code paths production uses
+  reconcile_post_counters()
+  reconcile_category_counts()
+  reconcile_follow_counts()
+  rebuild_index()
+  for user_id in user_ids:
+    rebuild_timeline(user_id)
+  refresh_all_leaderboards()
+  return sizes
+
+
+class Scenario:
+  """
+  One benchmarked request. `url` and `data` are callables taking the context, so
+  they can pick (or create, outside the timed section) the objects they need.
+  """
+  def __init__(self, label, url_name, method='get', url=None, data=None, auth=True):
+    self.label = label
+    self.url_name = url_name
+    self.method = method
+    self.url = url or (lambda ctx: reverse(url_name))
+    self.data = data or (lambda ctx: None)
+    self.auth = auth
+
+
+def _create_comment(ctx):
+  comment = Comment.objects.create(post_id=ctx['post'].pk, author=ctx['user'], content='Benchmark comment')
+  return reverse('comment-detail', kwargs={'pk': comment.pk})
+
+
+def _next_username(ctx):
+  ctx['registered'] = ctx.get('registered', 0) + 1
+  return {'username': f"newbench{ctx['registered']}", 'email': f"newbench{ctx['registered']}@example.com", 'password': PASSWORD}
+
+
+SCENARIOS = [
+  #posts/urls.py
+  Scenario('GET post-list (anonymous)', 'post-list', auth=False),
+  Scenario('GET post-list', 'post-list'),
+  Scenario('POST post-list', 'post-list', 'post', data=lambda ctx: {'title': 'Benchmark draft', 'content': '# Draft\n\nBody', 'category': ctx['category'].name}),
+  Scenario('GET post-detail', 'post-detail', url=lambda ctx: reverse('post-detail', kwargs={'pk': ctx['post'].pk})),
+  Scenario('PATCH post-detail', 'post-detail', 'patch', url=lambda ctx: reverse('post-detail', kwargs={'pk': ctx['own_post'].pk}),
+           data=lambda ctx: {'title': f'Edited {time.perf_counter()}'}),
+  Scenario('GET post-comments', 'post-comments', url=lambda ctx: reverse('post-comments', kwargs={'post_pk': ctx['post'].pk})),
+  Scenario('POST post-comments', 'post-comments', 'post', url=lambda ctx: reverse('post-comments', kwargs={'post_pk': ctx['post'].pk}),
+           data=lambda ctx: {'content': 'Benchmark comment'}),
+  Scenario('GET comment-detail', 'comment-detail', url=lambda ctx: reverse('comment-detail', kwargs={'pk': ctx['comment'].pk})),
+  Scenario('DELETE comment-detail', 'comment-detail', 'delete', url=_create_comment),
+  Scenario('POST post-like', 'post-like', 'post', url=lambda ctx: reverse('post-like', kwargs={'pk': ctx['post'].pk})),
+  Scenario('POST post-rate', 'post-rate', 'post', url=lambda ctx: reverse('post-rate', kwargs={'pk': ctx['post'].pk}),
+           data=lambda ctx: {'score': random.randint(1, 5)}),
+  Scenario('POST post-engagement', 'post-engagement', 'post', data=lambda ctx: {'operations': [
+    {'post': pk, 'action': random.choice(['like', 'unlike'])} for pk in ctx['post_ids'][:50]
+  ] + [{'post': pk, 'action': 'rate', 'score': random.randint(1, 5)} for pk in ctx['post_ids'][50:100]]}),
+  Scenario('GET top-posts', 'top-posts', auth=False),
+  Scenario('POST post-share', 'post-share', 'post', url=lambda ctx: reverse('post-share', kwargs={'pk': ctx['post'].pk}),
+           data=lambda ctx: {'recipient_email': 'friend@example.com', 'sender_name': 'Bench'}),
+  Scenario('POST post-publish', 'post-publish', 'post', url=lambda ctx: reverse('post-publish', kwargs={'pk': ctx['own_post'].pk})),
+  Scenario('GET category-list', 'category-list', auth=False),
+  Scenario('POST category-subscribe', 'category-subscribe', 'post',
+           url=lambda ctx: reverse('category-subscribe', kwargs={'category_id': ctx['category'].pk})),
+  Scenario('GET category-posts', 'category-posts', auth=False,
+           url=lambda ctx: reverse('category-posts', kwargs={'category_name': ctx['category'].name})),
+  Scenario('GET user-feed', 'user-feed'),
+  Scenario('GET explore (anonymous)', 'explore', auth=False),
+  Scenario('GET explore', 'explore'),
+  Scenario('GET explore?search', 'explore', url=lambda ctx: reverse('explore') + '?search=practice'),
+  Scenario('GET my-drafts', 'my-drafts'),
+  Scenario('GET schema', 'schema', auth=False),
+  Scenario('GET swagger-ui', 'swagger-ui', auth=False),
+  Scenario('GET redoc', 'redoc', auth=False),
+  #users/urls.py
+  Scenario('POST register', 'register', 'post', data=_next_username, auth=False),
+  Scenario('POST api-token-auth', 'api-token-auth', 'post', auth=False,
+           data=lambda ctx: {'username': ctx['user'].username, 'password': PASSWORD}),
+  Scenario('GET user-profile', 'user-profile'),
+  Scenario('GET profile-detail', 'profile-detail', auth=False,
+           url=lambda ctx: reverse('profile-detail', kwargs={'username': ctx['popular'].username})),
+  Scenario('POST user-follow', 'user-follow', 'post', url=lambda ctx: reverse('user-follow', kwargs={'username': ctx['popular'].username})),
+  Scenario('GET profile-posts', 'profile-posts', auth=False,
+           url=lambda ctx: reverse('profile-posts', kwargs={'username': ctx['popular'].username})),
+  Scenario('GET profile-followers', 'profile-followers', auth=False,
+           url=lambda ctx: reverse('profile-followers', kwargs={'username': ctx['popular'].username})),
+  Scenario('GET profile-following', 'profile-following', auth=False,
+           url=lambda ctx: reverse('profile-following', kwargs={'username': ctx['user'].username})),
+  Scenario('GET user-list', 'user-list', auth=False),
+]
+
+
+def build_context():
+  """
+  Picks the objects the scenarios act on: the user with the most followers and
+  a well-connected viewer, a popular published post, one of the viewer's own posts...
+  """
+  bench_users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+  popular = bench_users.order_by('-profile__followers_count', 'pk').first()
+  user = bench_users.order_by('-profile__following_count', 'pk').first()
+  post = Post.objects.filter(status=Post.Status.PUBLISHED).order_by('-comment_count', 'pk').first()
+  own_post = Post.objects.filter(author=user).order_by('pk').first() or Post.objects.create(
+    title='Viewer post', content='Body', author=user
+  )
+  return {
+    'user': user,
+    'popular': popular,
+    'token': Token.objects.get_or_create(user=user)[0].key,
+    'post': post,
+    'own_post': own_post,
+    'comment': Comment.objects.filter(post=post).order_by('pk').first() or Comment.objects.create(post=post, author=user, content='Hi'),
+    'category': Category.objects.order_by('-post_count', 'pk').first(),
+    'post_ids': list(Post.objects.filter(status=Post.Status.PUBLISHED).order_by('pk').values_list('pk', flat=True)[:100]),
+  }
+
+
+def percentile(values, pct):
+  #Nearest-rank percentile
+  ordered = sorted(values)
+  if not ordered:
+    return 0.0
+  return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def get_response_size(response):
+  if getattr(response, 'streaming', False):
+    return sum(len(chunk) for chunk in response.streaming_content)
+  return len(response.content)
+
+
+def run_scenario(scenario, ctx, iterations, warmup):
+  client = APIClient()
+  if scenario.auth:
+    client.credentials(HTTP_AUTHORIZATION=f"Token {ctx['token']}")
+  send = getattr(client, scenario.method)
+
+  timings, queries, sql_times, sizes, statuses = [], [], [], [], set()
+  for run in range(warmup + iterations):
+    url = scenario.url(ctx)
+    data = scenario.data(ctx)
+    kwargs = {'format': 'json'} if data is not None else {}
+
+    with CaptureQueriesContext(connection) as captured:
+      start = time.perf_counter()
+      response = send(url, data, **kwargs) if data is not None else send(url)
+      size = get_response_size(response)
+      elapsed = time.perf_counter() - start
+
+    if run < warmup:
+      continue
+    timings.append(elapsed * 1000)
+    queries.append(len(captured.captured_queries))
+    sql_times.append(sum(float(query['time']) for query in captured.captured_queries) * 1000)
+    sizes.append(size)
+    statuses.add(response.status_code)
+
+  return {
+    'url_name': scenario.url_name,
+    'method': scenario.method.upper(),
+    'status': sorted(statuses),
+    'p50_ms': round(percentile(timings, 50), 3),
+    'p95_ms': round(percentile(timings, 95), 3),
+    'p99_ms': round(percentile(timings, 99), 3),
+    'mean_ms': round(sum(timings) / len(timings), 3),
+    'queries': round(sum(queries) / len(queries), 2),
+    'sql_ms': round(sum(sql_times) / len(sql_times), 3),
+    'bytes': round(sum(sizes) / len(sizes)),
+  }
+
+
+def iter_routes(patterns, prefix=''):
+  for pattern in patterns:
+    if isinstance(pattern, URLResolver):
+      yield from iter_routes(pattern.url_patterns, prefix + str(pattern.pattern))
+    elif isinstance(pattern, URLPattern):
+      yield prefix + str(pattern.pattern)
+
+
+def get_uncovered_routes(scenarios, ctx):
+  #Routes of the two API apps that no scenario exercises
+  import posts.urls
+  import users.urls
+  prefix = 'api/'
+  routes = {prefix + route for module in (posts.urls, users.urls) for route in iter_routes(module.urlpatterns)}
+  covered = {resolve(scenario.url(ctx).split('?')[0]).route for scenario in scenarios}
+  return sorted(routes - covered)
+
+
+def run_benchmark(iterations=20, warmup=2, scenarios=None, only=None, sizes=None):
+  scenarios = scenarios or SCENARIOS
+  if only:
+    scenarios = [scenario for scenario in scenarios if any(name in scenario.label for name in only)]
+
+  cache.clear()
+  ctx = build_context()
+  routes = {scenario.label: run_scenario(scenario, ctx, iterations, warmup) for scenario in scenarios}
+
+  return {
+    'meta': {
+      'created_at': timezone.now().isoformat(),
+      'database': connection.vendor,
+      'django': django.get_version(),
+      'iterations': iterations,
+      'warmup': warmup,
+      'dataset': sizes or {},
+      'uncovered_routes': get_uncovered_routes(scenarios, ctx) if not only else [],
+    },
+    'routes': routes,
+  }
+
+
+#Latency changes smaller than this are timer noise on sub-millisecond routes
+MIN_LATENCY_DELTA_MS = 1.0
+
+
+def compare_reports(baseline, current, threshold=0.10):
+  """
+  Compares two reports route by route. Returns a list of
+  (label, metric, before, after, change, regressed) rows; latency and size regress
+  when they grew by more than `threshold`, query counts regress on any increase.
+  """
+  rows = []
+  for label, after in current['routes'].items():
+    before = baseline['routes'].get(label)
+    if before is None:
+      continue
+    for metric in ('p50_ms', 'p95_ms', 'queries', 'bytes'):
+      old, new = before[metric], after[metric]
+      change = (new - old) / old if old else 0.0
+      if metric == 'queries':
+        regressed = new > old
+      elif metric == 'bytes':
+        regressed = change > threshold
+      else:
+        regressed = change > threshold and new - old > MIN_LATENCY_DELTA_MS
+      rows.append((label, metric, old, new, change, regressed))
+  return rows
+
+
+#(url name, sync view, async view, url kwargs from the context)
+CONCURRENCY_ROUTES = [
+  ('user-feed', UserFeedView, AsyncUserFeedView, lambda ctx: {}),
+  ('explore', GlobalFeedView, AsyncGlobalFeedView, lambda ctx: {}),
+  ('category-posts', CategoryPostListView, AsyncCategoryPostListView, lambda ctx: {'category_name': ctx['category'].name}),
+  ('post-detail', PostDetailView, AsyncPostDetailView, lambda ctx: {'pk': ctx['post'].pk}),
+]
+
+
+def delay_queries(seconds):
+  #execute_wrapper adding a network round trip to every query, as against a remote database
+  def wrapper(execute, sql, params, many, context):
+    time.sleep(seconds)
+    return execute(sql, params, many, context)
+  return wrapper
+
+
+def wrap_connection(stack, latency):
+  #Runs on the thread that will execute the request's queries
+  if latency:
+    stack.enter_context(connection.execute_wrapper(delay_queries(latency)))
+
+
+def build_jobs(ctx, routes, total, mode):
+  """
+  Round-robins `total` authenticated GETs over the routes, as (view, request, kwargs)
+  for the sync or async view. Authenticated, so the anonymous response cache stays out of it.
+  """
+  factory = RequestFactory()
+  views = {}
+  jobs = []
+  for i in range(total):
+    url_name, sync_view, async_view, get_kwargs = routes[i % len(routes)]
+    view_class = async_view if mode == 'async' else sync_view
+    if view_class not in views:
+      views[view_class] = view_class.as_view()
+    kwargs = get_kwargs(ctx)
+    request = factory.get(reverse(url_name, kwargs=kwargs), HTTP_AUTHORIZATION=f"Token {ctx['token']}")
+    jobs.append((views[view_class], request, kwargs))
+  return jobs
+
+
+def run_sync_jobs(jobs, concurrency, latency):
+  #WSGI: one worker thread per in-flight request
+  def handle(job):
+    view, request, kwargs = job
+    start = time.perf_counter()
+    with ExitStack() as stack:
+      wrap_connection(stack, latency)
+      response = view(request, **kwargs)
+      response.render()
+    close_old_connections()
+    return time.perf_counter() - start, response.status_code
+
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    return list(pool.map(handle, jobs))
+
+
+async def run_async_jobs(jobs, concurrency, latency):
+  #ASGI: every request on one event loop, each in its own ThreadSensitiveContext like ASGIHandler
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def handle(job):
+    view, request, kwargs = job
+    async with semaphore, ThreadSensitiveContext():
+      start = time.perf_counter()
+      stack = ExitStack()
+      try:
+        await sync_to_async(wrap_connection)(stack, latency)
+        response = await view(request, **kwargs)
+      finally:
+        await sync_to_async(stack.close)()
+        await sync_to_async(close_old_connections)()
+      return time.perf_counter() - start, response.status_code
+
+  return await asyncio.gather(*[handle(job) for job in jobs])
+
+
+def run_event_loop(coroutine):
+  #The loop gets a thread of its own, as under an ASGI server. Under async_to_sync() every
+  #thread-sensitive ORM call would be sent back to the calling thread, serializing them all.
+  with ThreadPoolExecutor(max_workers=1) as loop_thread:
+    return loop_thread.submit(asyncio.run, coroutine).result()
+
+
+def summarize_run(results, wall):
+  timings = [elapsed * 1000 for elapsed, _ in results]
+  return {
+    'requests': len(results),
+    'status': sorted({status for _, status in results}),
+    'wall_s': round(wall, 3),
+    'throughput_rps': round(len(results) / wall, 1) if wall else 0.0,
+    'p50_ms': round(percentile(timings, 50), 3),
+    'p95_ms': round(percentile(timings, 95), 3),
+    'p99_ms': round(percentile(timings, 99), 3),
+  }
+
+
+def run_concurrency_benchmark(requests=200, concurrency=20, latency_ms=0.0, only=None):
+  """
+  Sends the same mix of feed/detail GETs through the sync views on a thread pool
+  and through the async views on one event loop, `concurrency` at a time, and
+  reports wall time, throughput and latency percentiles per mode.
+  latency_ms adds a simulated database round trip to every query.
+  """
+  routes = CONCURRENCY_ROUTES
+  if only:
+    routes = [route for route in routes if any(name in route[0] for name in only)]
+
+  ctx = build_context()
+  latency = latency_ms / 1000
+  runners = {
+    'sync': lambda jobs: run_sync_jobs(jobs, concurrency, latency),
+    'async': lambda jobs: run_event_loop(run_async_jobs(jobs, concurrency, latency)),
+  }
+
+  modes = {}
+  for mode, run in runners.items():
+    cache.clear()
+    jobs = build_jobs(ctx, routes, requests, mode)
+    start = time.perf_counter()
+    results = run(jobs)
+    modes[mode] = summarize_run(results, time.perf_counter() - start)
+
+  return {
+    'meta': {
+      'created_at': timezone.now().isoformat(),
+      'database': connection.vendor,
+      'django': django.get_version(),
+      'requests': requests,
+      'concurrency': concurrency,
+      'latency_ms': latency_ms,
+      'routes': [route[0] for route in routes],
+    },
+    'modes': modes,
+  }
@@ -0,0 +1,139 @@
+#Conditional GET (ETag / Last-Modified) for endpoints that clients poll.
+#Validators are computed from a single indexed lookup (or a cache read) before
+#any serialization, so an unchanged resource is answered with 304 Not Modified.
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from blogging_platform_api import caching
+
+from .models import Post
+from .rendering import get_render_policy
+from .directory import get_version as get_category_version
+
+
+WATERMARK_KEY = 'feed:watermark'
+
+#Stored renders are re-derived when the policy changes, so it is part of every validator
+RENDER_FINGERPRINT = hashlib.sha1(get_render_policy().encode('utf-8')).hexdigest()[:12]
+
+
+def get_feed_watermark():
+  """
+  Timestamp of the last change to any post visible in the feeds.
+  A cold cache starts a new watermark, which only costs one full response per client.
+  """
+  watermark = cache.get(WATERMARK_KEY)
+  if watermark is None:
+    cache.add(WATERMARK_KEY, time.time(), None)
+    watermark = cache.get(WATERMARK_KEY, time.time())
+  return watermark
+
+
+def bump_feed_watermark():
+  cache.set(WATERMARK_KEY, time.time(), None)
+
+
+def touch_post(post_id):
+  #Marks a post (and the feeds) as changed without loading it
+  Post.objects.filter(pk=post_id).update(updated_at=timezone.now())
+  bump_feed_watermark()
+
+
+def get_post_validators(post_id):
+  #(version, last_modified) from the post's updated_at, or None when it does not exist
+  updated_at = Post.objects.filter(pk=post_id).values_list('updated_at', flat=True).first()
+  if updated_at is None:
+    return None
+  return f'post:{post_id}:{updated_at.isoformat()}:{get_category_version()}', updated_at
+
+
+def get_feed_validators():
+  """
+  (version, last_modified) from the feed watermark: a cache read, no query at all.
+  A process-local cache would only hold this process's bumps, so without a shared
+  cache the version is derived from the posts instead: edits, counters and publishing
+  move the latest updated_at, deletions the count. Deletions leave the latest
+  updated_at alone, so there is no Last-Modified then.
+  """
+  if not caching.is_shared_cache():
+    state = Post.objects.aggregate(latest=Max('updated_at'), count=Count('pk'))
+    latest = state['latest'].isoformat() if state['latest'] else None
+    return f"feed:{latest}:{state['count']}:{get_category_version()}", None
+
+  watermark = get_feed_watermark()
+  last_modified = datetime.fromtimestamp(watermark, tz=dt_timezone.utc)
+  return f'feed:{watermark}:{get_category_version()}', last_modified
+
+
+def compute_etag(version, user, full_path):
+  user_key = user.pk if user.is_authenticated else 'anon'
+  source = f'{version}|{user_key}|{full_path}|{RENDER_FINGERPRINT}'
+  return quote_etag(hashlib.sha1(source.encode('utf-8')).hexdigest())
+
+
+def get_timestamp(last_modified):
+  return int(last_modified.timestamp()) if last_modified else None
+
+
+def add_validator_headers(response, etag, timestamp):
+  if response.status_code in (200, 304):
+    response.headers['ETag'] = etag
+    if timestamp is not None:
+      response.headers['Last-Modified'] = http_date(timestamp)
+    #Clients may keep the body but must revalidate it on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+  return response
+
+
+class ConditionalGetMixin:
+  """
+  Adds ETag / Last-Modified validators to a GET endpoint.
+
+  Views implement get_validators() and return (version, last_modified) for the
+  current request, or None when the resource cannot be validated cheaply (e.g.
+  it does not exist), in which case the request is served normally.
+  The ETag also covers the query string and the requesting user, since
+  responses carry per-user fields such as has_liked.
+  """
+
+  def get_validators(self):
+    raise NotImplementedError('Views using ConditionalGetMixin must implement get_validators()')
+
+  def get(self, request, *args, **kwargs):
+    validators = self.get_validators()
+    if validators is None:
+      return super().get(request, *args, **kwargs)
+
+    version, last_modified = validators
+    etag = compute_etag(version, request.user, request.get_full_path())
+    timestamp = get_timestamp(last_modified)
+
+    response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+    if response is None:
+      response = super().get(request, *args, **kwargs)
+    return add_validator_headers(response, etag, timestamp)
+
+
+class PostValidatorsMixin(ConditionalGetMixin):
+  """
+  Validators from the post's updated_at, which is bumped by edits, counter
+  changes and comment activity. The post is read by primary key only.
+  """
+  post_url_kwarg = 'pk'
+
+  def get_validators(self):
+    return get_post_validators(self.kwargs[self.post_url_kwarg])
+
+
+class FeedValidatorsMixin(ConditionalGetMixin):
+  #Validators from the feed watermark: a cache read, no query at all
+  def get_validators(self):
+    return get_feed_validators()
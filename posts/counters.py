@@ -0,0 +1,140 @@
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Post, Comment, Rating, Category
+from .directory import bump_version
+from .conditional import bump_feed_watermark
+
+
+RATING_SCORES = range(1, 6)
+
+
+def adjust_post_counters(post_id, **deltas):
+  """
+  Atomically applies deltas to the denormalized counters of a post,
+  e.g. adjust_post_counters(post.id, like_count=1).
+  Uses F() expressions so concurrent requests never lose an update.
+  Also bumps updated_at, so conditional GETs see the new counts.
+  """
+  changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+  if not changes:
+    return 0
+  updated = Post.objects.filter(pk=post_id).update(updated_at=timezone.now(), **changes)
+  bump_feed_watermark()
+  return updated
+
+
+def bulk_adjust_post_counters(deltas_by_post):
+  """
+  Applies counter deltas for many posts in a single UPDATE, e.g.
+  bulk_adjust_post_counters({1: {'like_count': 1}, 2: {'like_count': -1, 'rating_count': 1}}).
+  """
+  deltas_by_post = {pk: {f: d for f, d in deltas.items() if d} for pk, deltas in deltas_by_post.items()}
+  deltas_by_post = {pk: deltas for pk, deltas in deltas_by_post.items() if deltas}
+  if not deltas_by_post:
+    return 0
+
+  fields = {field for deltas in deltas_by_post.values() for field in deltas}
+  changes = {
+    field: F(field) + Case(
+      *[When(pk=pk, then=Value(deltas[field])) for pk, deltas in deltas_by_post.items() if field in deltas],
+      default=Value(0),
+    )
+    for field in fields
+  }
+  updated = Post.objects.filter(pk__in=list(deltas_by_post)).update(updated_at=timezone.now(), **changes)
+  bump_feed_watermark()
+  return updated
+
+
+def adjust_category_post_count(category_id, delta):
+  #Keeps Category.post_count (published posts) current and retires the cached directory
+  if not category_id or not delta:
+    return 0
+  updated = Category.objects.filter(pk=category_id).update(post_count=F('post_count') + delta)
+  bump_version()
+  return updated
+
+
+def get_rating_deltas(old_score, new_score):
+  """
+  Counter deltas for a rating going from old_score to new_score
+  (old_score is None for a new rating, new_score is None for a removed one).
+  """
+  deltas = {}
+  if old_score == new_score:
+    return deltas
+
+  deltas['rating_count'] = (new_score is not None) - (old_score is not None)
+  deltas['rating_sum'] = (new_score or 0) - (old_score or 0)
+  if old_score is not None:
+    deltas[f'rating_{old_score}'] = -1
+  if new_score is not None:
+    deltas[f'rating_{new_score}'] = 1
+  return deltas
+
+
+def get_actual_counters():
+  """
+  Subqueries computing every denormalized counter from its source table.
+  """
+  def count_of(queryset):
+    return Coalesce(Subquery(queryset.values('post_id').annotate(c=Count('*')).values('c')), 0)
+
+  ratings = Rating.objects.filter(post_id=OuterRef('pk'))
+  actual = {
+    'like_count': count_of(Post.likes.through.objects.filter(post_id=OuterRef('pk'))),
+    'comment_count': count_of(Comment.objects.filter(post_id=OuterRef('pk'))),
+    'rating_count': count_of(ratings),
+    'rating_sum': Coalesce(Subquery(ratings.values('post_id').annotate(s=Sum('score')).values('s')), 0),
+  }
+  for score in RATING_SCORES:
+    actual[f'rating_{score}'] = count_of(ratings.filter(score=score))
+  return actual
+
+
+def reconcile_post_counters(queryset=None, batch_size=1000):
+  """
+  Recomputes the like, comment and rating counters from the source tables and
+  repairs any post whose stored counters drifted. Returns the number of repaired posts.
+  """
+  actual = get_actual_counters()
+  fields = list(actual)
+
+  queryset = queryset if queryset is not None else Post.objects.all()
+  drifted = queryset.annotate(
+    **{f'actual_{field}': expression for field, expression in actual.items()}
+  ).exclude(
+    **{field: F(f'actual_{field}') for field in fields}
+  ).values_list('pk', *[f'actual_{field}' for field in fields])
+
+  now = timezone.now()
+  repaired = []
+  for pk, *values in drifted.iterator(chunk_size=batch_size):
+    repaired.append(Post(pk=pk, updated_at=now, **dict(zip(fields, values))))
+
+  Post.objects.bulk_update(repaired, fields + ['updated_at'], batch_size=batch_size)
+  if repaired:
+    bump_feed_watermark()
+  return len(repaired)
+
+
+def reconcile_category_counts(batch_size=1000):
+  """
+  Recomputes Category.post_count from the published posts and repairs drift.
+  Returns the number of repaired categories.
+  """
+  published = Post.objects.filter(
+    category_id=OuterRef('pk'), status=Post.Status.PUBLISHED
+  ).values('category_id').annotate(c=Count('*')).values('c')
+
+  drifted = Category.objects.annotate(
+    actual=Coalesce(Subquery(published), 0)
+  ).exclude(post_count=F('actual')).values_list('pk', 'actual')
+
+  repaired = [Category(pk=pk, post_count=actual) for pk, actual in drifted]
+  Category.objects.bulk_update(repaired, ['post_count'], batch_size=batch_size)
+  if repaired:
+    bump_version()
+  return len(repaired)
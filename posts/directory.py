@@ -0,0 +1,46 @@
+from django.core.cache import cache
+
+from blogging_platform_api import caching
+from blogging_platform_api.instrumentation import record_cache
+
+from .models import Category
+
+
+#The category directory is small and rarely changes, so the whole list is cached.
+#Every change bumps the version, which retires the previous cache entry at once.
+#Only a shared cache sees every process's bumps; a process-local one keeps the
+#directory for a few seconds, and names it doesn't know yet are looked up directly.
+VERSION_KEY = 'categories:version'
+DIRECTORY_TIMEOUT = 60 * 60
+
+
+def get_version():
+  return caching.get_version(VERSION_KEY)
+
+
+def bump_version():
+  caching.bump_version(VERSION_KEY)
+
+
+def get_category_directory():
+  """
+  Returns every category as a list of {'id', 'name', 'post_count'} dicts.
+  """
+  key = f'categories:directory:{get_version()}'
+  directory = cache.get(key)
+  record_cache('directory', directory is not None)
+  if directory is None:
+    directory = list(Category.objects.order_by('id').values('id', 'name', 'post_count'))
+    timeout = DIRECTORY_TIMEOUT if caching.is_shared_cache() else caching.LOCAL_VERSION_TIMEOUT
+    cache.set(key, directory, timeout)
+  return directory
+
+
+def resolve_category_id(name):
+  #Case-insensitive name -> id lookup served from the cached directory
+  lowered = name.lower()
+  for category in get_category_directory():
+    if category['name'].lower() == lowered:
+      return category['id']
+  #A category created or renamed moments ago may not be in this copy yet
+  return Category.objects.filter(name__iexact=name).values_list('id', flat=True).first()
@@ -0,0 +1,145 @@
+#Batch application of likes, unlikes and ratings (used by BulkEngagementView).
+#A batch costs a fixed number of set-based queries however many operations it holds:
+#read the posts and the user's current likes/ratings, insert, delete, update, and one
+#aggregate counter UPDATE. Counter deltas follow the rows this batch actually
+#inserted or deleted, never rows a concurrent request wrote in the meantime.
+from collections import defaultdict
+
+from django.db import transaction, IntegrityError
+from django.db.models import Case, Value, When
+
+from .models import Post, Rating
+from .counters import bulk_adjust_post_counters, get_rating_deltas, reconcile_post_counters
+from . import outbox
+
+
+LIKE = 'like'
+UNLIKE = 'unlike'
+RATE = 'rate'
+ACTIONS = (LIKE, UNLIKE, RATE)
+MAX_OPERATIONS = 500
+
+
+def insert_rows(model, user, objs):
+  """
+  Inserts the user's `objs` (one per post) and returns the post ids of the rows
+  that existed already. A row created by a concurrent request since the locked
+  read makes the INSERT fail; those rows are re-read (and locked) and the INSERT
+  is retried without them, as RatePostView does for a single rating.
+  """
+  conflicts = set()
+  while objs:
+    try:
+      with transaction.atomic():
+        model.objects.bulk_create(objs)
+      break
+    except IntegrityError:
+      existing = set(
+        model.objects.select_for_update().filter(user_id=user.pk, post_id__in=[obj.post_id for obj in objs]).values_list('post_id', flat=True)
+      )
+      if not existing:
+        raise
+      conflicts |= existing
+      objs = [obj for obj in objs if obj.post_id not in existing]
+  return conflicts
+
+
+def apply_engagement(user, operations):
+  """
+  Applies [{'post': id, 'action': 'like'|'unlike'|'rate', 'score': n}, ...] for the user.
+  Later operations on the same post win. Returns one result per operation, in order,
+  with that operation's own outcome: whether it changed anything ('applied') and the
+  like or score it left behind, as if the batch had been applied one operation at a time.
+  """
+  post_ids = {op['post'] for op in operations}
+  PostLike = Post.likes.through
+
+  with transaction.atomic():
+    posts = Post.objects.select_related('author').in_bulk(list(post_ids))
+
+    #Final desired state per post
+    wanted_likes = {}
+    wanted_scores = {}
+    for op in operations:
+      if op['post'] not in posts:
+        continue
+      if op['action'] == RATE:
+        wanted_scores[op['post']] = op['score']
+      else:
+        wanted_likes[op['post']] = op['action'] == LIKE
+
+    deltas = defaultdict(dict)
+
+    #Likes: insert the missing rows and delete the unwanted ones, both set-based
+    liked = set(
+      PostLike.objects.select_for_update().filter(user_id=user.pk, post_id__in=list(wanted_likes)).values_list('post_id', flat=True)
+    )
+    to_like = [pk for pk, wanted in wanted_likes.items() if wanted and pk not in liked]
+    to_unlike = [pk for pk, wanted in wanted_likes.items() if not wanted and pk in liked]
+
+    already_liked = insert_rows(PostLike, user, [PostLike(user_id=user.pk, post_id=pk) for pk in to_like])
+    #The rows to delete were locked by the read above. Should some be gone anyway (a
+    #backend without row locks), those posts are recounted instead of guessed
+    unliked, _ = PostLike.objects.filter(user_id=user.pk, post_id__in=to_unlike).delete()
+    recount = [] if unliked == len(to_unlike) else to_unlike
+    for pk in to_like:
+      if pk not in already_liked:
+        deltas[pk]['like_count'] = 1
+    if not recount:
+      for pk in to_unlike:
+        deltas[pk]['like_count'] = -1
+
+    #Ratings: new ones in one INSERT, changed ones in one UPDATE ... CASE
+    current = dict(
+      Rating.objects.select_for_update().filter(user_id=user.pk, post_id__in=list(wanted_scores)).values_list('post_id', 'score')
+    )
+    new = [Rating(user_id=user.pk, post_id=pk, score=score) for pk, score in wanted_scores.items() if pk not in current]
+    changed = {pk: score for pk, score in wanted_scores.items() if pk in current and current[pk] != score}
+
+    #Ratings created meanwhile are updated instead, from the score they now hold
+    if new:
+      rated = insert_rows(Rating, user, new)
+      if rated:
+        current.update(Rating.objects.filter(user_id=user.pk, post_id__in=list(rated)).values_list('post_id', 'score'))
+        changed.update({pk: wanted_scores[pk] for pk in rated if current[pk] != wanted_scores[pk]})
+    if changed:
+      Rating.objects.filter(user_id=user.pk, post_id__in=list(changed)).update(
+        score=Case(*[When(post_id=pk, then=Value(score)) for pk, score in changed.items()])
+      )
+    for pk, score in wanted_scores.items():
+      deltas[pk].update(get_rating_deltas(current.get(pk), score))
+
+    bulk_adjust_post_counters(deltas)
+    if recount:
+      reconcile_post_counters(Post.objects.filter(pk__in=recount))
+
+    #bulk_create/update skip post_save, so record the five-star notifications here
+    for pk, score in wanted_scores.items():
+      post = posts[pk]
+      if score == 5 and current.get(pk) != 5 and post.status == Post.Status.PUBLISHED and post.author.email:
+        outbox.enqueue(
+          outbox.RATING_FIVE_STAR,
+          author_email=post.author.email,
+          author_username=post.author.username,
+          post_title=post.title,
+        )
+
+  #Replay the operations over the state found before the batch (rows created
+  #meanwhile included), so a like followed by an unlike reports both steps
+  has_liked = {pk: pk in liked or pk in already_liked for pk in wanted_likes}
+  scores = {pk: current.get(pk) for pk in wanted_scores}
+  results = []
+  for op in operations:
+    pk = op['post']
+    result = {'post': pk, 'action': op['action']}
+    if pk not in posts:
+      result['status'] = 'not_found'
+    elif op['action'] == RATE:
+      result.update(status='ok', applied=scores[pk] != op['score'], score=op['score'])
+      scores[pk] = op['score']
+    else:
+      wanted = op['action'] == LIKE
+      result.update(status='ok', applied=has_liked[pk] != wanted, has_liked=wanted)
+      has_liked[pk] = wanted
+    results.append(result)
+  return results
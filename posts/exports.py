@@ -0,0 +1,139 @@
+#Streaming exports of posts and their engagement (the export endpoints and `manage.py export_posts`).
+#Rows are read as values_list() tuples, never model instances, in keyset chunks
+#(WHERE id > last ORDER BY id LIMIT n), and each chunk is written out as NDJSON or CSV
+#before the next one is read, so memory stays flat however large the table is.
+#`since` limits an export to rows changed at or after a time, for incremental exports.
+#Likes, ratings and tags have no timestamps of their own and follow their post's
+#updated_at, which every like, rating and edit bumps: an incremental export holds the
+#complete current likes, ratings and tags of each changed post. Deletions are not exported.
+import csv
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post, Comment, Rating
+
+
+OUTPUTS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson; charset=utf-8', 'csv': 'text/csv; charset=utf-8'}
+CHUNK_SIZE = 2000
+
+
+class Dataset:
+  """
+  One exportable table. `columns` maps output column names to values_list() lookups
+  (an 'id' column comes first, it drives the chunking); `owner` is the lookup of the
+  post's author, for per-author exports, and `changed` the timestamp `since` filters on.
+  `private` columns name other users and are left out of per-author exports.
+  """
+  def __init__(self, model, columns, owner, changed, private=()):
+    self.model = model
+    self.columns = {'id': 'pk', **columns}
+    self.owner = owner
+    self.changed = changed
+    self.private = set(private)
+
+  def get_columns(self, author=None):
+    return [name for name in self.columns if author is None or name not in self.private]
+
+  def get_queryset(self, author=None, since=None):
+    queryset = self.model._default_manager.all()
+    if author is not None:
+      queryset = queryset.filter(**{self.owner: author})
+    if since is not None:
+      queryset = queryset.filter(**{f'{self.changed}__gte': since})
+    return queryset
+
+
+DATASETS = {
+  'posts': Dataset(Post, {
+    'title': 'title', 'content': 'content', 'author': 'author__username', 'category': 'category__name',
+    'status': 'status', 'published_at': 'published_at', 'created_at': 'created_at', 'updated_at': 'updated_at',
+    'like_count': 'like_count', 'comment_count': 'comment_count', 'rating_count': 'rating_count', 'rating_sum': 'rating_sum',
+  }, owner='author', changed='updated_at'),
+  'comments': Dataset(Comment, {
+    'post_id': 'post_id', 'author': 'author__username', 'content': 'content',
+    'created_at': 'created_at', 'updated_at': 'updated_at',
+  }, owner='post__author', changed='updated_at'),
+  'likes': Dataset(Post.likes.through, {
+    'post_id': 'post_id', 'user': 'user__username',
+  }, owner='post__author', changed='post__updated_at', private=['user']),
+  'ratings': Dataset(Rating, {
+    'post_id': 'post_id', 'user': 'user__username', 'score': 'score',
+  }, owner='post__author', changed='post__updated_at', private=['user']),
+  'tags': Dataset(Post.tags.through, {
+    'post_id': 'post_id', 'tag': 'tag__name',
+  }, owner='post__author', changed='post__updated_at'),
+}
+
+
+def parse_since(value):
+  #ISO 8601; naive times are UTC, as in the importer
+  since = parse_datetime(value)
+  if since is None:
+    raise ValueError(f'Invalid timestamp {value!r}, use ISO 8601 (e.g. 2024-01-31T00:00:00Z).')
+  if timezone.is_naive(since):
+    since = timezone.make_aware(since, dt_timezone.utc)
+  return since
+
+
+def iter_chunks(queryset, lookups, chunk_size=CHUNK_SIZE):
+  """
+  Yields lists of at most `chunk_size` value tuples, the first lookup being the pk.
+  Every chunk is its own query resuming after the last id, so the database never
+  holds a cursor open between chunks and late chunks are as fast as early ones.
+  QuerySet.iterator() would keep one result set open instead, which the MySQL
+  driver buffers whole.
+  """
+  queryset = queryset.order_by('pk').values_list(*lookups)
+  last = None
+  while True:
+    chunk = queryset if last is None else queryset.filter(pk__gt=last)
+    rows = list(chunk[:chunk_size])
+    if rows:
+      yield rows
+    if len(rows) < chunk_size:
+      return
+    last = rows[-1][0]
+
+
+class Echo:
+  #File-like object for csv.writer that hands each line back instead of storing it
+  def write(self, value):
+    return value
+
+
+def render_ndjson(chunks, columns):
+  encoder = DjangoJSONEncoder(ensure_ascii=False)
+  for rows in chunks:
+    yield ''.join(encoder.encode(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def render_csv(chunks, columns):
+  writer = csv.writer(Echo())
+  encoder = DjangoJSONEncoder()
+  yield writer.writerow(columns)
+  for rows in chunks:
+    #Timestamps in the same ISO 8601 form as the NDJSON output
+    yield ''.join(
+      writer.writerow([encoder.default(value) if isinstance(value, datetime) else value for value in row])
+      for row in rows
+    )
+
+
+def export(dataset, output, author=None, since=None, chunk_size=CHUNK_SIZE, using=None):
+  """
+  Returns a generator of text pieces (one per chunk) making up the export of
+  `dataset` ('posts', 'comments', ...) as `output` ('ndjson' or 'csv'). With
+  `author`, only that author's posts and the engagement on them are exported.
+  """
+  spec = DATASETS[dataset]
+  columns = spec.get_columns(author)
+  queryset = spec.get_queryset(author=author, since=since)
+  if using is not None:
+    queryset = queryset.using(using)
+  chunks = iter_chunks(queryset, [spec.columns[name] for name in columns], chunk_size)
+  render = render_csv if output == 'csv' else render_ndjson
+  return render(chunks, columns)
@@ -1,5 +1,8 @@
 import django_filters
+from django.db.models import Case, When, Value, IntegerField
+from rest_framework.filters import BaseFilterBackend
 from .models import Post
+from .search import search
 
 class PostFilter(django_filters.FilterSet):
   #Filtering for Category(using the 'name' slug)
@@ -29,3 +32,38 @@ class PostFilter(django_filters.FilterSet):
     model = Post
     #Include fields that can be filtered directly (e.g., published_date)
     fields = ['category', 'author', 'tags', 'published_date']
+
+
+class PostSearchFilter(BaseFilterBackend):
+  """
+  Full-text search through the inverted index in posts.search.
+  Supports plain terms (all must match), "quoted phrases" and prefix* terms;
+  results are ordered by BM25 relevance, in cursor mode too.
+  """
+  search_param = 'search'
+
+  def filter_queryset(self, request, queryset, view):
+    query = request.query_params.get(self.search_param, '').strip()
+    if not query:
+      return queryset
+
+    ranked_ids = [post_id for post_id, _ in search(query)]
+    if not ranked_ids:
+      return queryset.none()
+
+    rank = Case(
+      *[When(pk=post_id, then=Value(position)) for position, post_id in enumerate(ranked_ids)],
+      output_field=IntegerField(),
+    )
+    #Keyset pages follow the relevance order instead of the view's usual key
+    view.cursor_ordering = ('search_rank', 'id')
+    return queryset.filter(pk__in=ranked_ids).annotate(search_rank=rank).order_by('search_rank')
+
+  def get_schema_operation_parameters(self, view):
+    return [{
+      'name': self.search_param,
+      'required': False,
+      'in': 'query',
+      'description': 'Full-text search. Supports "exact phrases" and prefix* terms.',
+      'schema': {'type': 'string'},
+    }]
@@ -0,0 +1,364 @@
+#Bulk post import for content migrations (`manage.py import_posts`).
+#Records stream in from JSONL or CSV and are inserted in batches with executemany(),
+#bypassing the ORM's per-instance work, the serializers and the post_save/m2m_changed
+#signals. The database assigns the ids, which are read back for the tag rows.
+#Authors, categories and tags are resolved through in-memory maps (missing tags are
+#created), and unless `render` is set the markdown render is left to refresh_renders
+#by leaving content_hash empty (reads render such posts in memory meanwhile).
+#Derived data (category counts, search index, feed caches) is rebuilt once at the
+#end, and subscriber notifications can be queued in one deferred pass.
+import csv
+import json
+import os
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post, Category, Tag, OutboxEvent
+from . import outbox
+from .rendering import render_content
+from .counters import reconcile_category_counts
+from .search import rebuild_index, bump_generation as bump_search_generation
+from .conditional import bump_feed_watermark
+from .response_cache import bump_generation as bump_response_cache
+
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 2000
+TITLE_MAX_LENGTH = Post._meta.get_field('title').max_length
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+STATUSES = {
+  'pb': Post.Status.PUBLISHED, 'published': Post.Status.PUBLISHED,
+  'df': Post.Status.DRAFT, 'draft': Post.Status.DRAFT,
+}
+
+
+class InvalidRecord(Exception):
+  pass
+
+
+def detect_format(path):
+  extension = os.path.splitext(path)[1].lstrip('.').lower()
+  return {'ndjson': 'jsonl', 'json': 'jsonl'}.get(extension, extension)
+
+
+def read_records(stream, format):
+  """
+  Yields every input record as a dict, or as an InvalidRecord when it can't be parsed,
+  so that record numbers (and checkpoints) stay aligned with the input.
+  """
+  if format == 'csv':
+    yield from csv.DictReader(stream)
+    return
+
+  for line in stream:
+    if not line.strip():
+      continue
+    try:
+      record = json.loads(line)
+    except ValueError as exc:
+      yield InvalidRecord(f'invalid JSON: {exc}')
+      continue
+    yield record if isinstance(record, dict) else InvalidRecord('not a JSON object')
+
+
+class Checkpoint:
+  """
+  Progress of an import, saved after every committed batch: how many input records
+  were consumed, the counts so far and the id ranges of the imported posts.
+  """
+  def __init__(self, path=None):
+    self.path = path
+    self.state = {'position': 0, 'imported': 0, 'skipped': 0, 'id_ranges': []}
+    if path and os.path.exists(path):
+      with open(path) as handle:
+        self.state.update(json.load(handle))
+
+  def save(self):
+    if not self.path:
+      return
+    #Written to the side and renamed, so a crash never leaves a truncated checkpoint
+    temporary = f'{self.path}.tmp'
+    with open(temporary, 'w') as handle:
+      json.dump(self.state, handle)
+    os.replace(temporary, self.path)
+
+  def add_batch(self, consumed, post_ids, skipped):
+    self.state['position'] += consumed
+    self.state['imported'] += len(post_ids)
+    self.state['skipped'] += skipped
+    #Posts created concurrently can fall between the imported ids, so only runs of
+    #consecutive ids are stored as ranges
+    ranges = self.state['id_ranges']
+    for pk in sorted(post_ids):
+      if ranges and ranges[-1][1] + 1 == pk:
+        ranges[-1][1] = pk
+      else:
+        ranges.append([pk, pk])
+    self.save()
+
+  def get_imported_filter(self):
+    condition = Q(pk__in=[])
+    for low, high in self.state['id_ranges']:
+      condition |= Q(pk__range=(low, high))
+    return condition
+
+
+class RowWriter:
+  """
+  Inserts plain dict rows with executemany(). bulk_create() prepares every field of
+  every instance; here defaults are prepared once, and of the given values only those
+  that aren't already plain ints and strings.
+  """
+  def __init__(self, model, fields=None):
+    self.model = model
+    self.fields = fields or model._meta.concrete_fields
+    self.connection = connections[DEFAULT_DB_ALIAS]
+    quote = self.connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in self.fields)
+    placeholders = ', '.join(['%s'] * len(self.fields))
+    self.sql = f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+    self.defaults = [
+      field.get_db_prep_save(field.get_default(), self.connection) if field.has_default() else None
+      for field in self.fields
+    ]
+
+  def prepare(self, field, value, prepared):
+    if value is None or type(value) in (int, str):
+      return value
+    #Timestamps repeat within a batch (created_at, updated_at); adapt each one once
+    key = (field.get_internal_type(), value)
+    if key not in prepared:
+      prepared[key] = field.get_db_prep_save(value, self.connection)
+    return prepared[key]
+
+  def insert(self, rows):
+    fields = list(zip(self.fields, self.defaults))
+    prepared = {}
+    values = [
+      [self.prepare(field, row[field.attname], prepared) if field.attname in row else default for field, default in fields]
+      for row in rows
+    ]
+    if values:
+      with self.connection.cursor() as cursor:
+        cursor.executemany(self.sql, values)
+
+
+class PostImporter:
+  """
+  Turns batches of records into posts. The lookup maps live as long as the importer,
+  so each author, category and tag is queried (or created) once per import.
+  """
+  def __init__(self, render=False, on_error=None):
+    self.render = render
+    self.on_error = on_error or (lambda number, message: None)
+    self.authors = {}
+    self.categories = {}
+    self.tags = {}
+    self.unknown_authors = set()
+    self.unknown_categories = set()
+    self.now = timezone.now()
+    #The id is left to the database: allocating ids here races with posts created meanwhile
+    self.post_writer = RowWriter(Post, fields=[field for field in Post._meta.concrete_fields if not field.primary_key])
+    PostTag = Post.tags.through
+    self.tag_writer = RowWriter(PostTag, fields=[PostTag._meta.get_field('post'), PostTag._meta.get_field('tag')])
+
+  def load_names(self, names):
+    #Resolves every name of the batch not seen before with one query per model
+    authors = {name for name in names['authors'] if name not in self.authors} - self.unknown_authors
+    if authors:
+      self.authors.update(User.objects.filter(username__in=authors).values_list('username', 'pk'))
+      self.unknown_authors |= authors - self.authors.keys()
+
+    categories = {name for name in names['categories'] if name not in self.categories} - self.unknown_categories
+    if categories:
+      self.categories.update(Category.objects.filter(name__in=categories).values_list('name', 'pk'))
+      self.unknown_categories |= categories - self.categories.keys()
+
+    #Tags are keyed by their lowercased name: MySQL's collation treats 'Python' and
+    #'python' as the same tag, so an incoming spelling reuses the stored one anywhere
+    tags = {}
+    for name in names['tags']:
+      if name.lower() not in self.tags:
+        tags.setdefault(name.lower(), name)
+    if tags:
+      existing = Tag.objects.annotate(lowered=Lower('name')).filter(lowered__in=list(tags))
+      self.tags.update(existing.values_list('lowered', 'pk'))
+      missing = [name for lowered, name in tags.items() if lowered not in self.tags]
+      if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        self.tags.update(existing.values_list('lowered', 'pk'))
+
+  def clean(self, record):
+    """
+    Validates one record. Returns (fields, author name, category name, tag names).
+    """
+    if isinstance(record, InvalidRecord):
+      raise record
+
+    title = (record.get('title') or '').strip()
+    content = record.get('content') or ''
+    author = (record.get('author') or '').strip()
+    if not title or not content.strip() or not author:
+      raise InvalidRecord('title, content and author are required')
+    if len(title) > TITLE_MAX_LENGTH:
+      raise InvalidRecord(f'title is longer than {TITLE_MAX_LENGTH} characters')
+
+    status = STATUSES.get(str(record.get('status') or 'draft').strip().lower())
+    if status is None:
+      raise InvalidRecord(f"unknown status {record.get('status')!r}")
+
+    published_at = None
+    if record.get('published_at'):
+      published_at = parse_datetime(str(record['published_at']))
+      if published_at is None:
+        raise InvalidRecord(f"invalid published_at {record['published_at']!r}")
+      if timezone.is_naive(published_at):
+        published_at = timezone.make_aware(published_at, dt_timezone.utc)
+    if status == Post.Status.PUBLISHED and published_at is None:
+      published_at = self.now #As Post.save() would
+
+    tags = record.get('tags') or []
+    if isinstance(tags, str):
+      #CSV columns (and lazy JSON) list tags as "a,b" or "a|b"
+      tags = tags.replace('|', ',').split(',')
+    if not isinstance(tags, list):
+      raise InvalidRecord('tags must be a list or a comma-separated string')
+    #One tag per name, whatever the spelling; the first spelling wins
+    unique = {}
+    for name in tags:
+      name = str(name).strip()
+      if name:
+        unique.setdefault(name.lower(), name)
+    tags = list(unique.values())
+    too_long = [name for name in tags if len(name) > TAG_MAX_LENGTH]
+    if too_long:
+      raise InvalidRecord(f'tag names longer than {TAG_MAX_LENGTH} characters: {", ".join(sorted(too_long))}')
+
+    fields = {'title': title, 'content': content, 'status': status, 'published_at': published_at}
+    return fields, author, (record.get('category') or '').strip(), tags
+
+  def import_batch(self, numbered_records):
+    """
+    Inserts one batch of (record number, record) pairs in a single transaction.
+    Returns (ids of the new posts, number of skipped records).
+    """
+    cleaned = []
+    for number, record in numbered_records:
+      try:
+        cleaned.append((number, *self.clean(record)))
+      except InvalidRecord as exc:
+        self.on_error(number, str(exc))
+
+    self.load_names({
+      'authors': {author for _, _, author, _, _ in cleaned},
+      'categories': {category for _, _, _, category, _ in cleaned if category},
+      #In file order, so a new tag is created with its first spelling
+      'tags': dict.fromkeys(name for *_, tags in cleaned for name in tags),
+    })
+
+    now = timezone.now()
+    rows, post_tags = [], []
+    for number, fields, author, category, tags in cleaned:
+      if author not in self.authors:
+        self.on_error(number, f'unknown author {author!r}')
+        continue
+      if category and category not in self.categories:
+        self.on_error(number, f'unknown category {category!r}')
+        continue
+      row = {**fields, 'author_id': self.authors[author], 'category_id': self.categories.get(category), 'created_at': now, 'updated_at': now}
+      if self.render:
+        row['content_hash'], rendered = render_content(fields['content'])
+        row.update(rendered)
+      rows.append(row)
+      post_tags.append(tags)
+
+    post_ids = []
+    with transaction.atomic():
+      if rows:
+        floor = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.post_writer.insert(rows)
+        post_ids = self.read_back_ids(rows, floor, now)
+        self.tag_writer.insert([
+          {'post_id': pk, 'tag_id': self.tags[name.lower()]}
+          for pk, tags in zip(post_ids, post_tags)
+          for name in tags
+        ])
+
+    return post_ids, len(numbered_records) - len(rows)
+
+  def read_back_ids(self, rows, floor, created_at):
+    """
+    Ids the database gave to `rows`, in row order. A batch shares one created_at, and
+    new ids are above the largest id seen before the insert, so the lookup only walks
+    the new end of the primary key. Ids ascend in insert order; a post created
+    meanwhile with the same timestamp is told apart by its author and title.
+    """
+    candidates = Post.objects.filter(pk__gt=floor, created_at=created_at).order_by('pk').values_list('pk', 'author_id', 'title')
+    post_ids = []
+    for pk, author_id, title in candidates.iterator():
+      if len(post_ids) < len(rows) and (rows[len(post_ids)]['author_id'], rows[len(post_ids)]['title']) == (author_id, title):
+        post_ids.append(pk)
+    if len(post_ids) != len(rows):
+      #Rolls the batch back; the import can be resumed from the checkpoint
+      raise RuntimeError(f'Could only find {len(post_ids)} of the {len(rows)} posts inserted in this batch')
+    return post_ids
+
+
+def import_posts(records, checkpoint=None, batch_size=BATCH_SIZE, render=False, on_error=None, on_batch=None):
+  """
+  Imports an iterable of records (see read_records), resuming after the records a
+  checkpoint has already consumed. Returns the checkpoint.
+  """
+  checkpoint = checkpoint or Checkpoint()
+  importer = PostImporter(render=render, on_error=on_error)
+  position = checkpoint.state['position']
+  numbered = enumerate(islice(records, position, None), start=position + 1)
+
+  while True:
+    batch = list(islice(numbered, batch_size))
+    if not batch:
+      break
+    post_ids, skipped = importer.import_batch(batch)
+    checkpoint.add_batch(len(batch), post_ids, skipped)
+    if on_batch is not None:
+      on_batch(checkpoint)
+  return checkpoint
+
+
+def queue_notifications(checkpoint, batch_size=BATCH_SIZE):
+  """
+  The deferred notification pass: one POST_NOTIFY_SUBSCRIBERS outbox event per imported
+  published post, as notify_subscribers_on_publish would have recorded. Returns the count.
+  """
+  post_ids = Post.objects.filter(
+    checkpoint.get_imported_filter(), status=Post.Status.PUBLISHED
+  ).values_list('pk', flat=True)
+  events = (OutboxEvent(topic=outbox.POST_NOTIFY_SUBSCRIBERS, payload={'post_id': pk}) for pk in post_ids.iterator(chunk_size=batch_size))
+
+  queued = 0
+  while True:
+    batch = list(islice(events, batch_size))
+    if not batch:
+      return queued
+    OutboxEvent.objects.bulk_create(batch)
+    queued += len(batch)
+
+
+def finish_import(checkpoint, index=True):
+  """
+  Rebuilds what the skipped signals would have maintained. Returns the number of
+  posts indexed for search.
+  """
+  reconcile_category_counts()
+  indexed = rebuild_index(Post.objects.filter(checkpoint.get_imported_filter())) if index else 0
+  bump_search_generation()
+  bump_feed_watermark()
+  bump_response_cache()
+  return indexed
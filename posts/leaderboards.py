@@ -0,0 +1,151 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, NullIf
+from django.utils import timezone
+
+from .models import Post, LeaderboardEntry
+
+
+#How many posts each board keeps
+LEADERBOARD_SIZE = getattr(settings, 'LEADERBOARD_SIZE', 100)
+#Seconds a refresh looks back before the board's watermark, for writes that committed late
+WATERMARK_OVERLAP = 60
+
+WINDOWS = {
+  LeaderboardEntry.Window.DAY: timedelta(days=1),
+  LeaderboardEntry.Window.WEEK: timedelta(days=7),
+  LeaderboardEntry.Window.MONTH: timedelta(days=30),
+  LeaderboardEntry.Window.ALL: None,
+}
+
+
+def get_metric_expression(metric):
+  if metric == LeaderboardEntry.Metric.LIKES:
+    return Cast(F('like_count'), FloatField())
+  if metric == LeaderboardEntry.Metric.COMMENTS:
+    return Cast(F('comment_count'), FloatField())
+  #Average from the maintained aggregates; NULL (unranked) when nobody rated
+  return Cast(F('rating_sum'), FloatField()) / NullIf(F('rating_count'), 0)
+
+
+def compute_leaderboard(window, metric, now=None):
+  """
+  Returns [(post_id, score), ...] for the top published posts of a window,
+  best first. Only posts published inside the window are ranked.
+  """
+  now = now or timezone.now()
+  queryset = Post.objects.filter(status=Post.Status.PUBLISHED)
+  if WINDOWS[window] is not None:
+    queryset = queryset.filter(published_at__gte=now - WINDOWS[window])
+
+  ranked = queryset.annotate(score=get_metric_expression(metric)).filter(score__gt=0)
+  return list(
+    ranked.order_by('-score', '-published_at', '-id').values_list('pk', 'score')[:LEADERBOARD_SIZE]
+  )
+
+
+def get_window_start(window, now):
+  return now - WINDOWS[window] if WINDOWS[window] is not None else None
+
+
+def get_rank_key(entry):
+  #Sort key of a (post_id, score, published_at) entry, as compute_leaderboard orders them
+  pk, score, published_at = entry
+  return (-score, -published_at.timestamp(), -pk)
+
+
+def update_leaderboard(window, metric, board, since, now):
+  """
+  Applies the posts touched since `since` to a board's stored (post_id, score,
+  published_at) entries.
+  Every change that can move a score (counters, edits, publishing) bumps
+  Post.updated_at, so the posts not touched keep their scores and their order.
+  Returns the new ranking, or None when it can't be derived from the stored rows:
+  a post left the window, or the board was not full (a deleted post may have left
+  a gap), or a ranked post fell below posts that were never on the board.
+  """
+  start = get_window_start(window, now)
+  if len(board) < LEADERBOARD_SIZE:
+    return None
+  if start is not None and any(published_at is None or published_at < start for _, _, published_at in board):
+    return None
+
+  #Re-reading a post twice is harmless, so the watermark overlaps writes committed late
+  since -= timedelta(seconds=WATERMARK_OVERLAP)
+  touched = list(
+    Post.objects.filter(updated_at__gte=since)
+    .annotate(score=get_metric_expression(metric))
+    .values_list('pk', 'score', 'published_at', 'status')
+  )
+  if not touched:
+    return [(pk, score) for pk, score, _ in board]
+
+  threshold = get_rank_key(board[-1])
+  touched_ids = {pk for pk, *_ in touched}
+  ranked = [(pk, score, published_at) for pk, score, published_at in board if pk not in touched_ids]
+  for pk, score, published_at, post_status in touched:
+    in_window = published_at is not None and (start is None or published_at >= start)
+    if post_status == Post.Status.PUBLISHED and in_window and score is not None and score > 0:
+      ranked.append((pk, score, published_at))
+  ranked.sort(key=get_rank_key)
+  ranked = ranked[:LEADERBOARD_SIZE]
+
+  #Posts that were never on the board ranked after its last entry; if the new last
+  #entry ranks below that, one of them may belong on the board
+  if len(ranked) < LEADERBOARD_SIZE or get_rank_key(ranked[-1]) > threshold:
+    return None
+  return [(pk, score) for pk, score, _ in ranked]
+
+
+def refresh_leaderboard(window, metric, now=None):
+  """
+  Brings one board up to date, incrementally from the posts touched since its last
+  refresh (see update_leaderboard) or by a full compute_leaderboard, and rewrites it
+  only when the ranking changed. Returns True when rows were written.
+  """
+  now = now or timezone.now()
+  entries = LeaderboardEntry.objects.filter(window=window, metric=metric)
+  rows = list(entries.order_by('rank').values_list('post_id', 'score', 'post__published_at', 'computed_at'))
+  board = [row[:3] for row in rows]
+
+  ranking = update_leaderboard(window, metric, board, rows[0][3], now) if rows else None
+  if ranking is None:
+    ranking = compute_leaderboard(window, metric, now)
+
+  if [(pk, score) for pk, score, _ in board] == ranking:
+    #computed_at is the board's watermark: the next refresh reads the posts touched after it
+    entries.update(computed_at=now)
+    return False
+
+  with transaction.atomic():
+    entries.delete()
+    LeaderboardEntry.objects.bulk_create([
+      LeaderboardEntry(window=window, metric=metric, rank=rank, post_id=post_id, score=score, computed_at=now)
+      for rank, (post_id, score) in enumerate(ranking, start=1)
+    ])
+  return True
+
+
+def refresh_all_leaderboards(now=None):
+  now = now or timezone.now()
+  refreshed = 0
+  for window in LeaderboardEntry.Window.values:
+    for metric in LeaderboardEntry.Metric.values:
+      refreshed += refresh_leaderboard(window, metric, now)
+  return refreshed
+
+
+def get_leaderboard_queryset(window, metric):
+  """
+  Top posts for a board in rank order, reading only the k ranked rows.
+  Reads never compute a board: the rows are written by the refresh_leaderboards
+  beat task and command, so a board that was never refreshed is empty.
+  """
+  return Post.objects.filter(
+    leaderboard_entries__window=window,
+    leaderboard_entries__metric=metric,
+    status=Post.Status.PUBLISHED,
+  ).order_by('leaderboard_entries__rank')
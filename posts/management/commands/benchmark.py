@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+  help = (
+    'Seeds a synthetic dataset in a throwaway test database, drives every API route through '
+    'the test client and reports p50/p95/p99 latency, queries, SQL time and response size as JSON.'
+  )
+
+  def add_arguments(self, parser):
+    for name, default in benchmark.DEFAULT_SIZES.items():
+      parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+    parser.add_argument('--seed', type=int, default=1, help='Random seed, so runs use the same dataset.')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed requests per route.')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per route before timing.')
+    parser.add_argument('--only', nargs='*', help='Only run routes whose label contains one of these strings.')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--compare', help='A previous report to compare against; regressions are listed on stderr.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative latency growth counted as a regression (default 0.10).')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error when a regression is found.')
+    parser.add_argument('--keepdb', action='store_true', help='Keep (and reuse) the seeded test database between runs.')
+
+  def handle(self, *args, **options):
+    baseline = None
+    if options['compare']:
+      with open(options['compare']) as handle:
+        baseline = json.load(handle)
+
+    sizes = {name: options[name] for name in benchmark.DEFAULT_SIZES}
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+    try:
+      if not benchmark.User.objects.filter(username__startswith=benchmark.USERNAME_PREFIX).exists():
+        self.stderr.write('Seeding dataset...')
+        benchmark.seed_dataset(sizes, seed=options['seed'])
+      report = benchmark.run_benchmark(
+        iterations=options['iterations'], warmup=options['warmup'], only=options['only'], sizes=sizes
+      )
+    finally:
+      connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+      teardown_test_environment()
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as handle:
+        handle.write(output + '\n')
+    else:
+      self.stdout.write(output)
+
+    for route in report['meta']['uncovered_routes']:
+      self.stderr.write(self.style.WARNING(f"No benchmark scenario covers route: {route}"))
+
+    if baseline is not None:
+      regressions = self.compare(baseline, report, options['threshold'])
+      if regressions and options['fail_on_regression']:
+        raise CommandError(f"{regressions} regression(s) against {options['compare']}.")
+
+  def compare(self, baseline, report, threshold):
+    regressions = 0
+    for label, metric, before, after, change, regressed in benchmark.compare_reports(baseline, report, threshold):
+      line = f"{label:<32} {metric:<8} {before:>12} -> {after:<12} {change:+.1%}"
+      if regressed:
+        regressions += 1
+        self.stderr.write(self.style.ERROR(f"{line}  REGRESSION"))
+      else:
+        self.stderr.write(line)
+    return regressions
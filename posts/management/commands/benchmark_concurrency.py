@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+  help = (
+    'Seeds a synthetic dataset in a throwaway test database and serves the same concurrent '
+    'mix of feed and post-detail GETs through the sync views (thread pool) and the async '
+    'views (one event loop), reporting throughput and p50/p95/p99 latency per mode as JSON.'
+  )
+
+  def add_arguments(self, parser):
+    for name, default in benchmark.DEFAULT_SIZES.items():
+      parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+    parser.add_argument('--seed', type=int, default=1, help='Random seed, so runs use the same dataset.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests sent per mode.')
+    parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once.')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='Simulated database round trip added to every query, as against a remote server.')
+    parser.add_argument('--only', nargs='*', help='Only use routes whose name contains one of these strings.')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--keepdb', action='store_true', help='Keep (and reuse) the seeded test database between runs.')
+
+  def handle(self, *args, **options):
+    sizes = {name: options[name] for name in benchmark.DEFAULT_SIZES}
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+    try:
+      if not benchmark.User.objects.filter(username__startswith=benchmark.USERNAME_PREFIX).exists():
+        self.stderr.write('Seeding dataset...')
+        benchmark.seed_dataset(sizes, seed=options['seed'])
+      report = benchmark.run_concurrency_benchmark(
+        requests=options['requests'], concurrency=options['concurrency'],
+        latency_ms=options['latency_ms'], only=options['only'],
+      )
+    finally:
+      connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+      teardown_test_environment()
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as handle:
+        handle.write(output + '\n')
+    else:
+      self.stdout.write(output)
+
+    for mode, result in report['modes'].items():
+      self.stderr.write(f"{mode:<6} {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms")
@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import outbox
+
+
+class Command(BaseCommand):
+  help = (
+    'Carries out pending outbox events (e-mails, timeline fan-out) in batches, retrying failures with backoff. '
+    'Everything runs in this process, no Celery worker is needed. Exits with an error while dead-lettered events remain.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE, help='Events claimed per batch.')
+    parser.add_argument('--loop', action='store_true', help='Keep draining until interrupted.')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep between passes with --loop.')
+    parser.add_argument('--purge-days', type=int, default=None, help='Also delete events processed more than this many days ago.')
+    parser.add_argument('--requeue-dead', action='store_true', help='Give dead-lettered events a fresh set of attempts first.')
+
+  def handle(self, *args, **options):
+    if options['requeue_dead']:
+      requeued = outbox.requeue_dead_letters()
+      self.stdout.write(f"Requeued {requeued} dead-lettered event(s).")
+
+    reported_dead = 0
+    while True:
+      processed, failed = outbox.drain(batch_size=options['batch_size'], inline=True)
+      if processed or failed or not options['loop']:
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} event(s), {failed} failed and will be retried."))
+
+      dead = outbox.dead_letters().count()
+      if dead != reported_dead:
+        reported_dead = dead
+        if dead:
+          self.stderr.write(self.style.ERROR(
+            f"{dead} event(s) failed {outbox.MAX_ATTEMPTS} times and will not be retried; "
+            "fix the cause (see last_error) and run with --requeue-dead."
+          ))
+
+      if options['purge_days'] is not None:
+        purged = outbox.purge_processed(timedelta(days=options['purge_days']))
+        if purged:
+          self.stdout.write(f"Purged {purged} processed event(s).")
+
+      if not options['loop']:
+        break
+      time.sleep(options['interval'])
+
+    if reported_dead:
+      raise CommandError(f"{reported_dead} dead-lettered outbox event(s).")
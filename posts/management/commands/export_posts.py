@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import exports
+
+
+class Command(BaseCommand):
+  help = (
+    'Streams a dataset (posts, comments, likes, ratings, tags) as NDJSON or CSV. '
+    'Memory use does not grow with the size of the table.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('dataset', choices=exports.DATASETS)
+    parser.add_argument('--output', choices=exports.OUTPUTS, default='ndjson', help='Output format (default: ndjson).')
+    parser.add_argument('--file', help='Write to this file instead of stdout.')
+    parser.add_argument('--since', help='Only rows changed at or after this ISO 8601 time.')
+    parser.add_argument('--author', help="Only this user's posts and the engagement on them.")
+    parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE, help='Rows read per query.')
+
+  def handle(self, *args, **options):
+    since = None
+    if options['since']:
+      try:
+        since = exports.parse_since(options['since'])
+      except ValueError as exc:
+        raise CommandError(str(exc))
+    author = None
+    if options['author']:
+      author = User.objects.filter(username=options['author']).first()
+      if author is None:
+        raise CommandError(f"No user named {options['author']!r}.")
+
+    started = timezone.now()
+    stream = open(options['file'], 'w', newline='', encoding='utf-8') if options['file'] else self.stdout
+    try:
+      for piece in exports.export(options['dataset'], options['output'], author=author, since=since, chunk_size=options['chunk_size']):
+        stream.write(piece)
+    finally:
+      if options['file']:
+        stream.close()
+    #Pass this as --since next time to export only what changed in between
+    self.stderr.write(f'Export started at {started.isoformat()}')
@@ -0,0 +1,65 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import importer
+
+
+class Command(BaseCommand):
+  help = (
+    'Bulk-imports posts from a JSONL or CSV file (fields: title, content, author, category, '
+    'tags, status, published_at). Bypasses serializers and signals; rebuilds derived data at the end.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('path', help="Input file, or '-' for stdin.")
+    parser.add_argument('--format', choices=importer.FORMATS, help='Input format (default: from the file extension).')
+    parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE, help='Posts inserted per transaction.')
+    parser.add_argument('--checkpoint', help='Progress file; a rerun with the same file resumes after the last committed batch.')
+    parser.add_argument('--render', action='store_true', help='Render markdown during the import instead of leaving it to refresh_renders.')
+    parser.add_argument('--skip-index', action='store_true', help='Leave search indexing to rebuild_search_index.')
+    parser.add_argument('--notify', action='store_true', help='Queue subscriber notifications for imported published posts.')
+
+  def handle(self, *args, **options):
+    path = options['path']
+    format = options['format'] or (None if path == '-' else importer.detect_format(path))
+    if format not in importer.FORMATS:
+      raise CommandError('Pass --format jsonl or --format csv.')
+
+    checkpoint = importer.Checkpoint(options['checkpoint'])
+    if checkpoint.state['position']:
+      self.stderr.write(f"Resuming after record {checkpoint.state['position']}.")
+
+    started = time.perf_counter()
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+      importer.import_posts(
+        importer.read_records(stream, format),
+        checkpoint=checkpoint,
+        batch_size=options['batch_size'],
+        render=options['render'],
+        on_error=lambda number, message: self.stderr.write(self.style.WARNING(f"Record {number} skipped: {message}")),
+        on_batch=lambda checkpoint: self.stderr.write(f"{checkpoint.state['imported']} imported..."),
+      )
+    finally:
+      if stream is not sys.stdin:
+        stream.close()
+    elapsed = time.perf_counter() - started
+
+    state = checkpoint.state
+    rate = state['imported'] / elapsed if elapsed else 0
+    self.stdout.write(self.style.SUCCESS(
+      f"Imported {state['imported']} post(s), skipped {state['skipped']} record(s) in {elapsed:.1f}s ({rate:.0f} posts/s)."
+    ))
+
+    indexed = importer.finish_import(checkpoint, index=not options['skip_index'])
+    if options['skip_index']:
+      self.stdout.write('Search index not updated; run rebuild_search_index.')
+    else:
+      self.stdout.write(f"Indexed {indexed} post(s) for search.")
+    if not options['render']:
+      self.stdout.write('Renders not stored; run refresh_renders.')
+    if options['notify']:
+      self.stdout.write(f"Queued {importer.queue_notifications(checkpoint)} subscriber notification(s); drain_outbox sends them.")
+    self.stdout.write('Imported posts reach home feeds after rebuild_timelines.')
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from posts.timeline import rebuild_timeline, REBUILD_DEPTH
+
+
+class Command(BaseCommand):
+  help = 'Rebuilds home-feed timelines from current follows and category subscriptions.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('usernames', nargs='*', help='Only rebuild these users (default: everyone).')
+    parser.add_argument('--depth', type=int, default=REBUILD_DEPTH, help='Recent posts to seed each timeline with.')
+
+  def handle(self, *args, **options):
+    users = User.objects.all()
+    if options['usernames']:
+      users = users.filter(username__in=options['usernames'])
+
+    rebuilt = 0
+    for user_id in users.values_list('pk', flat=True).iterator(chunk_size=1000):
+      rebuild_timeline(user_id, depth=options['depth'])
+      rebuilt += 1
+
+    self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timeline(s)."))
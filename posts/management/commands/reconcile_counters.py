@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_post_counters, reconcile_category_counts
+
+
+class Command(BaseCommand):
+  help = 'Repairs drift in the denormalized counters (post likes, comments, ratings; category post counts).'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per UPDATE batch.')
+
+  def handle(self, *args, **options):
+    repaired = reconcile_post_counters(batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(f"Repaired counters on {repaired} post(s)."))
+
+    repaired = reconcile_category_counts(batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(f"Repaired post counts on {repaired} category(ies)."))
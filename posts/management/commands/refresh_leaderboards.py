@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.leaderboards import refresh_all_leaderboards
+
+
+class Command(BaseCommand):
+  help = 'Updates the top-post leaderboards for every window and metric from the posts changed since their last refresh.'
+
+  def handle(self, *args, **options):
+    refreshed = refresh_all_leaderboards()
+    self.stdout.write(self.style.SUCCESS(f"Rewrote {refreshed} leaderboard(s); unchanged boards were skipped."))
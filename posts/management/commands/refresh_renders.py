@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.rendering import refresh_stored_renders
+
+
+class Command(BaseCommand):
+  help = 'Re-renders and stores the HTML and summary of every post whose render is stale (e.g. after a render policy change).'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=500, help='Posts read and written per batch.')
+
+  def handle(self, *args, **options):
+    updated = refresh_stored_renders(Post.objects.all(), batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(f"Re-rendered {updated} post(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.timeline import trim_timelines, MAX_LENGTH
+
+
+class Command(BaseCommand):
+  help = 'Deletes home-feed timeline entries beyond the newest --max-length of each user.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH, help='Entries kept per timeline.')
+
+  def handle(self, *args, **options):
+    deleted = trim_timelines(options['max_length'])
+    self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} timeline entr{'y' if deleted == 1 else 'ies'}."))
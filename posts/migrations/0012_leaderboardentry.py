@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_post_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('day', 'Last 24 hours'), ('week', 'Last 7 days'), ('month', 'Last 30 days'), ('all', 'All time')], max_length=5)),
+                ('metric', models.CharField(choices=[('likes', 'Likes'), ('rating', 'Average rating'), ('comments', 'Comments')], max_length=8)),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='posts.post')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('window', 'metric', 'rank'), name='unique_leaderboard_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:28
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Rating = apps.get_model('posts', 'Rating')
+    ratings = Rating.objects.filter(post_id=OuterRef('pk')).values('post_id')
+
+    def count_of(queryset):
+        return Coalesce(Subquery(queryset.annotate(c=Count('*')).values('c')), 0)
+
+    Post.objects.update(
+        rating_count=count_of(ratings),
+        rating_sum=Coalesce(Subquery(ratings.annotate(s=Sum('score')).values('s')), 0),
+        **{f'rating_{score}': count_of(ratings.filter(score=score)) for score in range(1, 6)},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
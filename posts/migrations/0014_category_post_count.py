@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_post_counts(apps, schema_editor):
+    Category = apps.get_model('posts', 'Category')
+    Post = apps.get_model('posts', 'Post')
+    published = Post.objects.filter(category_id=OuterRef('pk'), status='PB').values('category_id').annotate(c=Count('*')).values('c')
+    Category.objects.update(post_count=Coalesce(Subquery(published), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_post_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,13 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    #The render policy changed (<strong> is allowed, first_image must be http(s)). The stale
+    #renders are rewritten by `manage.py refresh_renders` after the deploy, not here: a
+    #migration must not import live rendering code, and reads render stale posts meanwhile
+
+    dependencies = [
+        ('posts', '0018_hot_query_indexes'),
+    ]
+
+    operations = []
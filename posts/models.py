@@ -1,12 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from .rendering import refresh_render, RENDERED_FIELDS
 
 
 # Create your models here.
 class Category(models.Model):
   name = models.CharField(max_length=100, unique=True)
+  #Number of published posts, maintained on publish/unpublish/delete/category change
+  post_count = models.PositiveIntegerField(default=0, editable=False)
 
   def __str__(self):
     return self.name
@@ -40,19 +43,91 @@ class Post(models.Model):
 
   #Date Fields
   created_at = models.DateTimeField(auto_now_add=True)
+  #Bumped on every change visible in the API (edits, counters, comments), used for conditional GETs
+  updated_at = models.DateTimeField(auto_now=True)
+
+  #Rendered HTML, stored at save time and keyed by a hash of content + render policy
+  content_html = models.TextField(blank=True, default='', editable=False)
+  content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+  #Plain-text summary used by list endpoints, computed with the render
+  excerpt = models.TextField(blank=True, default='', editable=False)
+  word_count = models.PositiveIntegerField(default=0, editable=False)
+  reading_time = models.PositiveIntegerField(default=0, editable=False) #Minutes
+  first_image = models.CharField(max_length=500, blank=True, default='', editable=False)
+
+  #Denormalized counters, kept current with F() updates (see posts.counters)
+  like_count = models.PositiveIntegerField(default=0, editable=False)
+  comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+  #Rating aggregates and 1-5 histogram, maintained by RatePostView
+  rating_count = models.PositiveIntegerField(default=0, editable=False)
+  rating_sum = models.PositiveIntegerField(default=0, editable=False)
+  rating_1 = models.PositiveIntegerField(default=0, editable=False)
+  rating_2 = models.PositiveIntegerField(default=0, editable=False)
+  rating_3 = models.PositiveIntegerField(default=0, editable=False)
+  rating_4 = models.PositiveIntegerField(default=0, editable=False)
+  rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+  class Meta:
+    #One index per hot query shape: equality columns first, then the feed's sort key
+    indexes = [
+      models.Index(fields=['status', '-published_at', '-id'], name='post_status_published'), #explore, leaderboards
+      models.Index(fields=['status', '-created_at', '-id'], name='post_status_created'), #post list
+      models.Index(fields=['category', 'status', '-published_at', '-id'], name='post_category_published'), #category pages
+      models.Index(fields=['author', 'status', '-published_at', '-id'], name='post_author_published'), #profile posts
+      models.Index(fields=['author', 'status', '-created_at', '-id'], name='post_author_created'), #drafts
+      models.Index(fields=['updated_at'], name='post_updated'), #posts touched since a leaderboard refresh
+    ]
 
   def save(self, *args, **kwargs):
     #Automatically set published_at when status changes to Published
     if self.status == self.Status.PUBLISHED and not self.published_at:
       self.published_at = timezone.now()
 
-    super().save(*args, **kwargs)
+    #Re-render the markdown only when the content (or render policy) changed
+    rendered = refresh_render(self)
+    if kwargs.get('update_fields') is not None:
+      #Partial saves still move updated_at, which conditional GETs rely on
+      kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'} | (set(RENDERED_FIELDS) if rendered else set())
+
+    #post_save receivers write outbox events; they commit or roll back with the row
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+    self._loaded_status = self.status
+    self._loaded_category_id = self.category_id
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    #Remember the stored status/category so saves can detect transitions
+    instance._loaded_status = instance.__dict__.get('status')
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+    return instance
+
+  @property
+  def was_published(self):
+    return getattr(self, '_loaded_status', None) == self.Status.PUBLISHED
+
+  @property
+  def loaded_category_id(self):
+    return getattr(self, '_loaded_category_id', None)
 
   def __str__(self):
     return self.title
   
   def total_likes(self):
-    return self.likes.count()
+    return self.like_count
+
+  @property
+  def avg_rating(self):
+    if not self.rating_count:
+      return None
+    return round(self.rating_sum / self.rating_count, 2)
+
+  @property
+  def rating_distribution(self):
+    return {str(score): getattr(self, f'rating_{score}') for score in range(1, 6)}
 
 
 class Comment(models.Model):
@@ -60,9 +135,13 @@ class Comment(models.Model):
   author = models.ForeignKey(User, on_delete=models.CASCADE)
   content = models.TextField()
   created_at = models.DateTimeField(auto_now_add=True)
+  updated_at = models.DateTimeField(auto_now=True)
 
   class Meta:
     ordering = ['-created_at'] #Newest comments first
+    indexes = [
+      models.Index(fields=['post', '-created_at'], name='comment_post_recent'),
+    ]
 
   def __str__(self):
     return f"Comment by {self.author.username} on {self.post.title}"
@@ -95,4 +174,115 @@ class CategorySubscription(models.Model):
     #Prevents a user from subscribing to the same category twice
     constraints = [
       models.UniqueConstraint(fields=['user', 'category'], name='unique_category_sub')
-    ]
\ No newline at end of file
+    ]
+
+
+class TimelineEntry(models.Model):
+  """
+  A post delivered to a user's home feed, written when the post is published
+  (fan-out-on-write). published_at is copied so the feed can be read in order
+  from this table alone.
+  """
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+  published_at = models.DateTimeField()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry')
+    ]
+    indexes = [
+      models.Index(fields=['user', '-published_at', '-post'], name='timeline_user_recent')
+    ]
+
+
+class SearchDocument(models.Model):
+  """
+  Per-post statistics for the inverted index (see posts.search).
+  """
+  post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+  length = models.PositiveIntegerField(default=0) #Weighted number of indexed tokens
+  signature = models.CharField(max_length=64) #Hash of the indexed text, to skip no-op reindexing
+
+
+class SearchPosting(models.Model):
+  """
+  One row per (term, post): how often the term occurs and at which positions.
+  """
+  term = models.CharField(max_length=64)
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='search_postings')
+  frequency = models.PositiveIntegerField()
+  positions = models.JSONField(default=list)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['term', 'post'], name='unique_search_posting')
+    ]
+
+
+class LeaderboardEntry(models.Model):
+  """
+  Precomputed top-k ranking of published posts per time window and metric
+  (see posts.leaderboards). Read by TopPostsView in rank order.
+  """
+  class Window(models.TextChoices):
+    DAY = 'day', 'Last 24 hours'
+    WEEK = 'week', 'Last 7 days'
+    MONTH = 'month', 'Last 30 days'
+    ALL = 'all', 'All time'
+
+  class Metric(models.TextChoices):
+    LIKES = 'likes', 'Likes'
+    RATING = 'rating', 'Average rating'
+    COMMENTS = 'comments', 'Comments'
+
+  window = models.CharField(max_length=5, choices=Window.choices)
+  metric = models.CharField(max_length=8, choices=Metric.choices)
+  rank = models.PositiveIntegerField()
+  post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='leaderboard_entries')
+  score = models.FloatField()
+  computed_at = models.DateTimeField()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['window', 'metric', 'rank'], name='unique_leaderboard_rank')
+    ]
+
+
+class NotificationDispatch(models.Model):
+  """
+  Progress of the "new post" e-mail to a post's audience (see posts.tasks.notify_subscribers).
+  Recipients are walked in e-mail order, so a retried dispatch resumes after `cursor`.
+  """
+  post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='notification_dispatch')
+  cursor = models.EmailField(blank=True, default='') #Last address handed to a batch
+  queued_count = models.PositiveIntegerField(default=0)
+  sent_count = models.PositiveIntegerField(default=0)
+  created_at = models.DateTimeField(auto_now_add=True)
+  completed_at = models.DateTimeField(null=True, blank=True)
+
+  def __str__(self):
+    return f"Dispatch for {self.post} ({self.sent_count}/{self.queued_count} sent)"
+
+
+class OutboxEvent(models.Model):
+  """
+  A side effect (e-mail, timeline fan-out, ...) recorded in the same transaction
+  as the change that caused it, and carried out later by the outbox drainer
+  (see posts.outbox). Events are retried with backoff until max attempts.
+  """
+  topic = models.CharField(max_length=64)
+  payload = models.JSONField(default=dict)
+  created_at = models.DateTimeField(auto_now_add=True)
+  available_at = models.DateTimeField(default=timezone.now) #Not picked up before this time (backoff/lease)
+  attempts = models.PositiveIntegerField(default=0)
+  last_error = models.TextField(blank=True, default='')
+  processed_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['processed_at', 'available_at', 'id'], name='outbox_pending'),
+    ]
+
+  def __str__(self):
+    return f"{self.topic} #{self.pk}"
@@ -0,0 +1,56 @@
+from django.core.mail import EmailMessage
+from django.db.models import F
+
+from users.models import Follow
+from .models import CategorySubscription
+
+
+#Recipients per sub-task; each batch is sent over one mail connection
+BATCH_SIZE = 500
+FROM_EMAIL = 'notifications@blogapi.com'
+
+
+def get_audience(post, after=''):
+  """
+  E-mail addresses of the author's followers and the category's subscribers,
+  de-duplicated in SQL (UNION) and ordered so a dispatch can resume after `after`.
+  Empty addresses never sort after '' and are skipped by the same filter.
+  """
+  audiences = [
+    Follow.objects.filter(followed_user_id=post.author_id, follower__email__gt=after)
+    .annotate(email=F('follower__email')).values_list('email', flat=True)
+  ]
+  if post.category_id:
+    audiences.append(
+      CategorySubscription.objects.filter(category_id=post.category_id, user__email__gt=after)
+      .annotate(email=F('user__email')).values_list('email', flat=True)
+    )
+
+  if len(audiences) == 1:
+    return audiences[0].distinct().order_by('email')
+  return audiences[0].union(*audiences[1:]).order_by('email')
+
+
+def iter_audience_batches(post, after='', batch_size=None):
+  #Streams the audience in fixed-size lists without loading it all at once
+  batch_size = batch_size or BATCH_SIZE
+  batch = []
+  for email in get_audience(post, after).iterator(chunk_size=batch_size):
+    batch.append(email)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def build_new_post_message(post, email, connection=None):
+  #One message per recipient, so addresses are never disclosed to each other
+  category_name = post.category.name if post.category else "General"
+  return EmailMessage(
+    subject=f"New Post: {post.title}",
+    body=f"{post.author.username} just published a new post in {category_name}!\n\nRead it here: http://myblog.com/posts/{post.id}/",
+    from_email=FROM_EMAIL,
+    to=[email],
+    connection=connection,
+  )
@@ -0,0 +1,129 @@
+#Transactional outbox.
+#Request code never talks to the mail server or runs fan-out inline: it records an
+#OutboxEvent in the same transaction as the model change, and the drainer (the
+#drain_outbox command or Celery task) carries the events out in batches with retries.
+#An event that fails MAX_ATTEMPTS times is dead-lettered: it is logged as an error,
+#left in the table (dead_letters()) and reported by drain_outbox until it is requeued.
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+#A claimed event is hidden from other drainers this long; a crashed drainer's events reappear after it
+LEASE = timedelta(minutes=5)
+BACKOFF_BASE = timedelta(seconds=30)
+
+#Topics
+POST_FAN_OUT = 'post.fan_out'
+TIMELINE_REBUILD = 'timeline.rebuild'
+POST_NOTIFY_SUBSCRIBERS = 'post.notify_subscribers'
+POST_SHARE = 'post.share'
+RATING_FIVE_STAR = 'rating.five_star'
+
+_handlers = {}
+_inline_handlers = {}
+
+
+def register(topic, handler, inline_handler=None):
+  """
+  Handlers are called as handler(**payload). `inline_handler` replaces the handler
+  when the drainer runs without a Celery worker (drain(inline=True)), for handlers
+  that would otherwise hand part of their work to one.
+  """
+  _handlers[topic] = handler
+  _inline_handlers[topic] = inline_handler or handler
+
+
+def enqueue(topic, **payload):
+  """
+  Records a side effect. Call it inside the transaction of the change that causes it,
+  so the event exists if and only if the change was committed.
+  """
+  return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def get_backoff(attempts):
+  return BACKOFF_BASE * (2 ** (attempts - 1))
+
+
+def claim_batch(batch_size=None, now=None):
+  """
+  Leases a batch of due events to this drainer. Concurrent drainers skip rows
+  that are already locked where the database supports it.
+  """
+  now = now or timezone.now()
+  with transaction.atomic():
+    due = OutboxEvent.objects.filter(
+      processed_at__isnull=True, available_at__lte=now, attempts__lt=MAX_ATTEMPTS
+    ).order_by('available_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+      due = due.select_for_update(skip_locked=True)
+    events = list(due[:batch_size or BATCH_SIZE])
+    OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(available_at=now + LEASE)
+  return events
+
+
+def process_event(event, inline=False):
+  handler = (_inline_handlers if inline else _handlers).get(event.topic)
+  try:
+    if handler is None:
+      raise LookupError(f"No outbox handler for topic '{event.topic}'")
+    handler(**event.payload)
+  except Exception as exc:
+    attempts = event.attempts + 1
+    if attempts >= MAX_ATTEMPTS:
+      logger.error("Outbox event %s (%s) dead-lettered after %s attempts: %s", event.pk, event.topic, attempts, exc)
+    else:
+      logger.warning("Outbox event %s (%s) failed, attempt %s: %s", event.pk, event.topic, attempts, exc)
+    OutboxEvent.objects.filter(pk=event.pk).update(
+      attempts=F('attempts') + 1,
+      last_error=repr(exc),
+      available_at=timezone.now() + get_backoff(attempts),
+    )
+    return False
+
+  OutboxEvent.objects.filter(pk=event.pk).update(attempts=F('attempts') + 1, processed_at=timezone.now())
+  return True
+
+
+def drain(batch_size=None, max_batches=None, inline=False):
+  """
+  Processes due events batch by batch until none are left (or max_batches).
+  With `inline`, everything runs in this process (no Celery worker needed).
+  Returns (processed, failed).
+  """
+  processed = failed = batches = 0
+  while max_batches is None or batches < max_batches:
+    events = claim_batch(batch_size)
+    if not events:
+      break
+    batches += 1
+    for event in events:
+      if process_event(event, inline):
+        processed += 1
+      else:
+        failed += 1
+  return processed, failed
+
+
+def dead_letters():
+  #Events that used up their attempts; they are never claimed again until requeued
+  return OutboxEvent.objects.filter(processed_at__isnull=True, attempts__gte=MAX_ATTEMPTS)
+
+
+def requeue_dead_letters():
+  return dead_letters().update(attempts=0, available_at=timezone.now())
+
+
+def purge_processed(older_than=timedelta(days=7)):
+  return OutboxEvent.objects.filter(processed_at__lt=timezone.now() - older_than).delete()[0]
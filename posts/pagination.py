@@ -0,0 +1,222 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class StandardPagination(pagination.PageNumberPagination):
+  #Project default: clients may ask for up to max_page_size items with ?page_size=
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+
+
+class KeysetPagination(pagination.BasePagination):
+  """
+  Forward-only keyset pagination on a compound key such as (published_at, id).
+
+  The cursor is an opaque token holding the key of the last row of the page,
+  so every page is a single indexed range scan: no OFFSET and no COUNT(*).
+  Views choose the key with a `cursor_ordering` attribute, which may also name
+  annotations of the queryset (e.g. the search_rank set by PostSearchFilter).
+  """
+  page_size = api_settings.PAGE_SIZE
+  page_size_query_param = StandardPagination.page_size_query_param
+  max_page_size = StandardPagination.max_page_size
+  cursor_query_param = 'cursor'
+  ordering = ('-published_at', '-id')
+  invalid_cursor_message = 'Invalid cursor'
+
+  def get_page_size(self, request):
+    try:
+      return pagination._positive_int(
+        request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size
+      )
+    except (KeyError, ValueError):
+      return self.page_size
+
+  def get_ordering(self, view):
+    return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+  def get_page_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.ordering = self.get_ordering(view)
+    self.model = queryset.model
+    #Sources with their own order (see below) have no annotations to key on
+    self.annotations = queryset.query.annotations if hasattr(queryset, 'query') else {}
+    self.page_size = self.get_page_size(request)
+
+    position = self.decode_cursor(request)
+    if hasattr(queryset, 'after'):
+      #Sources that keep their own order, such as posts.timeline.TimelineFeed
+      queryset = queryset.after(position)
+    else:
+      queryset = queryset.order_by(*self.ordering)
+      if position is not None:
+        queryset = queryset.filter(self.build_filter(position))
+
+    #One extra row tells whether there is a next page
+    return queryset[:self.page_size + 1]
+
+  def set_page(self, results):
+    self.has_next = len(results) > self.page_size
+    self.page = results[:self.page_size]
+    return self.page
+
+  def paginate_queryset(self, queryset, request, view=None):
+    return self.set_page(list(self.get_page_queryset(queryset, request, view)))
+
+  async def apaginate_queryset(self, queryset, request, view=None):
+    #Same page, read through the async ORM
+    return self.set_page([obj async for obj in self.get_page_queryset(queryset, request, view)])
+
+  def build_filter(self, position):
+    """
+    Builds the "strictly after this key" predicate, e.g. for (-published_at, -id):
+    published_at < p OR (published_at = p AND id < i)
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(self.ordering, position):
+      name = field.lstrip('-')
+      lookup = 'lt' if field.startswith('-') else 'gt'
+      condition |= equal & Q(**{f'{name}__{lookup}': value})
+      equal &= Q(**{name: value})
+    return condition
+
+  def get_field(self, name):
+    if name in self.annotations:
+      return self.annotations[name].output_field
+    return self.model._meta.get_field(name)
+
+  def get_position(self, instance):
+    return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+  def encode_cursor(self, position):
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+  def decode_cursor(self, request):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None
+
+    try:
+      values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+      if not isinstance(values, list) or len(values) != len(self.ordering):
+        raise ValueError
+      #Cursors only ever hold strings and numbers; null (or a list, an object, a bool)
+      #cannot come from encode_cursor() and would reach the ORM as a query value
+      if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+        raise ValueError
+      #Let each model field parse its own value back (e.g. ISO datetimes)
+      position = [
+        self.get_field(field.lstrip('-')).to_python(value)
+        for field, value in zip(self.ordering, values)
+      ]
+      if None in position:
+        raise ValueError
+      return position
+    except (TypeError, ValueError, binascii.Error, ValidationError):
+      raise NotFound(self.invalid_cursor_message)
+
+  def get_next_link(self):
+    if not self.has_next or not self.page:
+      return None
+    url = self.request.build_absolute_uri()
+    return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.get_position(self.page[-1])))
+
+  def get_paginated_response(self, data):
+    return Response({
+      'next': self.get_next_link(),
+      'results': data,
+    })
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'required': ['results'],
+      'properties': {
+        'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'results': schema,
+      },
+    }
+
+
+class FeedPagination(StandardPagination):
+  """
+  Page-number pagination by default. Clients switch a request to keyset mode
+  by sending ?cursor=<token> (or ?pagination=cursor for the first page).
+  """
+  mode_query_param = 'pagination'
+  keyset_class = KeysetPagination
+
+  def use_keyset(self, request):
+    return (
+      self.keyset_class.cursor_query_param in request.query_params
+      or request.query_params.get(self.mode_query_param) == 'cursor'
+    )
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.keyset = None
+    if self.use_keyset(request):
+      self.keyset = self.keyset_class()
+      return self.keyset.paginate_queryset(queryset, request, view)
+    return super().paginate_queryset(queryset, request, view)
+
+  async def apaginate_queryset(self, queryset, request, view=None):
+    """
+    paginate_queryset() for async views: the COUNT and the page go through the
+    async ORM, and the page is built so get_paginated_response() works unchanged.
+    """
+    self.keyset = None
+    if self.use_keyset(request):
+      self.keyset = self.keyset_class()
+      return await self.keyset.apaginate_queryset(queryset, request, view)
+
+    self.request = request
+    page_size = self.get_page_size(request)
+    paginator = self.django_paginator_class(queryset, page_size)
+    paginator.count = await queryset.acount()
+    page_number = self.get_page_number(request, paginator)
+    try:
+      number = paginator.validate_number(page_number)
+    except InvalidPage as exc:
+      raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+    bottom = (number - 1) * page_size
+    results = [obj async for obj in queryset[bottom:bottom + page_size]]
+    self.page = paginator._get_page(results, number, paginator)
+    return list(self.page)
+
+  def get_paginated_response(self, data):
+    if self.keyset is not None:
+      return self.keyset.get_paginated_response(data)
+    return super().get_paginated_response(data)
+
+  def get_schema_operation_parameters(self, view):
+    parameters = super().get_schema_operation_parameters(view)
+    parameters += [
+      {
+        'name': self.keyset_class.cursor_query_param,
+        'required': False,
+        'in': 'query',
+        'description': 'Opaque cursor returned in "next". Switches the endpoint to keyset pagination.',
+        'schema': {'type': 'string'},
+      },
+      {
+        'name': self.mode_query_param,
+        'required': False,
+        'in': 'query',
+        'description': 'Set to "cursor" to request the first page in keyset mode (no total count).',
+        'schema': {'type': 'string', 'enum': ['page', 'cursor']},
+      },
+    ]
+    return parameters
@@ -0,0 +1,190 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+from html import unescape
+
+import bleach
+import markdown
+from django.conf import settings
+
+from blogging_platform_api.instrumentation import record_cache, timer
+
+
+#Markdown extensions and sanitizer policy used for every post body
+#extensions=['extra'] adds support for tables, footnotes, etc.
+MARKDOWN_EXTENSIONS = ['extra', 'codehilite']
+
+ALLOWED_TAGS = [
+  'p', 'b', 'i', 'u', 'em', 'strong', 'a', 'h1', 'h2', 'h3', 'li', 'ul', 'ol', 'code', 'pre'
+]
+ALLOWED_ATTRS = {'a': ['href', 'title']}
+
+#Fields derived from the content at save time
+RENDERED_FIELDS = ['content_hash', 'content_html', 'excerpt', 'word_count', 'reading_time', 'first_image']
+
+EXCERPT_LENGTH = 280
+WORDS_PER_MINUTE = 200
+#Markdown image ![alt](src) or an inline <img src="...">
+IMAGE_RE = re.compile(r'!\[[^\]]*\]\(\s*<?([^)\s>]+)|<img[^>]+src=["\']([^"\']+)')
+#first_image is handed to clients as-is, so only absolute http(s) URLs qualify (no javascript:, data:, ...)
+IMAGE_URL_RE = re.compile(r'https?://[^\s"\'<>]+', re.IGNORECASE)
+
+
+def get_render_policy():
+  """
+  Returns a stable string describing how content is rendered.
+  Changing the extensions, the allowed tags or the summary settings changes the policy, which
+  invalidates every stored render without a migration.
+  """
+  tags = ','.join(sorted(ALLOWED_TAGS))
+  attrs = ';'.join(f"{tag}={','.join(sorted(names))}" for tag, names in sorted(ALLOWED_ATTRS.items()))
+  summary = f"{EXCERPT_LENGTH},{WORDS_PER_MINUTE},images:http,https"
+  return f"md:{','.join(MARKDOWN_EXTENSIONS)}|tags:{tags}|attrs:{attrs}|summary:{summary}"
+
+
+def compute_content_hash(content):
+  #Hash of the render policy + the raw markdown, used as the cache key
+  digest = hashlib.sha256()
+  digest.update(get_render_policy().encode('utf-8'))
+  digest.update(b'\0')
+  digest.update((content or '').encode('utf-8'))
+  return digest.hexdigest()
+
+
+def render_markdown(content):
+  """
+  Converts the raw 'content' (Markdown) into sanitized HTML plus the summary
+  fields. Returns a dict keyed by the RENDERED_FIELDS it fills.
+  """
+  with timer('render'):
+    raw_html = markdown.markdown(content or '', extensions=MARKDOWN_EXTENSIONS)
+    rendered = {'content_html': bleach.clean(raw_html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS)}
+    rendered.update(summarize(content, raw_html))
+  return rendered
+
+
+class RenderCache:
+  """
+  Small thread-safe, process-local LRU mapping content hashes to renders.
+  """
+  def __init__(self, maxsize=512):
+    self.maxsize = maxsize
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      rendered = self._data.get(key)
+      if rendered is not None:
+        self._data.move_to_end(key)
+      return rendered
+
+  def set(self, key, rendered):
+    with self._lock:
+      self._data[key] = rendered
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+
+render_cache = RenderCache(maxsize=getattr(settings, 'POST_RENDER_CACHE_SIZE', 512))
+
+
+def render_content(content, content_hash=None):
+  """
+  Returns (content_hash, rendered_fields) for the given markdown, going through the LRU.
+  """
+  content_hash = content_hash or compute_content_hash(content)
+  rendered = render_cache.get(content_hash)
+  record_cache('render', rendered is not None)
+  if rendered is None:
+    rendered = render_markdown(content)
+    render_cache.set(content_hash, rendered)
+  return content_hash, rendered
+
+
+def summarize(content, raw_html):
+  """
+  Returns the plain-text summary fields for a post, derived from its markdown
+  source and the unsanitized HTML (so stripped tags leave no markup behind).
+  """
+  text = ' '.join(unescape(bleach.clean(raw_html, tags=[], strip=True)).split())
+  words = len(text.split())
+
+  excerpt = text
+  if len(text) > EXCERPT_LENGTH:
+    #Cut on a word boundary
+    excerpt = text[:EXCERPT_LENGTH].rsplit(' ', 1)[0].rstrip(' .,;:') + '…'
+
+  return {
+    'excerpt': excerpt,
+    'word_count': words,
+    'reading_time': max(1, math.ceil(words / WORDS_PER_MINUTE)) if words else 0,
+    'first_image': find_first_image(content),
+  }
+
+
+def find_first_image(content):
+  #The first image whose URL is safe to hand out; entities are decoded before the check
+  for match in IMAGE_RE.finditer(content or ''):
+    url = unescape(match.group(1) or match.group(2)).strip()
+    if IMAGE_URL_RE.fullmatch(url) and len(url) <= 500:
+      return url
+  return ''
+
+
+def refresh_render(post):
+  """
+  Updates the stored render and summary on a Post instance if its content or
+  the render policy changed. Returns True when the fields were refreshed.
+  """
+  content_hash = compute_content_hash(post.content)
+  if post.content_hash == content_hash:
+    return False
+
+  post.content_hash, rendered = render_content(post.content, content_hash)
+  for field, value in rendered.items():
+    setattr(post, field, value)
+  return True
+
+
+def ensure_rendered(post):
+  """
+  Makes sure a loaded post carries a current render. Stale rows (e.g. after the
+  allowed-tags policy changed) are re-rendered in memory only: reads never write,
+  so they can be served from a replica. refresh_stored_renders() persists them.
+  """
+  refresh_render(post)
+  return post
+
+
+def refresh_stored_renders(queryset, batch_size=500):
+  """
+  Re-renders and saves every post of `queryset` whose stored render is stale, in
+  primary key chunks (the `refresh_renders` command, run after a deploy that changes
+  the policy). Returns the number of posts updated.
+  """
+  queryset = queryset.order_by('pk').only('pk', 'content', *RENDERED_FIELDS)
+  updated = 0
+  last = 0
+  while True:
+    posts = list(queryset.filter(pk__gt=last)[:batch_size])
+    if not posts:
+      return updated
+    last = posts[-1].pk
+    stale = [post for post in posts if refresh_render(post)]
+    if stale:
+      #Written without save() so signals and timestamps are untouched
+      queryset.model._default_manager.bulk_update(stale, RENDERED_FIELDS)
+      updated += len(stale)
+
+
+def get_content_html(post):
+  #Returns the sanitized HTML for a post, reading the stored render when it is still valid
+  return ensure_rendered(post).content_html
@@ -0,0 +1,120 @@
+#Shared response cache for anonymous list endpoints.
+#Anonymous responses are identical for every visitor, so their serialized data is
+#cached under (host, path, normalized query params, generation). Publishing, editing
+#or deleting a post and changing a category bump the generation, which retires every
+#cached response at once; old entries simply expire.
+#The cache must be shared by every worker process, or a write would only retire the
+#responses of the process that handled it: with a process-local cache nothing is cached.
+import asyncio
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from blogging_platform_api import caching
+from blogging_platform_api.instrumentation import record_cache
+
+
+GENERATION_KEY = 'responses:generation'
+CACHE_TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+
+#Stampede protection: one request rebuilds a missing entry, the others wait for it
+LOCK_TIMEOUT = 10
+WAIT_INTERVAL = 0.05
+WAIT_ATTEMPTS = 20
+
+
+def get_generation():
+  return caching.get_version(GENERATION_KEY)
+
+
+def bump_generation():
+  caching.bump_version(GENERATION_KEY)
+
+
+def normalize_query(query_params):
+  #Sorted, without empty values, so ?b=2&a=1 and ?a=1&b=2&c= share an entry
+  items = sorted(
+    (name, value)
+    for name, values in query_params.lists()
+    for value in values
+    if value != ''
+  )
+  return urlencode(items)
+
+
+def get_cache_key(request):
+  source = f'{request.get_host()}|{request.path}|{normalize_query(request.query_params)}'
+  digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+  return f'responses:{get_generation()}:{digest}'
+
+
+class AnonymousResponseCacheMixin:
+  """
+  Serves list() for anonymous users from the shared cache.
+  Authenticated requests carry per-user fields (has_liked, drafts) and are never cached.
+  """
+
+  def list(self, request, *args, **kwargs):
+    if request.user.is_authenticated or not caching.is_shared_cache():
+      return super().list(request, *args, **kwargs)
+
+    key = get_cache_key(request)
+    data = cache.get(key)
+    record_cache('responses', data is not None)
+    if data is not None:
+      return Response(data)
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, True, LOCK_TIMEOUT):
+      #Someone else is building this entry; wait briefly instead of piling onto the database
+      for _ in range(WAIT_ATTEMPTS):
+        time.sleep(WAIT_INTERVAL)
+        data = cache.get(key)
+        if data is not None:
+          return Response(data)
+      return super().list(request, *args, **kwargs)
+
+    try:
+      response = super().list(request, *args, **kwargs)
+      if response.status_code == 200:
+        cache.set(key, response.data, CACHE_TIMEOUT)
+      return response
+    finally:
+      cache.delete(lock_key)
+
+
+async def acached_response_data(request, build):
+  """
+  The anonymous cache of AnonymousResponseCacheMixin for async views. `build` is a
+  coroutine function returning the response data; waits for another request's
+  rebuild yield to the event loop instead of holding a thread.
+  """
+  if request.user.is_authenticated or not caching.is_shared_cache():
+    return await build()
+
+  key = await sync_to_async(get_cache_key)(request)
+  data = await cache.aget(key)
+  record_cache('responses', data is not None)
+  if data is not None:
+    return data
+
+  lock_key = f'{key}:lock'
+  if not await cache.aadd(lock_key, True, LOCK_TIMEOUT):
+    for _ in range(WAIT_ATTEMPTS):
+      await asyncio.sleep(WAIT_INTERVAL)
+      data = await cache.aget(key)
+      if data is not None:
+        return data
+    return await build()
+
+  try:
+    data = await build()
+    await cache.aset(key, data, CACHE_TIMEOUT)
+    return data
+  finally:
+    await cache.adelete(lock_key)
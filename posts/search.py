@@ -0,0 +1,244 @@
+#Inverted-index full-text search for posts.
+#Posts are tokenized on save into SearchPosting rows (term, post, frequency, positions).
+#Queries only read the postings of their own terms, are ranked with BM25 and support
+#"quoted phrases" and prefix* terms. Runs on SQLite and MySQL, no external service.
+import hashlib
+import math
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from blogging_platform_api import caching
+from blogging_platform_api.instrumentation import record_cache
+
+from .models import Post, SearchDocument, SearchPosting
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+PHRASE_RE = re.compile(r'"([^"]*)"')
+MAX_TERM_LENGTH = 64
+
+#Title matches count double; fields are spaced apart so phrases never span them
+FIELD_WEIGHTS = (('title', 2), ('content', 1), ('author', 1), ('tags', 1))
+FIELD_GAP = 1000
+
+#BM25 parameters
+K1 = 1.2
+B = 0.75
+
+MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+MAX_PREFIX_EXPANSIONS = 50
+MAX_CANDIDATE_FILTER = 5000 #Larger candidate sets are intersected in Python
+CACHE_TIMEOUT = getattr(settings, 'SEARCH_CACHE_TIMEOUT', 300)
+GENERATION_KEY = 'search:generation'
+
+
+def tokenize(text):
+  return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def get_index_fields(post):
+  tags = ' '.join(tag.name for tag in post.tags.all()) if post.pk else ''
+  return {
+    'title': post.title,
+    'content': post.content,
+    'author': post.author.username,
+    'tags': tags,
+  }
+
+
+def build_postings(fields):
+  """
+  Returns ({term: (weighted_frequency, positions)}, document_length).
+  """
+  postings = {}
+  length = 0
+  offset = 0
+  for name, weight in FIELD_WEIGHTS:
+    tokens = tokenize(fields.get(name))
+    for position, term in enumerate(tokens, start=offset):
+      frequency, positions = postings.get(term, (0, []))
+      positions.append(position)
+      postings[term] = (frequency + weight, positions)
+    length += len(tokens) * weight
+    offset += len(tokens) + FIELD_GAP
+  return postings, length
+
+
+def index_post(post):
+  """
+  (Re)indexes a single post. Skips the write when the indexed text is unchanged.
+  """
+  fields = get_index_fields(post)
+  signature = hashlib.sha256('\0'.join(fields[name] or '' for name, _ in FIELD_WEIGHTS).encode('utf-8')).hexdigest()
+
+  if SearchDocument.objects.filter(post_id=post.pk, signature=signature).exists():
+    return False
+
+  postings, length = build_postings(fields)
+  with transaction.atomic():
+    SearchPosting.objects.filter(post_id=post.pk).delete()
+    SearchPosting.objects.bulk_create([
+      SearchPosting(term=term, post_id=post.pk, frequency=frequency, positions=positions)
+      for term, (frequency, positions) in postings.items()
+    ], batch_size=1000)
+    SearchDocument.objects.update_or_create(post_id=post.pk, defaults={'length': length, 'signature': signature})
+
+  bump_generation()
+  return True
+
+
+def rebuild_index(queryset=None):
+  queryset = queryset if queryset is not None else Post.objects.all()
+  indexed = 0
+  for post in queryset.select_related('author').prefetch_related('tags').iterator(chunk_size=500):
+    indexed += index_post(post)
+  return indexed
+
+
+def get_generation():
+  #A shared counter, so a reindex on one worker retires every worker's cached results
+  return caching.get_version(GENERATION_KEY)
+
+
+def bump_generation():
+  caching.bump_version(GENERATION_KEY)
+
+
+def parse_query(query):
+  """
+  Splits a query into clauses: ('term', t), ('prefix', p) or ('phrase', [t, ...]).
+  """
+  clauses = []
+  for phrase in PHRASE_RE.findall(query):
+    terms = tokenize(phrase)
+    if len(terms) == 1:
+      clauses.append(('term', terms[0]))
+    elif terms:
+      clauses.append(('phrase', terms))
+
+  for word in PHRASE_RE.sub(' ', query).split():
+    terms = tokenize(word)
+    if not terms:
+      continue
+    #In 'foo-bar*' only the last token is a prefix
+    clauses += [('term', term) for term in terms[:-1]]
+    clauses.append(('prefix' if word.endswith('*') else 'term', terms[-1]))
+
+  return clauses
+
+
+def expand_clause(clause):
+  kind, value = clause
+  if kind == 'prefix':
+    return list(
+      SearchPosting.objects.filter(term__istartswith=value)
+      .order_by('term').values_list('term', flat=True).distinct()[:MAX_PREFIX_EXPANSIONS]
+    )
+  if kind == 'phrase':
+    return list(dict.fromkeys(value))
+  return [value]
+
+
+def get_collection_stats():
+  stats = SearchDocument.objects.aggregate(total=Count('pk'), avg_length=Avg('length'))
+  return stats['total'] or 0, stats['avg_length'] or 0.0
+
+
+def phrase_matches(terms, positions_by_term):
+  #True when the terms appear at consecutive positions
+  first, rest = terms[0], terms[1:]
+  followers = [set(positions_by_term.get(term, ())) for term in rest]
+  for start in positions_by_term.get(first, ()):
+    if all(start + i + 1 in positions for i, positions in enumerate(followers)):
+      return True
+  return False
+
+
+def run_search(query, limit=MAX_RESULTS):
+  """
+  Returns a list of (post_id, score), best match first. Every clause must match.
+  """
+  clauses = parse_query(query)
+  if not clauses:
+    return []
+
+  expanded = [(clause, expand_clause(clause)) for clause in clauses]
+  if any(not terms for _, terms in expanded):
+    return []
+
+  all_terms = {term for _, terms in expanded for term in terms}
+  needs_positions = any(clause[0] == 'phrase' for clause, _ in expanded)
+
+  #Document frequency for every term, then start from the rarest clause
+  df = dict(
+    SearchPosting.objects.filter(term__in=all_terms).values('term').annotate(n=Count('pk')).values_list('term', 'n')
+  )
+  expanded.sort(key=lambda item: sum(df.get(term, 0) for term in item[1]))
+
+  candidates = None
+  postings = {}
+  for clause, terms in expanded:
+    rows = SearchPosting.objects.filter(term__in=terms)
+    if candidates is not None and len(candidates) <= MAX_CANDIDATE_FILTER:
+      rows = rows.filter(post_id__in=candidates)
+    fields = ['post_id', 'term', 'frequency'] + (['positions'] if needs_positions else [])
+
+    matched = set()
+    for row in rows.values(*fields).iterator(chunk_size=2000):
+      postings.setdefault(row['post_id'], {})[row['term']] = row
+      matched.add(row['post_id'])
+
+    candidates = matched if candidates is None else candidates & matched
+    if not candidates:
+      return []
+
+  total, avg_length = get_collection_stats()
+  lengths = {}
+  candidate_ids = list(candidates)
+  for start in range(0, len(candidate_ids), 1000):
+    chunk = candidate_ids[start:start + 1000]
+    lengths.update(SearchDocument.objects.filter(post_id__in=chunk).values_list('post_id', 'length'))
+
+  results = []
+  for post_id in candidates:
+    doc = postings[post_id]
+
+    if needs_positions:
+      positions_by_term = {term: row['positions'] for term, row in doc.items()}
+      if not all(phrase_matches(clause[1], positions_by_term) for clause, _ in expanded if clause[0] == 'phrase'):
+        continue
+
+    length = lengths.get(post_id, 0)
+    score = 0.0
+    for term, row in doc.items():
+      idf = math.log(1 + (total - df.get(term, 0) + 0.5) / (df.get(term, 0) + 0.5))
+      tf = row['frequency']
+      norm = 1 - B + B * (length / avg_length if avg_length else 1)
+      score += idf * (tf * (K1 + 1)) / (tf + K1 * norm)
+    results.append((post_id, score))
+
+  results.sort(key=lambda item: (-item[1], -item[0]))
+  return results[:limit]
+
+
+def search(query, limit=MAX_RESULTS):
+  """
+  Cached front for run_search(). Cache entries are keyed by the index
+  generation, so any reindex invalidates them all at once.
+  """
+  normalized = ' '.join(query.lower().split())
+  if not normalized:
+    return []
+
+  digest = hashlib.sha1(f'{normalized}|{limit}'.encode('utf-8')).hexdigest()
+  key = f'search:{get_generation()}:{digest}'
+  results = cache.get(key)
+  record_cache('search', results is not None)
+  if results is None:
+    results = run_search(normalized, limit)
+    cache.set(key, results, CACHE_TIMEOUT)
+  return results
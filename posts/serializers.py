@@ -1,13 +1,15 @@
 from rest_framework import serializers
+from django.db import models
 from .models import Post, Category, Tag, Comment, Rating
-from .utils import get_social_share_links
+from .utils import get_social_share_links, alist
 from drf_spectacular.utils import extend_schema_field
 from drf_spectacular.types import OpenApiTypes
-import markdown
-import bleach
+from .rendering import get_content_html, ensure_rendered
+from .engagement import ACTIONS, RATE, MAX_OPERATIONS
+from blogging_platform_api.instrumentation import TimedSerializerMixin
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
   author_username = serializers.ReadOnlyField(source='author.username')
 
   class Meta:
@@ -15,7 +17,63 @@ class CommentSerializer(serializers.ModelSerializer):
     fields = ['id', 'post', 'author_username', 'content', 'created_at']
     read_only_fields = ['author', 'post']
 
-class PostSerializer(serializers.ModelSerializer):
+def load_user_engagement(user, post_ids):
+  """
+  Returns (liked_post_ids, {post_id: score}) for the user across post_ids.
+  Always two queries, no matter how many posts are on the page.
+  """
+  liked = set(
+    Post.likes.through.objects.filter(user_id=user.pk, post_id__in=post_ids).values_list('post_id', flat=True)
+  )
+  scores = dict(
+    Rating.objects.filter(user_id=user.pk, post_id__in=post_ids).values_list('post_id', 'score')
+  )
+  return liked, scores
+
+
+async def aload_user_engagement(user, post_ids):
+  #load_user_engagement() for async views. The two queries still run one after the
+  #other: the async ORM runs them on the request's thread, so gathering them gains nothing
+  liked = await alist(Post.likes.through.objects.filter(user_id=user.pk, post_id__in=post_ids).values_list('post_id', flat=True))
+  scores = await alist(Rating.objects.filter(user_id=user.pk, post_id__in=post_ids).values_list('post_id', 'score'))
+  return set(liked), dict(scores)
+
+
+async def apreload_engagement(context, posts):
+  """
+  Fills the serializer context's 'engagement' for `posts` ahead of serialization,
+  so async views serialize without touching the database.
+  """
+  engagement = context.setdefault('engagement', {})
+  request = context.get('request')
+  if posts and request is not None and request.user.is_authenticated:
+    liked, scores = await aload_user_engagement(request.user, [post.pk for post in posts])
+    for post in posts:
+      engagement[post.pk] = (post.pk in liked, scores.get(post.pk))
+  return context
+
+
+class PostListSerializer(serializers.ListSerializer):
+  """
+  Collects the ids of the posts on the page and resolves the requesting user's
+  likes and ratings for all of them at once, instead of once per post.
+  """
+  def to_representation(self, data):
+    iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+    posts = list(iterable)
+
+    request = self.context.get('request')
+    #Async views preload the engagement (see apreload_engagement)
+    if posts and request is not None and request.user.is_authenticated and 'engagement' not in self.context:
+      liked, scores = load_user_engagement(request.user, [post.pk for post in posts])
+      engagement = self.context.setdefault('engagement', {})
+      for post in posts:
+        engagement[post.pk] = (post.pk in liked, scores.get(post.pk))
+
+    return [self.child.to_representation(post) for post in posts]
+
+
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
   # Use StringRelatedField to show the author's username instead of their ID
   author = serializers.ReadOnlyField(source='author.username')
   # Use SlugRelatedField to show category name, and make it required
@@ -35,9 +93,15 @@ class PostSerializer(serializers.ModelSerializer):
     required=False, #Tages are optional requirement
   )
 
-  likes_count = serializers.ReadOnlyField(source='total_likes')
+  likes_count = serializers.ReadOnlyField(source='like_count')
+  comments_count = serializers.ReadOnlyField(source='comment_count')
   has_liked = serializers.SerializerMethodField()
+  has_rated = serializers.SerializerMethodField()
+  my_score = serializers.SerializerMethodField()
+  #Rating aggregates are stored on the post, so these cost no queries
   avg_rating = serializers.FloatField(read_only=True)
+  ratings_count = serializers.ReadOnlyField(source='rating_count')
+  rating_distribution = serializers.DictField(child=serializers.IntegerField(), read_only=True)
 
   #share_links = serializers.SerializerMethodField()
 
@@ -46,33 +110,47 @@ class PostSerializer(serializers.ModelSerializer):
 
   class Meta:
     model = Post
-    fields = ['id', 'title', 'content', 'author', 'status_display', 'category', 'created_at', 'has_liked', 'likes_count', 'comments', 'content_html', 'avg_rating', 'tags', 'status']
+    fields = ['id', 'title', 'content', 'author', 'status_display', 'category', 'created_at', 'has_liked', 'has_rated', 'my_score', 'likes_count', 'comments_count', 'comments', 'content_html', 'avg_rating', 'ratings_count', 'rating_distribution', 'tags', 'status']
 
     read_only_fields = ('author',) #These are set by the server, not the user
+    list_serializer_class = PostListSerializer
 
-  def get_has_liked(self, obj):
+  def get_engagement(self, obj):
+    """
+    Returns (has_liked, my_score) for the requesting user. List pages fill the
+    'engagement' context in bulk; single posts fall back to a direct lookup.
+    """
     request = self.context.get('request')
     if request is None or not request.user.is_authenticated:
-      return False
-    
-    #Check if the user exists in the ManyToMany relationship
-    return obj.likes.filter(pk=request.user.pk).exists()
+      return False, None
 
-  @extend_schema_field(OpenApiTypes.STR)
-  def get_content_html(self, obj):
-    
+    engagement = self.context.setdefault('engagement', {})
+    if obj.pk not in engagement:
+      liked, scores = load_user_engagement(request.user, [obj.pk])
+      engagement[obj.pk] = (obj.pk in liked, scores.get(obj.pk))
+    return engagement[obj.pk]
+
+  @extend_schema_field(OpenApiTypes.BOOL)
+  def get_has_liked(self, obj):
+    return self.get_engagement(obj)[0]
 
-    #Converts the raw 'content' (Markdown) into HTML
-    #extensions=['extra'] adds support for tables, footnotes, etc.
-    html =  markdown.markdown(obj.content, extensions=['extra', 'codehilite'])
+  @extend_schema_field(OpenApiTypes.BOOL)
+  def get_has_rated(self, obj):
+    return self.get_engagement(obj)[1] is not None
 
-    #Define which HTML tags are allowed
-    allowed_tags = [
-      'p', 'b', 'i', 'u', 'em', 'string', 'a', 'h1', 'h2', 'h3', 'li', 'ul', 'ol', 'code', 'pre'
-    ]
-    allowed_attrs = {'a': ['href', 'title']}
+  @extend_schema_field(OpenApiTypes.INT)
+  def get_my_score(self, obj):
+    return self.get_engagement(obj)[1]
 
-    return bleach.clean(html, tags=allowed_tags, attributes=allowed_attrs)
+  def to_representation(self, instance):
+    #Stale renders (e.g. after a policy change) are redone in memory, never saved here
+    ensure_rendered(instance)
+    return super().to_representation(instance)
+
+  @extend_schema_field(OpenApiTypes.STR)
+  def get_content_html(self, obj):
+    #Reads the HTML rendered at save time
+    return get_content_html(obj)
 
   @extend_schema_field(OpenApiTypes.OBJECT)
   def get_share_links(self, obj):
@@ -83,19 +161,45 @@ class PostSerializer(serializers.ModelSerializer):
     return None
 
 
-class RatingSerializer(serializers.ModelSerializer):
+class PostSummarySerializer(PostSerializer):
+  """
+  Lean representation for list endpoints: a precomputed plain-text excerpt
+  instead of the full body, rendered HTML and nested comments.
+  The full form stays on PostDetailView.
+  """
+  content_html = None
+  comments = None
+
+  class Meta(PostSerializer.Meta):
+    fields = ['id', 'title', 'excerpt', 'word_count', 'reading_time', 'first_image', 'author', 'status_display', 'category', 'created_at', 'published_at', 'has_liked', 'has_rated', 'my_score', 'likes_count', 'comments_count', 'avg_rating', 'ratings_count', 'tags', 'status']
+    read_only_fields = ('author', 'excerpt', 'word_count', 'reading_time', 'first_image', 'published_at')
+
+
+class RatingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = ['score']
 
 
-class CategorySerializer(serializers.ModelSerializer):
-  post_count = serializers.SerializerMethodField()
+class EngagementOperationSerializer(serializers.Serializer):
+  post = serializers.IntegerField()
+  action = serializers.ChoiceField(choices=ACTIONS)
+  score = serializers.IntegerField(min_value=1, max_value=5, required=False)
+
+  def validate(self, attrs):
+    if attrs['action'] == RATE and 'score' not in attrs:
+      raise serializers.ValidationError({'score': 'This field is required for "rate".'})
+    return attrs
+
+
+class BulkEngagementSerializer(serializers.Serializer):
+  operations = EngagementOperationSerializer(many=True, allow_empty=False, max_length=MAX_OPERATIONS)
+
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+  #Published posts only, maintained on the category row
+  post_count = serializers.IntegerField(read_only=True)
 
   class Meta:
     model = Category
-    fields = ['id', 'name', 'post_count']
-
-  def get_post_count(self, obj):
-    #Counts only posts that are Published
-    return Post.objects.filter(category=obj, status='PB').count()
\ No newline at end of file
+    fields = ['id', 'name', 'post_count']
\ No newline at end of file
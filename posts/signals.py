@@ -1,8 +1,14 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from .models import Rating, Post
-from .tasks import send_rating_notification_email, notify_subscribers
+from users.models import Follow
+from .models import Rating, Post, CategorySubscription, Category
+from . import outbox
+from .timeline import remove_post
+from .search import index_post, bump_generation
+from .counters import adjust_category_post_count
+from .directory import bump_version as bump_category_directory
+from .conditional import bump_feed_watermark, touch_post
+from .response_cache import bump_generation as bump_response_cache
 
 @receiver(post_save, sender=Rating)
 def notify_author_of_five_star(sender, instance, created, **kwargs):
@@ -11,16 +17,106 @@ def notify_author_of_five_star(sender, instance, created, **kwargs):
     post = instance.post
 
     if post.author.email:
-      #Execute synchronously for development (remove .delay() to avoid Celery dependency)
-      send_rating_notification_email(  # type: ignore
-        post.author.email,
-        post.author.username,
-        post.title
+      #Sent by the outbox drainer, never inside the request
+      outbox.enqueue(
+        outbox.RATING_FIVE_STAR,
+        author_email=post.author.email,
+        author_username=post.author.username,
+        post_title=post.title,
       )
 
 
 @receiver(post_save, sender=Post)
 def notify_subscribers_on_publish(sender, instance, created, **kwargs):
   if created and instance.status == Post.Status.PUBLISHED:
-    #Execute synchronously for development (remove .delay() to avoid Celery dependency)
-    notify_subscribers(instance.id)  # type: ignore
+    outbox.enqueue(outbox.POST_NOTIFY_SUBSCRIBERS, post_id=instance.id)
+
+
+@receiver(post_save, sender=Post)
+def update_timelines_on_status_change(sender, instance, created, **kwargs):
+  is_published = instance.status == Post.Status.PUBLISHED
+
+  if is_published and not instance.was_published:
+    #Fan-out-on-write: deliver the post to followers' and subscribers' timelines (via the outbox)
+    outbox.enqueue(outbox.POST_FAN_OUT, post_id=instance.id)
+  elif not is_published and instance.was_published:
+    remove_post(instance.id)
+
+
+def _is_cascade(sender, kwargs):
+  #post_delete fired because a related object (e.g. the user) is being deleted
+  origin = kwargs.get('origin')
+  return origin is not None and not isinstance(origin, sender)
+
+
+#Rebuilding a timeline rewrites hundreds of rows, so it is left to the outbox drainer
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def rebuild_timeline_on_follow_change(sender, instance, **kwargs):
+  if not _is_cascade(sender, kwargs):
+    outbox.enqueue(outbox.TIMELINE_REBUILD, user_id=instance.follower_id)
+
+
+@receiver(post_save, sender=CategorySubscription)
+@receiver(post_delete, sender=CategorySubscription)
+def rebuild_timeline_on_subscription_change(sender, instance, **kwargs):
+  if not _is_cascade(sender, kwargs):
+    outbox.enqueue(outbox.TIMELINE_REBUILD, user_id=instance.user_id)
+
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, **kwargs):
+  index_post(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_search_index_on_tags(sender, instance, action, **kwargs):
+  if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+    index_post(instance)
+    touch_post(instance.pk)
+    bump_response_cache()
+
+
+@receiver(post_delete, sender=Post)
+def drop_cached_searches(sender, instance, **kwargs):
+  #Postings cascade with the post; cached results must not return it any more
+  bump_generation()
+
+
+@receiver(post_save, sender=Post)
+def update_category_post_counts(sender, instance, created, **kwargs):
+  #A post counts towards its category while it is published
+  counted_before = instance.loaded_category_id if instance.was_published else None
+  counted_now = instance.category_id if instance.status == Post.Status.PUBLISHED else None
+
+  if counted_before == counted_now:
+    return
+  adjust_category_post_count(counted_before, -1)
+  adjust_category_post_count(counted_now, 1)
+
+
+@receiver(post_delete, sender=Post)
+def decrement_category_post_count(sender, instance, **kwargs):
+  if instance.was_published and instance.loaded_category_id:
+    adjust_category_post_count(instance.loaded_category_id, -1)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_directory(sender, instance, **kwargs):
+  bump_category_directory()
+  bump_response_cache()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_feed_watermark_on_post_change(sender, instance, **kwargs):
+  #Retires the validators of the feeds; the post's own updated_at is set by save()
+  bump_feed_watermark()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_cached_responses(sender, instance, **kwargs):
+  #Publishing, editing or deleting a post retires every cached anonymous page
+  bump_response_cache()
@@ -1,7 +1,15 @@
+from functools import partial
+from smtplib import SMTPException
+
 from celery import shared_task
-from django.core.mail import send_mail
-from .models import Post, CategorySubscription
-from users.models import Follow
+from django.core.mail import send_mail, get_connection
+from django.db.models import F
+from django.utils import timezone
+from .models import Post, NotificationDispatch
+from .notifications import iter_audience_batches, build_new_post_message
+from .timeline import fan_out_post, rebuild_timeline, trim_timelines as trim_all_timelines
+from .leaderboards import refresh_all_leaderboards
+from . import outbox
 
 
 @shared_task
@@ -29,27 +37,105 @@ def share_post_via_email(post_title, post_url, recipient_email, sender_name):
   )
 
 @shared_task
-def notify_subscribers(post_id):
-  post = Post.objects.get(pk=post_id)
+def notify_subscribers(post_id, inline=False):
+  """
+  E-mails a newly published post to the author's followers and the category's
+  subscribers. The audience is streamed in e-mail order and handed out in batches;
+  progress is kept on NotificationDispatch so a retry resumes where it stopped.
+  Batches go to Celery workers, or are sent right here with `inline` (drain_outbox
+  without a worker), where a mail error fails the call for the outbox to retry.
+  """
+  post = Post.objects.filter(pk=post_id).first()
+  if post is None:
+    return 0
 
-  #1. Get emails of people following the author
-  author_followers = Follow.objects.filter(author=post.author).values_list('follower__email', flat=True)
+  dispatch, _ = NotificationDispatch.objects.get_or_create(post=post)
+  if dispatch.completed_at:
+    return 0
 
-  #2. Get emails of people subscribed to the category
-  category_subs = CategorySubscription.objects.filter(category=post.category).values_list('user__email', flat=True)
+  queued = 0
+  for batch in iter_audience_batches(post, after=dispatch.cursor):
+    if inline:
+      sent, error = deliver_batch(post.pk, batch)
+      if error is not None:
+        #Resume after the last recipient reached
+        if sent:
+          NotificationDispatch.objects.filter(pk=dispatch.pk).update(
+            cursor=batch[sent - 1], queued_count=F('queued_count') + sent
+          )
+        raise error
+    else:
+      send_notification_batch.delay(post.pk, batch)  # type: ignore
+    #Only advance the cursor once the batch is handed off, so a retry never skips anyone
+    NotificationDispatch.objects.filter(pk=dispatch.pk).update(
+      cursor=batch[-1], queued_count=F('queued_count') + len(batch)
+    )
+    queued += len(batch)
 
-  #3. Combine and remove duplicates
-  recipient_list = list(set(list(author_followers) + list(category_subs)))
+  NotificationDispatch.objects.filter(pk=dispatch.pk).update(completed_at=timezone.now())
+  return queued
 
-  #4. Remove empty emails
-  recipient_list = [email for email in recipient_list if email]
 
-  if recipient_list:
-    category_name = post.category.name if post.category else "General"
-    send_mail(
-      subject=f"New Post: {post.title}",
-      message=f"{post.author.username} just published a new post in {category_name}!\n\nRead it here: http://myblog.com/posts/{post.id}/",
-      from_email='notifications@blogapi.com',
-      recipient_list=recipient_list,
-      fail_silently=False,
-    )
+def deliver_batch(post_id, emails):
+  """
+  Sends one message per recipient over a single reused mail connection.
+  Returns (sent, error): on a mail error, emails[sent:] were not sent.
+  """
+  post = Post.objects.select_related('author', 'category').filter(pk=post_id).first()
+  if post is None:
+    return 0, None
+
+  sent = 0
+  try:
+    with get_connection(fail_silently=False) as connection:
+      for email in emails:
+        build_new_post_message(post, email, connection).send()
+        sent += 1
+  except (SMTPException, OSError) as exc:
+    return sent, exc
+  finally:
+    if sent:
+      NotificationDispatch.objects.filter(post_id=post_id).update(sent_count=F('sent_count') + sent)
+  return sent, None
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_notification_batch(self, post_id, emails):
+  #On a mail error the task retries with only the recipients not yet sent
+  sent, error = deliver_batch(post_id, emails)
+  if error is not None:
+    raise self.retry(exc=error, args=(post_id, emails[sent:]))
+  return sent
+
+
+@shared_task
+def fan_out_to_timelines(post_id):
+  return fan_out_post(post_id)
+
+
+@shared_task
+def rebuild_user_timeline(user_id):
+  return rebuild_timeline(user_id)
+
+
+@shared_task
+def trim_timelines():
+  return trim_all_timelines()
+
+
+@shared_task
+def refresh_leaderboards():
+  return refresh_all_leaderboards()
+
+
+@shared_task
+def drain_outbox():
+  return outbox.drain()
+
+
+#Side effects recorded by the signals, carried out by the outbox drainer
+outbox.register(outbox.POST_FAN_OUT, fan_out_to_timelines)
+outbox.register(outbox.TIMELINE_REBUILD, rebuild_user_timeline)
+outbox.register(outbox.POST_NOTIFY_SUBSCRIBERS, notify_subscribers, inline_handler=partial(notify_subscribers, inline=True))
+outbox.register(outbox.POST_SHARE, share_post_via_email)
+outbox.register(outbox.RATING_FIVE_STAR, send_rating_notification_email)
@@ -0,0 +1,214 @@
+#Test helpers for query performance and caching.
+import json
+import os
+import re
+import traceback
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
+
+
+#SQLite: a bare "SCAN <table>" reads the whole table ("SCAN t USING INDEX" walks an index in order)
+SQLITE_FULL_SCAN_RE = re.compile(r'\bSCAN (?!.*\bUSING\b)(?!CONSTANT ROW)(\S+)')
+SQLITE_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY|LAST TERM OF ORDER BY)')
+
+
+def explain(sql):
+  """
+  Returns the plan of an already-interpolated SELECT as a list of lines.
+  """
+  with connection.cursor() as cursor:
+    if connection.vendor == 'sqlite':
+      cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+      return [row[-1] for row in cursor.fetchall()]
+    if connection.vendor == 'mysql':
+      cursor.execute(f'EXPLAIN FORMAT=JSON {sql}')
+      return [cursor.fetchone()[0]]
+    cursor.execute(f'EXPLAIN {sql}')
+    return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+def _walk_mysql_tables(node):
+  if isinstance(node, dict):
+    if 'table_name' in node and 'access_type' in node:
+      yield node
+    for value in node.values():
+      yield from _walk_mysql_tables(value)
+  elif isinstance(node, list):
+    for value in node:
+      yield from _walk_mysql_tables(value)
+
+
+def find_plan_problems(plan, allowed_scans=()):
+  """
+  Returns a description of every full table scan or sort-in-a-temporary-structure
+  (filesort) in a plan from explain(). Tables in allowed_scans may be scanned.
+  """
+  problems = []
+  if connection.vendor == 'sqlite':
+    for line in plan:
+      match = SQLITE_FULL_SCAN_RE.search(line)
+      if match and match.group(1) not in allowed_scans:
+        problems.append(f'full scan: {line}')
+      if SQLITE_SORT_RE.search(line):
+        problems.append(f'filesort: {line}')
+  elif connection.vendor == 'mysql':
+    document = json.loads(plan[0])
+    for table in _walk_mysql_tables(document):
+      if table['access_type'] == 'ALL' and table['table_name'] not in allowed_scans:
+        problems.append(f"full scan: {table['table_name']}")
+    if re.search(r'"using_filesort":\s*true', plan[0]):
+      problems.append('filesort')
+  return problems
+
+
+class QueryPlanTestMixin:
+  """
+  assertIndexedQueries(callable) runs the callable, EXPLAINs every SELECT it
+  issued and fails when one of them does a full scan or a filesort.
+  """
+  def assertIndexedQueries(self, func, allowed_scans=()):
+    with CaptureQueriesContext(connection) as ctx:
+      result = func()
+
+    failures = []
+    for query in ctx.captured_queries:
+      sql = query['sql']
+      if not sql.lstrip().upper().startswith('SELECT'):
+        continue
+      problems = find_plan_problems(explain(sql), allowed_scans)
+      if problems:
+        failures.append(f"{sql}\n  " + '\n  '.join(problems))
+
+    if failures:
+      self.fail('Queries without a supporting index:\n' + '\n'.join(failures))
+    return result
+
+
+def is_project_frame(frame):
+  #Frames from our own apps, without the test helpers themselves
+  filename = os.path.abspath(frame.filename)
+  return (
+    filename.startswith(str(settings.BASE_DIR))
+    and 'site-packages' not in filename
+    and filename != os.path.abspath(__file__)
+  )
+
+
+class QueryRecorder:
+  """
+  Records every query run inside the block (through connection.execute_wrapper)
+  together with the project stack frames that issued it.
+  """
+  def __init__(self, using='default'):
+    self.connection = connections[using]
+    self.queries = []
+
+  def __enter__(self):
+    self._wrapper = self.connection.execute_wrapper(self)
+    self._wrapper.__enter__()
+    return self
+
+  def __exit__(self, *exc_info):
+    return self._wrapper.__exit__(*exc_info)
+
+  def __call__(self, execute, sql, params, many, context):
+    stack = [frame for frame in traceback.extract_stack()[:-1] if is_project_frame(frame)]
+    self.queries.append({'sql': sql, 'params': params, 'stack': stack})
+    return execute(sql, params, many, context)
+
+  def __len__(self):
+    return len(self.queries)
+
+  def repeated(self):
+    """
+    Statements issued more than once with different parameters (the N+1 pattern),
+    as [(sql, count, first_stack)], most repeated first.
+    """
+    groups = defaultdict(list)
+    for query in self.queries:
+      groups[query['sql']].append(query)
+    return sorted(
+      ((sql, len(queries), queries[0]['stack']) for sql, queries in groups.items() if len(queries) > 1),
+      key=lambda item: -item[1],
+    )
+
+  def report(self):
+    lines = []
+    for sql, count, stack in self.repeated():
+      lines.append(f"{count}x {sql}")
+      lines += ['    ' + line.rstrip() for line in traceback.format_list(stack[-6:])]
+    if not lines:
+      lines = [query['sql'] for query in self.queries]
+    return '\n'.join(lines)
+
+
+class QueryBudget:
+  """
+  Declares how many queries a route may run. List routes are requested at every
+  size in page_sizes and must stay within max_queries and run the same number of
+  queries at each size. `url` may be a callable taking the test case.
+  """
+  def __init__(self, name, url, max_queries, auth=False, page_sizes=(1, 10, 50)):
+    self.name = name
+    self.url = url
+    self.max_queries = max_queries
+    self.auth = auth
+    self.page_sizes = page_sizes
+
+
+class QueryBudgetTestMixin:
+  """
+  Provides assertQueryBudget(budget). Subclasses set `budget_user`, used for
+  routes declared with auth=True.
+  """
+  page_size_param = 'page_size'
+
+  def get_budget_url(self, budget, page_size):
+    url = budget.url(self) if callable(budget.url) else budget.url
+    if page_size is None:
+      return url
+    return f"{url}{'&' if '?' in url else '?'}{urlencode({self.page_size_param: page_size})}"
+
+  def assertQueryBudget(self, budget):
+    self.client.force_authenticate(user=self.budget_user if budget.auth else None)
+    recorders = {}
+    for page_size in budget.page_sizes or [None]:
+      #Measure the database path, not the response caches
+      cache.clear()
+      with QueryRecorder() as recorder:
+        response = self.client.get(self.get_budget_url(budget, page_size))
+      self.assertEqual(response.status_code, 200, f"{budget.name}: {response.status_code}")
+      results = response.data.get('results') if isinstance(response.data, dict) else None
+      if page_size is not None and results is not None:
+        self.assertEqual(len(results), page_size, f"{budget.name}: seed at least {page_size} items")
+      recorders[page_size] = recorder
+
+    counts = {page_size: len(recorder) for page_size, recorder in recorders.items()}
+    largest = recorders[list(recorders)[-1]]
+    problems = []
+    if max(counts.values()) > budget.max_queries:
+      problems.append(f"ran {max(counts.values())} queries, budget is {budget.max_queries}")
+    if len(set(counts.values())) > 1:
+      problems.append(f"query count grows with page size: {counts}")
+
+    if problems:
+      self.fail(f"{budget.name}: {'; '.join(problems)}\n{largest.report()}")
+
+
+class SharedCacheTestMixin:
+  """
+  The test suite runs in one process, where its LocMemCache behaves exactly like a
+  shared cache. Treats it as one, so the shared-cache code paths are the ones tested.
+  """
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    patcher = patch('blogging_platform_api.caching.is_shared_cache', return_value=True)
+    patcher.start()
+    cls.addClassCleanup(patcher.stop)
@@ -1,9 +1,48 @@
+import base64
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
 from typing import Any, Dict
-from django.urls import reverse
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.urls import reverse, reverse_lazy
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase, APIRequestFactory, force_authenticate
+from django.test import SimpleTestCase
+from django.http import HttpResponse
 from django.contrib.auth.models import User
-from .models import Post, Category
+from django.utils import timezone
+from django.db import connection, connections, transaction
+from django.apps import apps
+from django.conf import settings
+from django.test.utils import CaptureQueriesContext
+from unittest import skipUnless
+from unittest.mock import ANY, patch
+from users.models import Follow
+from .models import Post, Category, Comment, Rating, TimelineEntry, Tag, SearchPosting, CategorySubscription, NotificationDispatch, OutboxEvent, LeaderboardEntry
+from .rendering import compute_content_hash, refresh_render
+from .counters import adjust_post_counters, reconcile_post_counters
+from . import leaderboards
+from .leaderboards import refresh_all_leaderboards, refresh_leaderboard
+from .timeline import rebuild_timeline
+from .response_cache import get_cache_key
+from .directory import resolve_category_id
+from rest_framework.request import Request
+from rest_framework.response import Response
+from django.core.cache import cache
+from django.core import mail
+from django.core.management import call_command, CommandError
+from rest_framework.authtoken.models import Token
+from .tasks import notify_subscribers, send_notification_batch
+from .outbox import drain
+from .testing import QueryPlanTestMixin, QueryBudget, QueryBudgetTestMixin, SharedCacheTestMixin
+from . import benchmark, importer, exports, outbox, engagement
+from .rendering import render_cache
+from blogging_platform_api.instrumentation import registry
+from blogging_platform_api import db_router
+from .async_views import AsyncGlobalFeedView, AsyncUserFeedView, AsyncPostDetailView, AsyncCategoryPostListView
 
 class PostTests(APITestCase):
   def setUp(self):
@@ -109,7 +148,8 @@ class PostTests(APITestCase):
     response = self.client.get(url)
 
     self.assertEqual(len(response.data), 1)  # type: ignore
-    self.assertIn("Serializers", response.data[0]['content'])  # type: ignore 
+    #List endpoints return the plain-text excerpt instead of the full body
+    self.assertIn("Serializers", response.data[0]['excerpt'])  # type: ignore 
 
 
   #Negative Test (Unauthorized Create)
@@ -125,3 +165,1624 @@ class PostTests(APITestCase):
 
     #Assert that it blocks the user (401 Unauthorized)
     self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RenderCacheTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='writer', password='password123')
+    self.category = Category.objects.create(name='Tech')
+
+  def test_html_is_stored_on_save(self):
+    post = Post.objects.create(title='MD', content='*hello*', author=self.user, category=self.category)
+    self.assertEqual(post.content_hash, compute_content_hash('*hello*'))
+    self.assertEqual(Post.objects.get(pk=post.pk).content_html, '<p><em>hello</em></p>')
+
+  def test_strong_is_allowed(self):
+    post = Post.objects.create(title='MD', content='**bold**', author=self.user, category=self.category)
+    self.assertEqual(post.content_html, '<p><strong>bold</strong></p>')
+
+  def test_stale_render_is_served_without_writing(self):
+    post = Post.objects.create(title='MD', content='Hello', author=self.user, category=self.category)
+    #Simulate a render produced under an older policy
+    Post.objects.filter(pk=post.pk).update(content_hash='stale', content_html='old')
+
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('post-detail', kwargs={'pk': post.pk}))
+    self.assertEqual(response.data['content_html'], '<p>Hello</p>')  # type: ignore
+    self.assertFalse([q for q in ctx.captured_queries if not q['sql'].startswith('SELECT')])
+    self.assertEqual(Post.objects.get(pk=post.pk).content_hash, 'stale')
+
+    call_command('refresh_renders', stdout=StringIO())
+    post.refresh_from_db()
+    self.assertEqual((post.content_hash, post.content_html), (compute_content_hash('Hello'), '<p>Hello</p>'))
+
+
+class CounterTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='reader', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.post = Post.objects.create(title='Counted', content='Body', author=self.user, category=self.category)
+    self.client.force_authenticate(user=self.user)  # type: ignore
+
+  def test_like_toggle_updates_counter(self):
+    url = reverse('post-like', kwargs={'pk': self.post.pk})
+
+    response = self.client.post(url)
+    self.assertEqual(response.data['current_total'], 1)  # type: ignore
+    self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+
+    response = self.client.post(url)
+    self.assertEqual(response.data['current_total'], 0)  # type: ignore
+    self.assertFalse(response.data['has_liked'])  # type: ignore
+
+  def test_comment_create_and_delete_update_counter(self):
+    response = self.client.post(reverse('post-comments', kwargs={'post_pk': self.post.pk}), {'content': 'Nice'})
+    self.assertEqual(Post.objects.get(pk=self.post.pk).comment_count, 1)
+
+    self.client.delete(reverse('comment-detail', kwargs={'pk': response.data['id']}))  # type: ignore
+    self.assertEqual(Post.objects.get(pk=self.post.pk).comment_count, 0)
+
+  def test_reconcile_repairs_drift(self):
+    self.post.likes.add(self.user)
+    Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+
+    self.assertEqual(reconcile_post_counters(), 1)
+
+    post = Post.objects.get(pk=self.post.pk)
+    self.assertEqual((post.like_count, post.comment_count), (1, 0))
+
+
+class EngagementBatchTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='fan', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.posts = [
+      Post.objects.create(title=f'P{i}', content='Body', author=self.user, category=self.category)
+      for i in range(3)
+    ]
+    self.client.force_authenticate(user=self.user)  # type: ignore
+
+  def test_list_resolves_engagement_per_post(self):
+    self.posts[0].likes.add(self.user)
+    Rating.objects.create(user=self.user, post=self.posts[1], score=4)
+
+    response = self.client.get(reverse('post-list'))
+    results = {item['id']: item for item in response.data['results']}  # type: ignore
+
+    self.assertTrue(results[self.posts[0].pk]['has_liked'])
+    self.assertFalse(results[self.posts[1].pk]['has_liked'])
+    self.assertTrue(results[self.posts[1].pk]['has_rated'])
+    self.assertEqual(results[self.posts[1].pk]['my_score'], 4)
+    self.assertIsNone(results[self.posts[2].pk]['my_score'])
+
+  def test_engagement_query_count_is_constant(self):
+    url = reverse('post-list')
+    with CaptureQueriesContext(connection) as small:
+      self.client.get(url)
+
+    for i in range(5):
+      Post.objects.create(title=f'More {i}', content='Body', author=self.user, category=self.category)
+
+    with CaptureQueriesContext(connection) as large:
+      self.client.get(url)
+
+    engagement_sql = lambda ctx: [q for q in ctx.captured_queries if 'posts_rating' in q['sql'] or 'posts_post_likes' in q['sql']]
+    self.assertEqual(len(engagement_sql(small)), len(engagement_sql(large)))
+
+
+class KeysetPaginationTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='scroller', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    published_at = timezone.now()
+    for i in range(25):
+      post = Post.objects.create(title=f'P{i}', content='Body', author=self.user, category=self.category)
+      #Several posts share a timestamp so the id tie-breaker is exercised
+      Post.objects.filter(pk=post.pk).update(status='PB', published_at=published_at - timedelta(minutes=i // 3))
+
+  def test_cursor_mode_walks_every_post_once(self):
+    url = reverse('explore') + '?pagination=cursor'
+    seen = []
+    while url:
+      response = self.client.get(url)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      self.assertNotIn('count', response.data)  # type: ignore
+      seen += [item['id'] for item in response.data['results']]  # type: ignore
+      url = response.data['next']  # type: ignore
+
+    expected = list(Post.objects.order_by('-published_at', '-id').values_list('id', flat=True))
+    self.assertEqual(seen, expected)
+
+  def test_page_number_mode_is_default(self):
+    response = self.client.get(reverse('explore'))
+    self.assertEqual(response.data['count'], 25)  # type: ignore
+
+  def test_invalid_cursor_is_rejected(self):
+    response = self.client.get(reverse('explore') + '?cursor=not-a-cursor')
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+  def test_malformed_cursor_payloads_are_rejected(self):
+    payloads = [
+      [None, None], ['2024-01-01T00:00:00+00:00', None], ['2024-01-01T00:00:00+00:00'],
+      ['2024-01-01T00:00:00+00:00', 1, 2], ['2024-01-01T00:00:00+00:00', [1]], [True, 1],
+      ['yesterday', 1], ['2024-01-01T00:00:00+00:00', 'one'], {'id': 1}, 'cursor',
+    ]
+    for payload in payloads:
+      with self.subTest(payload=payload):
+        cursor = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+        response = self.client.get(reverse('explore'), {'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TimelineTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    self.client.force_authenticate(user=self.reader)  # type: ignore
+
+  def publish(self, title):
+    post = Post.objects.create(title=title, content='Body', author=self.author, category=self.category)
+    #Bypass notify_subscribers, which only runs on creation of published posts
+    post.status = Post.Status.PUBLISHED
+    post.save()
+    return post
+
+  def test_publish_fans_out_to_followers(self):
+    post = self.publish('Fresh')
+    #Fan-out is recorded in the outbox and carried out by the drainer
+    self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+    drain()
+
+    self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+    response = self.client.get(reverse('user-feed'))
+    self.assertEqual([item['id'] for item in response.data['results']], [post.pk])  # type: ignore
+
+  def test_unpublish_removes_from_timeline(self):
+    post = self.publish('Oops')
+    drain()
+    post.status = Post.Status.DRAFT
+    post.save()
+
+    self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+
+  def test_unfollow_rebuilds_timeline(self):
+    self.publish('Gone soon')
+    drain()
+    Follow.objects.get(follower=self.reader, followed_user=self.author).delete()
+
+    #The rebuild is recorded in the outbox, not run inside the request
+    self.assertTrue(TimelineEntry.objects.filter(user=self.reader).exists())
+    drain()
+    self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+
+  def test_hot_author_is_pulled_on_read(self):
+    post = self.publish('Viral')
+    TimelineEntry.objects.all().delete()
+
+    with patch('posts.timeline.get_hot_sources', return_value=({self.author.pk}, set())):
+      response = self.client.get(reverse('user-feed'))
+
+    self.assertEqual([item['id'] for item in response.data['results']], [post.pk])  # type: ignore
+
+  def test_timeline_and_hot_pulls_are_merged_in_order(self):
+    hot = User.objects.create_user(username='celebrity', password='password123')
+    Follow.objects.create(follower=self.reader, followed_user=hot)
+    now = timezone.now()
+    expected = []
+    for i in range(7):
+      author = hot if i % 2 else self.author
+      post = Post.objects.create(title=f'Post {i}', content='Body', author=author, status='PB')
+      Post.objects.filter(pk=post.pk).update(published_at=now - timedelta(minutes=i))
+      if author == self.author:
+        TimelineEntry.objects.create(user=self.reader, post=post, published_at=now - timedelta(minutes=i))
+      expected.append(post.pk)
+
+    with patch('posts.timeline.get_hot_sources', return_value=({hot.pk}, set())):
+      response = self.client.get(reverse('user-feed'), {'page_size': 3})
+      self.assertEqual(response.data['count'], 7)  # type: ignore
+      self.assertEqual([item['id'] for item in response.data['results']], expected[:3])  # type: ignore
+      response = self.client.get(reverse('user-feed'), {'page_size': 3, 'page': 3})
+      self.assertEqual([item['id'] for item in response.data['results']], expected[6:])  # type: ignore
+
+      seen, url = [], reverse('user-feed') + '?pagination=cursor&page_size=3'
+      while url:
+        response = self.client.get(url)
+        seen += [item['id'] for item in response.data['results']]  # type: ignore
+        url = response.data['next']  # type: ignore
+      self.assertEqual(seen, expected)
+
+  def test_rebuilt_timelines_do_not_repeat_hot_posts(self):
+    hot = User.objects.create_user(username='celebrity', password='password123')
+    now = timezone.now()
+    for i in range(15):
+      post = Post.objects.create(title=f'Hot {i}', content='Body', author=hot, category=self.category, status='PB')
+      Post.objects.filter(pk=post.pk).update(published_at=now - timedelta(minutes=i))
+    CategorySubscription.objects.create(user=self.reader, category=self.category)
+    Follow.objects.create(follower=self.reader, followed_user=hot)
+    #Rebuilt while the author was not hot yet, then again once it is
+    drain()
+    self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 15)
+
+    for rebuild in (False, True):
+      with self.subTest(rebuilt_while_hot=rebuild), patch('posts.timeline.get_hot_sources', return_value=({hot.pk}, {self.category.pk})):
+        if rebuild:
+          rebuild_timeline(self.reader.pk)
+          self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        response = self.client.get(reverse('user-feed'), {'page_size': 6})
+        self.assertEqual(response.data['count'], 15)  # type: ignore
+        seen = []
+        for page in (1, 2, 3):
+          response = self.client.get(reverse('user-feed'), {'page_size': 6, 'page': page})
+          self.assertEqual(response.status_code, status.HTTP_200_OK)
+          seen += [item['id'] for item in response.data['results']]  # type: ignore
+        self.assertEqual(len(seen), 15)
+        self.assertEqual(len(set(seen)), 15)
+
+  def test_timelines_are_trimmed(self):
+    posts = [self.publish(f'Post {i}') for i in range(5)]
+    drain()
+    self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 5)
+
+    call_command('trim_timelines', '--max-length', '2', stdout=StringIO())
+    kept = TimelineEntry.objects.filter(user=self.reader).values_list('post_id', flat=True)
+    self.assertEqual(sorted(kept), [posts[3].pk, posts[4].pk])
+
+
+class SearchIndexTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='writer', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.django = Post.objects.create(title='Django Tips', content='Learn about serializers and views.', author=self.user, category=self.category)
+    self.flask = Post.objects.create(title='Flask Basics', content='Views without serializers.', author=self.user, category=self.category)
+    self.url = reverse('post-list')
+    #Drafts are only listed for their author
+    self.client.force_authenticate(user=self.user)  # type: ignore
+
+  def search_ids(self, query):
+    response = self.client.get(self.url, {'search': query})
+    return [item['id'] for item in response.data['results']]  # type: ignore
+
+  def test_all_terms_must_match(self):
+    self.assertEqual(self.search_ids('serializers django'), [self.django.pk])
+
+  def test_title_matches_rank_higher(self):
+    mention = Post.objects.create(title='Frameworks', content='Flask is small.', author=self.user, category=self.category)
+    self.assertEqual(self.search_ids('flask'), [self.flask.pk, mention.pk])
+
+  def test_phrase_and_prefix_queries(self):
+    self.assertEqual(self.search_ids('"without serializers"'), [self.flask.pk])
+    self.assertEqual(self.search_ids('"serializers without"'), [])
+    self.assertEqual(set(self.search_ids('serial*')), {self.django.pk, self.flask.pk})
+
+  def test_index_follows_edits_and_deletes(self):
+    self.django.content = 'Now about templates.'
+    self.django.save()
+    self.assertEqual(self.search_ids('templates'), [self.django.pk])
+    self.assertEqual(self.search_ids('serializers'), [self.flask.pk])
+
+    self.flask.delete()
+    self.assertEqual(self.search_ids('serializers'), [])
+    self.assertFalse(SearchPosting.objects.filter(post_id=self.flask.pk).exists())
+
+  def test_tags_are_indexed(self):
+    self.flask.tags.add(Tag.objects.create(name='microframework'))
+    self.assertEqual(self.search_ids('microframework'), [self.flask.pk])
+
+  def test_cursor_pages_keep_the_relevance_order(self):
+    mentions = [
+      Post.objects.create(title=f'Frameworks {i}', content='Flask ' + 'is small. ' * i, author=self.user, category=self.category)
+      for i in range(1, 4)
+    ]
+    ranked = self.search_ids('flask')
+    self.assertEqual(set(ranked), {self.flask.pk, *[post.pk for post in mentions]})
+    #Relevance order differs from the list's usual newest-first key
+    self.assertNotEqual(ranked, sorted(ranked, reverse=True))
+
+    ids, url, params = [], self.url, {'search': 'flask', 'pagination': 'cursor', 'page_size': 1}
+    while url:
+      response = self.client.get(url, params)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      ids += [item['id'] for item in response.data['results']]  # type: ignore
+      url, params = response.data['next'], None  # type: ignore
+    self.assertEqual(ids, ranked)
+
+
+class PostSummaryTests(APITestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(username='writer', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    body = '![cover](https://img.example.com/cover.png)\n\n' + ' '.join(['word'] * 450)
+    self.post = Post.objects.create(title='Long read', content=body, author=self.user, category=self.category)
+    self.client.force_authenticate(user=self.user)  # type: ignore
+
+  def test_summary_fields_computed_on_save(self):
+    self.assertEqual(self.post.word_count, 450)
+    self.assertEqual(self.post.reading_time, 3)
+    self.assertEqual(self.post.first_image, 'https://img.example.com/cover.png')
+    self.assertTrue(self.post.excerpt.endswith('…'))
+    self.assertLessEqual(len(self.post.excerpt), 281)
+
+  def test_first_image_is_an_http_url(self):
+    content = (
+      '![x](javascript:alert(1)) ![y](data:image/svg+xml;base64,PHN2Zz4=) '
+      '<img src="java&#115;cript:alert(1)"> <img src="/relative.png"> '
+      '![z](http://img.example.com/safe.png)'
+    )
+    post = Post.objects.create(title='Images', content=content, author=self.user)
+    self.assertEqual(post.first_image, 'http://img.example.com/safe.png')
+
+    post.content = '![x](javascript:alert(1))'
+    post.save()
+    self.assertEqual(post.first_image, '')
+
+  def test_list_is_lean_and_detail_is_full(self):
+    item = self.client.get(reverse('post-list')).data['results'][0]  # type: ignore
+    self.assertIn('excerpt', item)
+    for heavy in ('content', 'content_html', 'comments'):
+      self.assertNotIn(heavy, item)
+
+    detail = self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk})).data  # type: ignore
+    self.assertIn('content_html', detail)
+    self.assertIn('comments', detail)
+
+
+class LeaderboardTests(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(username='ranker', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    now = timezone.now()
+    self.recent = self.create_post('Recent', now - timedelta(hours=2), likes=3, comments=1)
+    self.old = self.create_post('Old', now - timedelta(days=20), likes=5, comments=4)
+    self.draft = Post.objects.create(title='Draft', content='Body', author=self.user, category=self.category)
+    Post.objects.filter(pk=self.draft.pk).update(like_count=50)
+    Post.objects.filter(pk=self.recent.pk).update(rating_count=1, rating_sum=5)
+    Post.objects.filter(pk=self.old.pk).update(rating_count=2, rating_sum=4)
+    refresh_all_leaderboards()
+
+  def create_post(self, title, published_at, likes, comments):
+    post = Post.objects.create(title=title, content='Body', author=self.user, category=self.category)
+    Post.objects.filter(pk=post.pk).update(status='PB', published_at=published_at, like_count=likes, comment_count=comments)
+    return post
+
+  def top_ids(self, **params):
+    response = self.client.get(reverse('top-posts'), params)
+    return [item['id'] for item in response.data['results']]  # type: ignore
+
+  def test_sort_by_and_window_are_honored(self):
+    self.assertEqual(self.top_ids(), [self.old.pk, self.recent.pk])
+    self.assertEqual(self.top_ids(window='day'), [self.recent.pk])
+    self.assertEqual(self.top_ids(sort_by='rating'), [self.recent.pk, self.old.pk])
+    self.assertEqual(self.top_ids(sort_by='comments', window='month'), [self.old.pk, self.recent.pk])
+
+  def test_drafts_are_never_ranked(self):
+    self.assertNotIn(self.draft.pk, self.top_ids())
+
+  def test_reads_never_refresh(self):
+    LeaderboardEntry.objects.all().delete()
+    with CaptureQueriesContext(connection) as ctx:
+      self.assertEqual(self.top_ids(), [])
+    self.assertFalse([q for q in ctx.captured_queries if not q['sql'].startswith('SELECT')])
+
+    call_command('refresh_leaderboards', stdout=StringIO())
+    self.assertEqual(self.top_ids(), [self.old.pk, self.recent.pk])
+
+  def test_refresh_only_rewrites_changed_boards(self):
+    self.assertEqual(refresh_all_leaderboards(), 0)
+
+    adjust_post_counters(self.recent.pk, like_count=7)
+    self.assertTrue(refresh_leaderboard('all', 'likes'))
+    self.assertEqual(self.top_ids(), [self.recent.pk, self.old.pk])
+
+  @patch.object(leaderboards, 'LEADERBOARD_SIZE', 2)
+  def test_full_boards_take_the_touched_posts_incrementally(self):
+    #Never touched since the boards were computed: stays off them until it outranks a ranked post
+    outsider = self.create_post('Outsider', timezone.now() - timedelta(hours=5), likes=2, comments=0)
+    Post.objects.filter(pk=outsider.pk).update(updated_at=timezone.now() - timedelta(days=1))
+    LeaderboardEntry.objects.update(computed_at=timezone.now())
+
+    with patch.object(leaderboards, 'compute_leaderboard', wraps=leaderboards.compute_leaderboard) as compute:
+      adjust_post_counters(self.recent.pk, like_count=7)
+      self.assertTrue(refresh_leaderboard('all', 'likes'))
+      self.assertEqual(self.top_ids(), [self.recent.pk, self.old.pk])
+      self.assertFalse(refresh_leaderboard('all', 'likes'))
+      compute.assert_not_called()
+
+      #A ranked post falling below the board's old last entry needs the posts off the board
+      adjust_post_counters(self.recent.pk, like_count=-9)
+      self.assertTrue(refresh_leaderboard('all', 'likes'))
+      self.assertEqual(self.top_ids(), [self.old.pk, outsider.pk])
+      compute.assert_called_once_with('all', 'likes', ANY)
+
+  @patch.object(leaderboards, 'LEADERBOARD_SIZE', 2)
+  def test_window_rollover_recomputes_the_board(self):
+    with patch.object(leaderboards, 'compute_leaderboard', wraps=leaderboards.compute_leaderboard) as compute:
+      self.assertFalse(refresh_leaderboard('month', 'likes'))
+      compute.assert_not_called()
+
+      self.assertTrue(refresh_leaderboard('month', 'likes', now=timezone.now() + timedelta(days=15)))
+      compute.assert_called_once()
+    self.assertEqual(self.top_ids(window='month'), [self.recent.pk])
+
+  def test_invalid_parameters_are_rejected(self):
+    response = self.client.get(reverse('top-posts'), {'sort_by': 'views'})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RatingAggregateTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.user = User.objects.create_user(username='critic', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.post = Post.objects.create(title='Rated', content='Body', author=self.author, category=self.category)
+    self.url = reverse('post-rate', kwargs={'pk': self.post.pk})
+    self.client.force_authenticate(user=self.user)  # type: ignore
+
+  def test_new_and_changed_ratings_update_aggregates(self):
+    self.client.post(self.url, {'score': 4})
+    other = User.objects.create_user(username='other', password='password123')
+    self.client.force_authenticate(user=other)  # type: ignore
+    self.client.post(self.url, {'score': 2})
+    #Changing an existing score moves it between histogram buckets
+    self.client.post(self.url, {'score': 5})
+
+    post = Post.objects.get(pk=self.post.pk)
+    self.assertEqual((post.rating_count, post.rating_sum), (2, 9))
+    self.assertEqual(post.rating_distribution, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+    detail = self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk})).data  # type: ignore
+    self.assertEqual(detail['avg_rating'], 4.5)
+    self.assertEqual(detail['rating_distribution']['5'], 1)
+
+  def test_invalid_score_is_rejected(self):
+    response = self.client.post(self.url, {'score': 9})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(Post.objects.get(pk=self.post.pk).rating_count, 0)
+
+  def test_reconcile_repairs_rating_drift(self):
+    Rating.objects.create(user=self.user, post=self.post, score=3)
+    self.assertEqual(reconcile_post_counters(), 1)
+    post = Post.objects.get(pk=self.post.pk)
+    self.assertEqual((post.rating_count, post.rating_sum, post.rating_3), (1, 3, 1))
+
+
+class CategoryDirectoryTests(SharedCacheTestMixin, APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(username='editor', password='password123')
+    self.tech = Category.objects.create(name='Tech')
+    self.food = Category.objects.create(name='Food')
+    self.post = Post.objects.create(title='Draft', content='Body', author=self.user, category=self.tech)
+
+  def counts(self):
+    response = self.client.get(reverse('category-list'))
+    return {item['name']: item['post_count'] for item in response.data['results']}  # type: ignore
+
+  def test_counts_follow_publish_move_and_delete(self):
+    self.assertEqual(self.counts(), {'Tech': 0, 'Food': 0})
+
+    self.post.status = Post.Status.PUBLISHED
+    self.post.save()
+    self.assertEqual(self.counts(), {'Tech': 1, 'Food': 0})
+
+    self.post.category = self.food
+    self.post.save()
+    self.assertEqual(self.counts(), {'Tech': 0, 'Food': 1})
+
+    Post.objects.get(pk=self.post.pk).delete()
+    self.assertEqual(self.counts(), {'Tech': 0, 'Food': 0})
+
+  def test_directory_is_served_from_cache(self):
+    self.counts()
+    with CaptureQueriesContext(connection) as ctx:
+      self.counts()
+    self.assertEqual(len(ctx.captured_queries), 0)
+
+    Category.objects.create(name='Travel')
+    self.assertIn('Travel', self.counts())
+
+  def test_category_posts_resolve_name_case_insensitively(self):
+    Post.objects.filter(pk=self.post.pk).update(status='PB', published_at=timezone.now())
+    response = self.client.get(reverse('category-posts', kwargs={'category_name': 'tech'}))
+    self.assertEqual([item['id'] for item in response.data['results']], [self.post.pk])  # type: ignore
+
+    response = self.client.get(reverse('category-posts', kwargs={'category_name': 'missing'}))
+    self.assertEqual(response.data['results'], [])  # type: ignore
+
+  def test_names_missing_from_a_stale_directory_are_looked_up(self):
+    self.counts()
+    #Created by another process, whose version bump this process never saw
+    travel = Category.objects.bulk_create([Category(name='Travel')])[0]
+    self.assertNotIn('Travel', self.counts())
+    self.assertEqual(resolve_category_id('travel'), travel.pk)
+
+
+class ConditionalGetTests(SharedCacheTestMixin, APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(username='poller', password='password123')
+    self.post = Post.objects.create(title='Polled', content='Body', author=self.user)
+    Post.objects.filter(pk=self.post.pk).update(status='PB', published_at=timezone.now())
+    self.client.force_authenticate(user=self.user)
+
+  def test_unchanged_post_returns_304_with_one_query(self):
+    url = reverse('post-detail', kwargs={'pk': self.post.pk})
+    response = self.client.get(url)
+    etag = response['ETag']
+
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    self.assertEqual(len(ctx.captured_queries), 1)
+
+    #A like changes the counters and therefore the validator
+    self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(response.data['has_liked'])  # type: ignore
+    self.assertNotEqual(response['ETag'], etag)
+
+  def test_etag_differs_per_user(self):
+    url = reverse('post-detail', kwargs={'pk': self.post.pk})
+    etag = self.client.get(url)['ETag']
+    self.client.force_authenticate(user=None)
+    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+  def test_comment_changes_invalidate_comment_list(self):
+    url = reverse('post-comments', kwargs={'post_pk': self.post.pk})
+    etag = self.client.get(url)['ETag']
+    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    response = self.client.post(url, {'content': 'First'})
+    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    etag = response['ETag']
+    comment_id = response.data['results'][0]['id']  # type: ignore
+    self.client.patch(reverse('comment-detail', kwargs={'pk': comment_id}), {'content': 'Edited'})
+    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+  def test_explore_validated_by_watermark_without_queries(self):
+    url = reverse('explore')
+    response = self.client.get(url)
+    etag, last_modified = response['ETag'], response['Last-Modified']
+
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    self.assertEqual(len(ctx.captured_queries), 0)
+    self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    #Other pages have their own validators
+    self.assertEqual(self.client.get(url + '?page=2', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_404_NOT_FOUND)
+
+    self.post.title = 'Retitled'
+    self.post.save()
+    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+  def test_explore_validated_from_posts_without_shared_cache(self):
+    #Changes made by other processes never bump this process's own cache
+    url = reverse('explore')
+    with patch('blogging_platform_api.caching.is_shared_cache', return_value=False):
+      etag = self.client.get(url)['ETag']
+      self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+      Post.objects.filter(pk=self.post.pk).update(title='Elsewhere', updated_at=timezone.now() + timedelta(seconds=1))
+      response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      self.assertNotIn('Last-Modified', response)
+
+      etag = response['ETag']
+      Post.objects.filter(pk=self.post.pk).delete()
+      self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class ResponseCacheTests(SharedCacheTestMixin, APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(username='writer', password='password123')
+    self.category = Category.objects.create(name='Tech')
+    self.post = Post.objects.create(title='Cached', content='Body', author=self.user, category=self.category)
+    self.post.status = Post.Status.PUBLISHED
+    self.post.save()
+
+  def test_anonymous_pages_are_served_from_cache(self):
+    for url in [reverse('explore'), reverse('post-list'), reverse('category-posts', kwargs={'category_name': 'Tech'})]:
+      self.client.get(url + '?a=1&b=2')
+      with CaptureQueriesContext(connection) as ctx:
+        response = self.client.get(url + '?b=2&a=1&c=')
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      self.assertEqual(len(ctx.captured_queries), 0, url)
+      self.assertEqual([item['id'] for item in response.data['results']], [self.post.pk])  # type: ignore
+
+  def test_publish_edit_and_delete_bump_the_generation(self):
+    url = reverse('explore')
+    self.client.get(url)
+
+    other = Post.objects.create(title='Second', content='Body', author=self.user)
+    other.status = Post.Status.PUBLISHED
+    other.save()
+    self.assertEqual(len(self.client.get(url).data['results']), 2)  # type: ignore
+
+    other.title = 'Renamed'
+    other.save()
+    self.assertEqual(self.client.get(url).data['results'][0]['title'], 'Renamed')  # type: ignore
+
+    other.delete()
+    self.assertEqual(len(self.client.get(url).data['results']), 1)  # type: ignore
+
+  def test_authenticated_requests_bypass_the_cache(self):
+    url = reverse('post-list')
+    self.client.get(url)
+    self.client.force_authenticate(user=self.user)
+    draft = Post.objects.create(title='Mine', content='Body', author=self.user)
+    Post.objects.filter(pk=draft.pk).update(title='Mine, renamed')
+
+    titles = [item['title'] for item in self.client.get(url).data['results']]  # type: ignore
+    self.assertIn('Mine, renamed', titles)
+
+  @patch('posts.response_cache.WAIT_INTERVAL', 0)
+  def test_waits_for_concurrent_rebuild_then_falls_back(self):
+    url = reverse('explore')
+    request = self.client.get(url).wsgi_request  # type: ignore
+    cache.clear()
+
+    #Another request holds the rebuild lock and never finishes
+    cache.add(f'{get_cache_key(Request(request))}:lock', True, 10)
+    response = self.client.get(url)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(len(response.data['results']), 1)  # type: ignore
+
+  def test_nothing_is_cached_without_a_shared_cache(self):
+    #Writes on other processes could not retire this process's entries
+    url = reverse('explore')
+    with patch('blogging_platform_api.caching.is_shared_cache', return_value=False):
+      self.client.get(url)
+      Post.objects.filter(pk=self.post.pk).update(title='Changed elsewhere')
+      self.assertEqual(self.client.get(url).data['results'][0]['title'], 'Changed elsewhere')  # type: ignore
+
+  def test_evicted_generation_does_not_repeat(self):
+    key = get_cache_key(Request(self.client.get(reverse('explore')).wsgi_request))  # type: ignore
+    cache.delete('responses:generation')
+    self.assertNotEqual(get_cache_key(Request(self.client.get(reverse('explore')).wsgi_request)), key)  # type: ignore
+
+
+class NotifySubscribersTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+    self.category = Category.objects.create(name='Tech')
+    self.readers = [
+      User.objects.create_user(username=name, password='password123', email=f'{name}@example.com')
+      for name in ['ann', 'bob', 'cat', 'dan']
+    ]
+    User.objects.create_user(username='noemail', password='password123')
+    ann, bob, cat, dan = self.readers
+    for user in [ann, bob, User.objects.get(username='noemail')]:
+      Follow.objects.create(follower=user, followed_user=self.author)
+    for user in [bob, cat, dan]:
+      CategorySubscription.objects.create(user=user, category=self.category)
+    self.post = Post.objects.create(title='Hello', content='Body', author=self.author, category=self.category)
+
+    #Run the batch sub-tasks inline instead of sending them to a worker
+    patcher = patch.object(send_notification_batch, 'delay', side_effect=send_notification_batch)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_sends_one_message_per_unique_recipient(self):
+    self.assertEqual(notify_subscribers(self.post.pk), 4)
+
+    recipients = sorted(message.to[0] for message in mail.outbox)
+    self.assertEqual(recipients, ['ann@example.com', 'bob@example.com', 'cat@example.com', 'dan@example.com'])
+    self.assertTrue(all(len(message.to) == 1 for message in mail.outbox))
+
+    dispatch = NotificationDispatch.objects.get(post=self.post)
+    self.assertEqual((dispatch.queued_count, dispatch.sent_count), (4, 4))
+    self.assertIsNotNone(dispatch.completed_at)
+
+    #A completed dispatch is never sent twice
+    self.assertEqual(notify_subscribers(self.post.pk), 0)
+    self.assertEqual(len(mail.outbox), 4)
+
+  @patch('posts.notifications.BATCH_SIZE', 3)
+  def test_batches_share_a_connection(self):
+    with patch('posts.tasks.get_connection', wraps=mail.get_connection) as get_connection:
+      notify_subscribers(self.post.pk)
+    self.assertEqual(get_connection.call_count, 2)
+    self.assertEqual(len(mail.outbox), 4)
+
+  def test_retry_resumes_after_cursor(self):
+    NotificationDispatch.objects.create(post=self.post, cursor='bob@example.com', queued_count=2, sent_count=2)
+    notify_subscribers(self.post.pk)
+
+    self.assertEqual([message.to[0] for message in mail.outbox], ['cat@example.com', 'dan@example.com'])
+    self.assertEqual(NotificationDispatch.objects.get(post=self.post).sent_count, 4)
+
+
+class OutboxTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+    self.rater = User.objects.create_user(username='rater', password='password123')
+    self.post = Post.objects.create(title='Rated', content='Body', author=self.author)
+    self.post.status = Post.Status.PUBLISHED
+    self.post.save()
+    OutboxEvent.objects.all().delete()
+    self.client.force_authenticate(user=self.rater)
+
+  def test_request_records_event_without_sending(self):
+    response = self.client.post(reverse('post-rate', kwargs={'pk': self.post.pk}), {'score': 5})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(len(mail.outbox), 0)
+    self.assertEqual(list(OutboxEvent.objects.values_list('topic', flat=True)), ['rating.five_star'])
+
+    self.assertEqual(drain(), (1, 0))
+    self.assertEqual(mail.outbox[0].to, ['author@example.com'])
+    self.assertIsNotNone(OutboxEvent.objects.get().processed_at)
+    self.assertEqual(drain(), (0, 0))
+
+  def test_event_rolls_back_with_the_change(self):
+    with self.assertRaises(RuntimeError):
+      with transaction.atomic():
+        Rating.objects.create(user=self.rater, post=self.post, score=5)
+        raise RuntimeError
+    self.assertFalse(OutboxEvent.objects.exists())
+
+  def test_failures_are_retried_with_backoff(self):
+    self.client.post(reverse('post-rate', kwargs={'pk': self.post.pk}), {'score': 5})
+
+    with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+      self.assertEqual(drain(), (0, 1))
+    event = OutboxEvent.objects.get()
+    self.assertEqual(event.attempts, 1)
+    self.assertIn('down', event.last_error)
+    self.assertGreater(event.available_at, timezone.now())
+
+    #Not due yet; once the backoff has passed it is delivered
+    self.assertEqual(drain(), (0, 0))
+    OutboxEvent.objects.update(available_at=timezone.now())
+    self.assertEqual(drain(), (1, 0))
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_drain_command_sends_subscriber_batches_without_a_worker(self):
+    reader = User.objects.create_user(username='reader', password='password123', email='reader@example.com')
+    Follow.objects.create(follower=reader, followed_user=self.author)
+    outbox.enqueue(outbox.POST_NOTIFY_SUBSCRIBERS, post_id=self.post.pk)
+
+    with patch.object(send_notification_batch, 'delay', side_effect=AssertionError('no worker')):
+      call_command('drain_outbox', stdout=StringIO())
+    self.assertEqual([message.to for message in mail.outbox], [['reader@example.com']])
+    self.assertEqual(NotificationDispatch.objects.get(post=self.post).sent_count, 1)
+
+  def test_exhausted_events_are_dead_lettered_and_reported(self):
+    self.client.post(reverse('post-rate', kwargs={'pk': self.post.pk}), {'score': 5})
+    OutboxEvent.objects.update(attempts=outbox.MAX_ATTEMPTS - 1)
+
+    with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+      with self.assertLogs('posts.outbox', 'ERROR'):
+        self.assertEqual(drain(), (0, 1))
+    self.assertEqual(outbox.dead_letters().count(), 1)
+
+    stderr = StringIO()
+    with self.assertRaises(CommandError):
+      call_command('drain_outbox', stdout=StringIO(), stderr=stderr)
+    self.assertIn('--requeue-dead', stderr.getvalue())
+
+    call_command('drain_outbox', '--requeue-dead', stdout=StringIO())
+    self.assertFalse(outbox.dead_letters().exists())
+    self.assertEqual(len(mail.outbox), 1)
+
+
+class BulkEngagementTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+    self.user = User.objects.create_user(username='syncer', password='password123')
+    self.posts = [Post.objects.create(title=f'Post {i}', content='Body', author=self.author) for i in range(4)]
+    Post.objects.update(status='PB', published_at=timezone.now())
+    self.client.force_authenticate(user=self.user)
+    self.url = reverse('post-engagement')
+
+  def test_applies_batch_with_fixed_query_count(self):
+    a, b, c, d = self.posts
+    a.likes.add(self.user)
+    Post.objects.filter(pk=a.pk).update(like_count=1)
+    Rating.objects.create(user=self.user, post=c, score=2)
+    Post.objects.filter(pk=c.pk).update(rating_count=1, rating_sum=2, rating_2=1)
+
+    operations = [
+      {'post': a.pk, 'action': 'unlike'},
+      {'post': b.pk, 'action': 'like'},
+      {'post': c.pk, 'action': 'rate', 'score': 4},
+      {'post': d.pk, 'action': 'rate', 'score': 5},
+      {'post': d.pk, 'action': 'like'},
+      {'post': 999999, 'action': 'like'},
+    ]
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.post(self.url, {'operations': operations}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    #Doubling the batch must not add queries
+    queries = len(ctx.captured_queries)
+    more = [{'post': post.pk, 'action': 'rate', 'score': 3} for post in self.posts] * 2
+    with CaptureQueriesContext(connection) as ctx:
+      self.client.post(self.url, {'operations': more}, format='json')
+    self.assertLessEqual(len(ctx.captured_queries), queries)
+
+    results = response.data['results']  # type: ignore
+    self.assertEqual([r['status'] for r in results], ['ok'] * 5 + ['not_found'])
+    self.assertEqual(results[0]['has_liked'], False)
+    self.assertEqual(results[3]['score'], 5)
+
+    #The five-star rating was recorded for the outbox drainer
+    self.assertTrue(OutboxEvent.objects.filter(topic='rating.five_star').exists())
+    self.assertEqual(reconcile_post_counters(), 0)
+
+  def test_last_operation_wins(self):
+    post = self.posts[0]
+    operations = [{'post': post.pk, 'action': 'like'}, {'post': post.pk, 'action': 'unlike'}]
+    self.client.post(self.url, {'operations': operations}, format='json')
+
+    post.refresh_from_db()
+    self.assertEqual(post.like_count, 0)
+    self.assertFalse(post.likes.filter(pk=self.user.pk).exists())
+
+  def test_results_report_each_operations_own_outcome(self):
+    a, b = self.posts[:2]
+    Rating.objects.create(user=self.user, post=b, score=3)
+    Post.objects.filter(pk=b.pk).update(rating_count=1, rating_sum=3, rating_3=1)
+    operations = [
+      {'post': a.pk, 'action': 'like'},
+      {'post': a.pk, 'action': 'unlike'},
+      {'post': a.pk, 'action': 'unlike'},
+      {'post': b.pk, 'action': 'rate', 'score': 3},
+      {'post': b.pk, 'action': 'rate', 'score': 5},
+    ]
+    response = self.client.post(self.url, {'operations': operations}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    results = response.data['results']  # type: ignore
+    self.assertEqual([(r['applied'], r['has_liked']) for r in results[:3]], [(True, True), (True, False), (False, False)])
+    self.assertEqual([(r['applied'], r['score']) for r in results[3:]], [(False, 3), (True, 5)])
+    self.assertFalse(Post.objects.get(pk=a.pk).likes.exists())
+    self.assertEqual(Rating.objects.get(post=b).score, 5)
+    self.assertEqual(reconcile_post_counters(), 0)
+
+  def test_rows_written_concurrently_are_not_counted_twice(self):
+    a, b = self.posts[:2]
+    insert_rows = engagement.insert_rows
+
+    def insert_after_another_request(model, user, objs):
+      #Another request by the same user commits its like and rating after our locked read
+      if model is Rating:
+        Rating.objects.create(user=self.user, post=b, score=2)
+        Post.objects.filter(pk=b.pk).update(rating_count=1, rating_sum=2, rating_2=1)
+      else:
+        a.likes.add(self.user)
+        Post.objects.filter(pk=a.pk).update(like_count=1)
+      return insert_rows(model, user, objs)
+
+    operations = [{'post': a.pk, 'action': 'like'}, {'post': b.pk, 'action': 'rate', 'score': 4}]
+    with patch('posts.engagement.insert_rows', insert_after_another_request):
+      response = self.client.post(self.url, {'operations': operations}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    a.refresh_from_db()
+    b.refresh_from_db()
+    self.assertEqual(a.like_count, 1)
+    self.assertEqual((b.rating_count, b.rating_sum), (1, 4))
+    self.assertEqual(Rating.objects.get(post=b).score, 4)
+    self.assertEqual(reconcile_post_counters(), 0)
+
+  def test_rate_requires_score(self):
+    response = self.client.post(self.url, {'operations': [{'post': self.posts[0].pk, 'action': 'rate'}]}, format='json')
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryPlanTests(SharedCacheTestMixin, QueryPlanTestMixin, APITestCase):
+  """
+  EXPLAINs the queries behind each hot endpoint on a seeded dataset and fails
+  on full table scans or filesorts, so a dropped index or a changed ordering is caught.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.authors = [User.objects.create_user(username=f'author{i}', password='password123') for i in range(5)]
+    cls.categories = [Category.objects.create(name=f'Category {i}') for i in range(5)]
+    now = timezone.now()
+    posts = [
+      Post(
+        title=f'Post {i}', content='Body', author=cls.authors[i % 5], category=cls.categories[i % 5],
+        status='PB' if i % 3 else 'DF', published_at=now - timedelta(hours=i) if i % 3 else None,
+        like_count=i % 7, comment_count=i % 4, rating_count=i % 2, rating_sum=(i % 2) * (i % 5 + 1),
+      )
+      for i in range(300)
+    ]
+    Post.objects.bulk_create(posts)
+    cls.post = Post.objects.filter(status='PB').first()
+    Comment.objects.bulk_create([Comment(post=cls.post, author=cls.authors[i % 5], content='Hi') for i in range(50)])
+    for follower in cls.authors[1:]:
+      Follow.objects.create(follower=follower, followed_user=cls.authors[0])
+    cls.reader = User.objects.create_user(username='plan_reader', password='password123')
+    CategorySubscription.objects.create(user=cls.reader, category=cls.categories[1])
+    Follow.objects.create(follower=cls.reader, followed_user=cls.authors[2])
+    TimelineEntry.objects.bulk_create([
+      TimelineEntry(user=cls.reader, post=post, published_at=post.published_at)
+      for post in Post.objects.filter(status='PB', author=cls.authors[3])
+    ])
+    refresh_all_leaderboards()
+
+  def setUp(self):
+    cache.clear()
+
+  def test_public_feeds_use_indexes(self):
+    for url in [
+      reverse('explore'),
+      reverse('explore') + '?pagination=cursor',
+      reverse('post-list'),
+      reverse('category-posts', kwargs={'category_name': 'Category 1'}),
+      reverse('post-comments', kwargs={'post_pk': self.post.pk}),
+      reverse('profile-posts', kwargs={'username': 'author0'}),
+      reverse('profile-followers', kwargs={'username': 'author0'}),
+      reverse('profile-following', kwargs={'username': 'author1'}),
+    ]:
+      #The category directory is a deliberate (cached) read of the whole, small table
+      response = self.assertIndexedQueries(lambda: self.client.get(url), allowed_scans=['posts_category'])
+      self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+
+  def test_drafts_use_indexes(self):
+    self.client.force_authenticate(user=self.authors[0])
+    response = self.assertIndexedQueries(lambda: self.client.get(reverse('my-drafts')))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+  def test_user_feed_uses_indexes(self):
+    self.client.force_authenticate(user=self.reader)
+    #A followed hot author and a subscribed hot category are pulled next to the timeline
+    hot = ({self.authors[2].pk}, {self.categories[1].pk})
+    with patch('posts.timeline.get_hot_sources', return_value=hot):
+      for params in [{}, {'page': 2}, {'pagination': 'cursor'}]:
+        response = self.assertIndexedQueries(lambda: self.client.get(reverse('user-feed'), params))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, params)
+        self.assertTrue(response.data['results'], params)  # type: ignore
+
+      response = self.assertIndexedQueries(lambda: self.client.get(response.data['next']))  # type: ignore
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+  def test_top_posts_use_indexes(self):
+    for params in [{}, {'sort_by': 'rating', 'window': 'day'}, {'sort_by': 'comments', 'window': 'week'}]:
+      response = self.assertIndexedQueries(lambda: self.client.get(reverse('top-posts'), params))
+      self.assertEqual(response.status_code, status.HTTP_200_OK, params)
+      self.assertTrue(response.data['results'], params)  # type: ignore
+
+
+class InstrumentationTests(SharedCacheTestMixin, APITestCase):
+  def setUp(self):
+    cache.clear()
+    render_cache.clear()
+    registry.reset()
+    self.user = User.objects.create_user(username='timed', password='password123')
+    self.staff = User.objects.create_user(username='ops', password='password123', is_staff=True)
+    self.category = Category.objects.create(name='Tech')
+
+  def timings(self, response):
+    #{'db': 'dur=..;desc=".."', ...} from the Server-Timing header
+    entries = [entry.strip().split(';', 1) for entry in response['Server-Timing'].split(',')]
+    return {entry[0]: entry[1] if len(entry) > 1 else '' for entry in entries}
+
+  def test_server_timing_breaks_the_request_down(self):
+    self.client.force_authenticate(user=self.user)
+    response = self.client.post(reverse('post-list'), {'title': 'Timed', 'content': '# Hello', 'category': 'Tech'})
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    timings = self.timings(response)
+    self.assertIn('render', timings)
+    self.assertIn('serialize', timings)
+    self.assertIn('total', timings)
+
+    self.client.force_authenticate(user=None)
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('explore'))
+    timings = self.timings(response)
+    self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timings['db'])
+    self.assertIn('desc="0 hit 1 miss"', timings['cache'])
+    self.assertIn('desc="1 hit 0 miss"', self.timings(self.client.get(reverse('explore')))['cache'])
+
+  def test_metrics_are_staff_only(self):
+    self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+    self.client.force_authenticate(user=self.user)
+    self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+  def test_metrics_expose_per_route_histograms(self):
+    post = Post.objects.create(title='One', content='Body', author=self.user, category=self.category)
+    self.client.get(reverse('post-detail', kwargs={'pk': post.pk}))
+    self.client.get(reverse('post-detail', kwargs={'pk': post.pk}))
+
+    self.client.force_authenticate(user=self.staff)
+    response = self.client.get(reverse('metrics'))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(response['Content-Type'].startswith('text/plain'))
+    body = response.content.decode()
+    self.assertIn('# TYPE blog_request_duration_seconds histogram', body)
+    self.assertIn('blog_request_duration_seconds_count{method="GET",route="api/posts/<int:pk>/"} 2', body)
+    self.assertIn('blog_db_queries_bucket{method="GET",route="api/posts/<int:pk>/",le="+Inf"} 2', body)
+    self.assertIn('blog_requests_total{method="GET",route="api/posts/<int:pk>/",status="200"} 2', body)
+
+
+def post_url(name):
+  return lambda test: reverse(name, kwargs={'pk': test.post.pk})
+
+
+def post_comments_url(test):
+  return reverse('post-comments', kwargs={'post_pk': test.post.pk})
+
+
+def profile_url(name):
+  return lambda test: reverse(name, kwargs={'username': test.author.username})
+
+
+#Queries each route may run. List routes must also cost the same at 1, 10 and 50 items.
+QUERY_BUDGETS = [
+  QueryBudget('explore', reverse_lazy('explore'), 3),
+  QueryBudget('post-list', reverse_lazy('post-list'), 3),
+  QueryBudget('category-posts', lambda test: reverse('category-posts', kwargs={'category_name': test.category.name}), 4),
+  QueryBudget('category-list', reverse_lazy('category-list'), 1, page_sizes=()),
+  QueryBudget('top-posts', reverse_lazy('top-posts'), 8),
+  QueryBudget('post-comments', post_comments_url, 3),
+  #Hot sources (2, cached afterwards), count, page keys off the timeline index, posts, tags, likes, ratings
+  QueryBudget('user-feed', reverse_lazy('user-feed'), 8, auth=True),
+  QueryBudget('my-drafts', reverse_lazy('my-drafts'), 5, auth=True),
+  QueryBudget('profile-posts', profile_url('profile-posts'), 3),
+  QueryBudget('profile-followers', profile_url('profile-followers'), 2),
+  QueryBudget('profile-following', lambda test: reverse('profile-following', kwargs={'username': test.reader.username}), 2),
+  QueryBudget('user-list', reverse_lazy('user-list'), 2),
+  QueryBudget('post-detail', post_url('post-detail'), 4, page_sizes=()),
+  QueryBudget('comment-detail', lambda test: reverse('comment-detail', kwargs={'pk': test.comment.pk}), 1, page_sizes=()),
+  QueryBudget('profile-detail', profile_url('profile-detail'), 1, page_sizes=()),
+  QueryBudget('user-profile', reverse_lazy('user-profile'), 1, auth=True, page_sizes=()),
+]
+
+
+class QueryBudgetTests(SharedCacheTestMixin, QueryBudgetTestMixin, APITestCase):
+  """
+  Requests every read route at several page sizes on a dataset with at least
+  50 items per list, and fails when a route goes over its budget in QUERY_BUDGETS
+  or its query count grows with the page size (an N+1).
+  """
+  @classmethod
+  def setUpTestData(cls):
+    cls.author = User.objects.create_user(username='budget_author', password='password123')
+    cls.reader = User.objects.create_user(username='budget_reader', password='password123')
+    cls.budget_user = cls.reader
+    cls.category = Category.objects.create(name='Budget')
+    tags = [Tag.objects.create(name=f'budget{i}') for i in range(3)]
+    now = timezone.now()
+
+    posts = [
+      Post(title=f'Post {i}', content='Body', author=cls.author, category=cls.category, status='PB',
+           published_at=now - timedelta(minutes=i), like_count=i + 1)
+      for i in range(60)
+    ] + [
+      Post(title=f'Draft {i}', content='Body', author=cls.reader, category=cls.category)
+      for i in range(60)
+    ]
+    for post in posts:
+      refresh_render(post) #Store the render up front, as Post.save() would
+    Post.objects.bulk_create(posts)
+    published = list(Post.objects.filter(status='PB'))
+    for post in published:
+      post.tags.set(tags)
+    TimelineEntry.objects.bulk_create([
+      TimelineEntry(user=cls.reader, post=post, published_at=post.published_at) for post in published
+    ])
+
+    cls.post = published[0]
+    fans = User.objects.bulk_create([User(username=f'fan{i}') for i in range(60)])
+    Comment.objects.bulk_create([Comment(post=cls.post, author=fan, content='Hi') for fan in fans])
+    cls.comment = Comment.objects.filter(post=cls.post).first()
+    Follow.objects.bulk_create(
+      [Follow(follower=fan, followed_user=cls.author) for fan in fans]
+      + [Follow(follower=cls.reader, followed_user=fan) for fan in fans]
+    )
+    refresh_all_leaderboards()
+
+  def test_routes_stay_within_budget(self):
+    for budget in QUERY_BUDGETS:
+      with self.subTest(route=budget.name):
+        self.assertQueryBudget(budget)
+
+  def test_growth_is_reported_with_the_offending_sql(self):
+    budget = QueryBudget('explore', reverse_lazy('explore'), 100)
+    with patch('posts.views.GlobalFeedView.get_queryset', lambda view: Post.objects.filter(status='PB').order_by('-published_at', '-id')):
+      with self.assertRaises(AssertionError) as ctx:
+        self.assertQueryBudget(budget)
+    self.assertIn('query count grows with page size', str(ctx.exception))
+    self.assertIn('auth_user', str(ctx.exception))
+    self.assertIn('serializers.py', str(ctx.exception))
+
+
+class BenchmarkTests(APITestCase):
+  def test_seed_and_report(self):
+    benchmark.seed_dataset({'users': 8, 'posts': 20, 'follows_per_user': 3}, seed=7)
+    self.assertEqual(Post.objects.count(), 20)
+    self.assertEqual(reconcile_post_counters(), 0)
+
+    report = benchmark.run_benchmark(iterations=2, warmup=0, only=['explore', 'post-detail'])
+    route = report['routes']['GET explore (anonymous)']
+    self.assertEqual(route['status'], [200])
+    self.assertGreater(route['bytes'], 0)
+    self.assertLessEqual(route['p50_ms'], route['p99_ms'])
+
+  def test_compare_flags_regressions(self):
+    baseline = {'routes': {'GET explore': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 5, 'bytes': 1000}}}
+    current = {'routes': {'GET explore': {'p50_ms': 10.5, 'p95_ms': 30.0, 'queries': 6, 'bytes': 1000}}}
+    regressed = {metric for _, metric, *_, flag in benchmark.compare_reports(baseline, current) if flag}
+    self.assertEqual(regressed, {'p95_ms', 'queries'})
+
+
+class AsyncReadViewTests(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.factory = APIRequestFactory()
+    self.author = User.objects.create_user(username='writer', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    self.category = Category.objects.create(name='Async')
+    Follow.objects.create(follower=self.reader, followed_user=self.author)
+    self.posts = []
+    for i in range(3):
+      post = Post.objects.create(title=f'Async {i}', content=f'# Heading {i}', author=self.author, category=self.category)
+      post.status = Post.Status.PUBLISHED
+      post.save()
+      self.posts.append(post)
+    drain()
+    self.posts[0].likes.add(self.reader)
+    Comment.objects.create(post=self.posts[0], author=self.reader, content='First')
+    self.client.force_authenticate(user=self.reader)  # type: ignore
+
+  def get_async(self, view_class, path, user=None, **kwargs):
+    headers = kwargs.pop('headers', {})
+    request = self.factory.get(path, **headers)
+    if user is not None:
+      force_authenticate(request, user=user)
+    return async_to_sync(view_class.as_view())(request, **kwargs)
+
+  def test_responses_match_the_sync_views(self):
+    routes = [
+      (AsyncGlobalFeedView, reverse('explore'), {}),
+      (AsyncGlobalFeedView, reverse('explore') + '?pagination=cursor&page_size=2', {}),
+      (AsyncUserFeedView, reverse('user-feed'), {}),
+      (AsyncCategoryPostListView, reverse('category-posts', kwargs={'category_name': 'Async'}), {'category_name': 'Async'}),
+      (AsyncPostDetailView, reverse('post-detail', kwargs={'pk': self.posts[0].pk}), {'pk': self.posts[0].pk}),
+    ]
+    for view_class, url, kwargs in routes:
+      with self.subTest(url=url):
+        expected = self.client.get(url)
+        response = self.get_async(view_class, url, user=self.reader, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+  def test_conditional_get_returns_304(self):
+    url = reverse('post-detail', kwargs={'pk': self.posts[0].pk})
+    etag = self.get_async(AsyncPostDetailView, url, user=self.reader, pk=self.posts[0].pk)['ETag']
+    response = self.get_async(AsyncPostDetailView, url, user=self.reader, pk=self.posts[0].pk, headers={'HTTP_IF_NONE_MATCH': etag})
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+  def test_errors_match_the_sync_views(self):
+    response = self.get_async(AsyncUserFeedView, reverse('user-feed'))
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    response = self.get_async(AsyncPostDetailView, reverse('post-detail', kwargs={'pk': 999}), user=self.reader, pk=999)
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(json.loads(response.content), {'detail': 'No Post matches the given query.'})
+
+  def test_token_authentication(self):
+    token = Token.objects.create(user=self.reader)
+    headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+    response = self.get_async(AsyncUserFeedView, reverse('user-feed'), headers=headers)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    #Second request resolves the token from the process-local cache
+    response = self.get_async(AsyncUserFeedView, reverse('user-feed'), headers=headers)
+    self.assertEqual(len(json.loads(response.content)['results']), 3)
+
+    response = self.get_async(AsyncUserFeedView, reverse('user-feed'), headers={'HTTP_AUTHORIZATION': 'Token nope'})
+    self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+  def test_other_requests_fall_back_to_the_sync_view(self):
+    url = reverse('explore') + '?search=Heading'
+    response = self.get_async(AsyncGlobalFeedView, url, user=self.reader)
+    self.assertIsInstance(response, Response)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    request = self.factory.post(reverse('post-detail', kwargs={'pk': self.posts[0].pk}))
+    force_authenticate(request, user=self.reader)
+    response = async_to_sync(AsyncPostDetailView.as_view())(request, pk=self.posts[0].pk)
+    self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class ConcurrencyBenchmarkTests(APITransactionTestCase):
+  #Transactional, so the worker threads' connections see the seeded rows
+  def test_sync_and_async_modes_are_reported(self):
+    benchmark.seed_dataset({'users': 6, 'posts': 15, 'follows_per_user': 3}, seed=3)
+    report = benchmark.run_concurrency_benchmark(requests=8, concurrency=4)
+    self.assertEqual(set(report['modes']), {'sync', 'async'})
+    for result in report['modes'].values():
+      self.assertEqual(result['status'], [200])
+      self.assertEqual(result['requests'], 8)
+      self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+class StubHealth:
+  def __init__(self, down=()):
+    self.down = set(down)
+
+  def is_healthy(self, alias):
+    return alias not in self.down
+
+
+class ReplicaRoutingTests(SharedCacheTestMixin, SimpleTestCase):
+  def setUp(self):
+    cache.clear()
+    self.router = db_router.PrimaryReplicaRouter(replicas=['replica1', 'replica2'], health=StubHealth(down=['replica2']))
+    self.factory = APIRequestFactory()
+
+  def read_in(self, state):
+    token = db_router._state.set(state)
+    try:
+      return self.router.db_for_read(Post)
+    finally:
+      db_router._state.reset(token)
+
+  def test_reads_go_to_a_healthy_replica_only_in_safe_requests(self):
+    self.assertEqual(self.read_in(db_router.RoutingState(use_replicas=True)), 'replica1')
+    self.assertEqual(self.read_in(db_router.RoutingState(use_replicas=False)), 'default')
+    #Outside requests (Celery, commands)
+    self.assertEqual(self.router.db_for_read(Post), 'default')
+    #Apps other than posts and users are left to Django
+    self.assertIsNone(self.router.db_for_read(Token))
+
+    self.router.health = StubHealth(down=['replica1', 'replica2'])
+    self.assertEqual(self.read_in(db_router.RoutingState(use_replicas=True)), 'default')
+
+  def test_reads_after_a_write_stay_on_the_primary(self):
+    state = db_router.RoutingState(use_replicas=True)
+    state(lambda *args: None, 'SELECT 1', None, False, {})
+    self.assertEqual(self.read_in(state), 'replica1')
+    state(lambda *args: None, 'UPDATE "posts_post" SET "like_count" = 1', None, False, {})
+    self.assertEqual(self.read_in(state), 'default')
+
+  def test_replicas_are_never_migrated(self):
+    self.assertFalse(self.router.allow_migrate('replica1', 'posts'))
+    self.assertIsNone(self.router.allow_migrate('default', 'posts'))
+
+  def test_health_is_probed_once_per_interval(self):
+    health = db_router.ReplicaHealth(interval=60, max_lag=5)
+    with patch.object(db_router, 'get_replica_lag', return_value=30) as lag:
+      self.assertFalse(health.is_healthy('replica1'))
+      self.assertFalse(health.is_healthy('replica1'))
+    self.assertEqual(lag.call_count, 1)
+
+    health.reset()
+    with patch.object(db_router, 'get_replica_lag', side_effect=db_router.DatabaseError):
+      self.assertFalse(health.is_healthy('replica1'))
+    health.reset()
+    with patch.object(db_router, 'get_replica_lag', return_value=1):
+      self.assertTrue(health.is_healthy('replica1'))
+
+  def run_request(self, request, write=False):
+    #Drives the middleware with a view that (optionally) writes, then reads
+    reads = []
+
+    def view(request):
+      if write:
+        #What the primary's execute_wrapper sees for a write
+        db_router._state.get()(lambda *args: None, 'INSERT INTO "posts_post_likes"', None, False, {})
+      reads.append(self.router.db_for_read(Post))
+      return HttpResponse()
+
+    with patch.object(db_router, 'REPLICAS', ['replica1']):
+      response = db_router.ReplicaRoutingMiddleware(view)(request)
+    return response, reads[0]
+
+  def test_client_is_pinned_to_the_primary_after_writing(self):
+    headers = {'HTTP_AUTHORIZATION': 'Token abc'}
+    self.assertEqual(self.run_request(self.factory.get('/api/explore/', **headers))[1], 'replica1')
+
+    response, read = self.run_request(self.factory.post('/api/posts/1/like/', **headers), write=True)
+    self.assertEqual(read, 'default')
+    self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+    self.assertEqual(self.run_request(self.factory.get('/api/explore/', **headers))[1], 'default')
+    #Other clients keep reading from replicas
+    self.assertEqual(self.run_request(self.factory.get('/api/explore/', HTTP_AUTHORIZATION='Token xyz'))[1], 'replica1')
+
+    #Clients without credentials are pinned by the signed cookie, which can't be forged
+    request = self.factory.get('/api/explore/')
+    request.COOKIES[db_router.PIN_COOKIE] = response.cookies[db_router.PIN_COOKIE].value
+    self.assertEqual(self.run_request(request)[1], 'default')
+    request = self.factory.get('/api/explore/')
+    request.COOKIES[db_router.PIN_COOKIE] = '1'
+    self.assertEqual(self.run_request(request)[1], 'replica1')
+
+  def test_cookie_pin_without_a_shared_cache(self):
+    #Only the writing worker would see a pin in its own memory: the cookie carries it
+    headers = {'HTTP_AUTHORIZATION': 'Token abc'}
+    with patch('blogging_platform_api.caching.is_shared_cache', return_value=False):
+      response, _ = self.run_request(self.factory.post('/api/posts/1/like/', **headers), write=True)
+      self.assertEqual(self.run_request(self.factory.get('/api/explore/', **headers))[1], 'replica1')
+      request = self.factory.get('/api/explore/', **headers)
+      request.COOKIES[db_router.PIN_COOKIE] = response.cookies[db_router.PIN_COOKIE].value
+      self.assertEqual(self.run_request(request)[1], 'default')
+
+
+HAS_REPLICA_ALIAS = 'replica' in settings.DATABASES
+
+
+@skipUnless(HAS_REPLICA_ALIAS, 'Set DB_SQLITE and DB_SQLITE_REPLICA to run against a SQLite primary and replica')
+class SQLiteReplicaTests(APITransactionTestCase):
+  """
+  Routing against two real databases: the SQLite primary and the file-backed
+  'replica' alias. The replica is given a different title for the same post, so
+  every response shows which database it was read from. Requests run outside a
+  test transaction, as reads inside one always stay on the primary.
+  """
+  #The runner sets up the aliases of skipped classes too
+  databases = {'default', 'replica'} if HAS_REPLICA_ALIAS else {'default'}
+
+  @classmethod
+  def setUpClass(cls):
+    #Replicas are never migrated; copy the schema over as replication would
+    existing = set(connections['replica'].introspection.table_names())
+    cls.replicated_models = [
+      model for model in apps.get_models()
+      if model._meta.managed and not model._meta.proxy and model._meta.db_table not in existing
+    ]
+    with connections['replica'].schema_editor() as editor:
+      for model in cls.replicated_models:
+        editor.create_model(model)
+    super().setUpClass()
+
+  @classmethod
+  def tearDownClass(cls):
+    super().tearDownClass()
+    with connections['replica'].schema_editor() as editor:
+      for model in cls.replicated_models:
+        editor.delete_model(model)
+
+  def setUp(self):
+    cache.clear()
+    db_router.replica_health.reset()
+    self.user = User.objects.create_user(username='reader', password='password123')
+    self.post = Post.objects.create(title='From primary', content='Body', author=self.user, status='PB')
+    #The replica's copy of the same rows; flush leaves the unmigrated replica alone
+    User.objects.using('replica').bulk_create([User(pk=self.user.pk, username='reader', password=self.user.password)])
+    Post.objects.using('replica').bulk_create([Post(
+      pk=self.post.pk, title='From replica', content='Body', author_id=self.user.pk, status='PB',
+      published_at=self.post.published_at, content_hash=self.post.content_hash, content_html=self.post.content_html,
+    )])
+    self.addCleanup(User.objects.using('replica').all().delete)
+
+  def title(self, client):
+    response = client.get(reverse('post-detail', kwargs={'pk': self.post.pk}))
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return response.data['title']  # type: ignore
+
+  def test_reads_use_the_replica_and_writes_pin_to_the_primary(self):
+    self.client.force_authenticate(user=self.user)
+    self.assertEqual(self.title(self.client), 'From replica')
+
+    response = self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    PostLike = Post.likes.through
+    self.assertTrue(PostLike.objects.using('default').filter(post_id=self.post.pk, user_id=self.user.pk).exists())
+    self.assertFalse(PostLike.objects.using('replica').exists())
+
+    #The signed pin cookie keeps this client's follow-up reads on the primary
+    self.assertEqual(self.title(self.client), 'From primary')
+    self.assertEqual(self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk})).data['likes_count'], 1)  # type: ignore
+    #Other clients still read from the replica
+    self.assertEqual(self.title(self.client_class()), 'From replica')
+
+
+class ImportPostsTests(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.author = User.objects.create_user(username='migrated', password='password123')
+    self.category = Category.objects.create(name='Archive')
+    Tag.objects.create(name='existing')
+    self.tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp.cleanup)
+
+  def write(self, name, lines):
+    path = os.path.join(self.tmp.name, name)
+    with open(path, 'w') as handle:
+      handle.write('\n'.join(lines) + '\n')
+    return path
+
+  def record(self, i, **fields):
+    return json.dumps({
+      'title': f'Old post {i}', 'content': f'# Old {i}\n\nArchived *markdown*', 'author': 'migrated',
+      'category': 'Archive', 'tags': ['existing', f'new{i % 2}'], 'status': 'published',
+      'published_at': '2019-05-01T12:00:00', **fields,
+    })
+
+  def test_jsonl_import(self):
+    path = self.write('posts.jsonl', [self.record(i) for i in range(5)] + [
+      self.record(5, status='draft', tags=[]),
+      'not json',
+      self.record(7, author='ghost'),
+      self.record(8, category='Nowhere'),
+      self.record(9, title=''),
+    ])
+    with CaptureQueriesContext(connection) as ctx:
+      call_command('import_posts', path, '--batch-size', '100', '--skip-index', stdout=StringIO(), stderr=StringIO())
+
+    posts = Post.objects.filter(author=self.author)
+    self.assertEqual(posts.count(), 6)
+    self.assertEqual(set(Tag.objects.values_list('name', flat=True)), {'existing', 'new0', 'new1'})
+    self.assertEqual(Post.tags.through.objects.count(), 10)
+    self.category.refresh_from_db()
+    self.assertEqual(self.category.post_count, 5)
+    #No signals ran: no per-post outbox events or search postings
+    self.assertFalse(OutboxEvent.objects.exists())
+    self.assertFalse(SearchPosting.objects.exists())
+    #One batch: the lookups, tag creation and inserts don't grow with the number of posts
+    self.assertLess(len(ctx.captured_queries), 20)
+
+    post = posts.get(title='Old post 3')
+    self.assertEqual(post.published_at.year, 2019)
+    self.assertEqual(post.content_hash, '')
+    response = self.client.get(reverse('post-detail', kwargs={'pk': post.pk}))
+    self.assertIn('<h1>Old 3</h1>', response.data['content_html'])  # type: ignore
+    self.assertEqual(sorted(response.data['tags']), ['existing', 'new1'])  # type: ignore
+
+  def test_csv_import_with_index_and_notifications(self):
+    path = self.write('posts.csv', [
+      'title,content,author,category,tags,status',
+      'Imported,Body about gardening,migrated,Archive,a|b,published',
+      'Draft,Another body,migrated,,,draft',
+    ])
+    call_command('import_posts', path, '--notify', stdout=StringIO(), stderr=StringIO())
+
+    self.assertEqual(Post.objects.count(), 2)
+    self.assertEqual(sorted(Post.objects.get(title='Imported').tags.values_list('name', flat=True)), ['a', 'b'])
+    self.assertTrue(SearchPosting.objects.filter(term='gardening').exists())
+    self.assertEqual(list(OutboxEvent.objects.values_list('topic', flat=True)), ['post.notify_subscribers'])
+
+  def test_resume_from_checkpoint(self):
+    path = self.write('posts.jsonl', [self.record(i) for i in range(5)])
+    checkpoint_path = os.path.join(self.tmp.name, 'import.checkpoint')
+
+    def crash(checkpoint):
+      raise RuntimeError('worker killed')
+
+    with open(path) as handle, self.assertRaises(RuntimeError):
+      importer.import_posts(importer.read_records(handle, 'jsonl'), importer.Checkpoint(checkpoint_path), batch_size=2, on_batch=crash)
+    self.assertEqual(Post.objects.count(), 2)
+
+    with open(path) as handle:
+      checkpoint = importer.import_posts(importer.read_records(handle, 'jsonl'), importer.Checkpoint(checkpoint_path), batch_size=2)
+    self.assertEqual(Post.objects.count(), 5)
+    self.assertEqual(sorted(Post.objects.values_list('title', flat=True)), [f'Old post {i}' for i in range(5)])
+    self.assertEqual(checkpoint.state['imported'], 5)
+    self.assertEqual(Post.objects.filter(checkpoint.get_imported_filter()).count(), 5)
+
+  def test_tag_case_variants_share_one_tag(self):
+    python = Tag.objects.create(name='Python')
+    path = self.write('posts.jsonl', [
+      self.record(0, tags=['python', 'PYTHON', 'Django']),
+      self.record(1, tags=['django', 'Existing']),
+    ])
+    call_command('import_posts', path, '--skip-index', stdout=StringIO(), stderr=StringIO())
+
+    self.assertEqual(Post.objects.count(), 2)
+    self.assertEqual(sorted(Tag.objects.values_list('name', flat=True)), ['Django', 'Python', 'existing'])
+    first, second = Post.objects.order_by('title')
+    self.assertEqual(sorted(first.tags.values_list('name', flat=True)), ['Django', 'Python'])
+    self.assertEqual(sorted(second.tags.values_list('name', flat=True)), ['Django', 'existing'])
+    self.assertEqual(Post.objects.filter(tags=python).count(), 1)
+
+  def test_ids_come_from_the_database(self):
+    path = self.write('posts.jsonl', [self.record(i) for i in range(3)])
+    insert = importer.RowWriter.insert
+    intruders = []
+
+    def insert_after_a_concurrent_post(writer, rows):
+      #A post created by the site between the id lookup and the insert
+      if writer.model is Post and not intruders:
+        intruders.append(Post.objects.create(title='Live post', content='Body', author=self.author))
+      insert(writer, rows)
+
+    with patch.object(importer.RowWriter, 'insert', insert_after_a_concurrent_post), open(path) as handle:
+      checkpoint = importer.import_posts(importer.read_records(handle, 'jsonl'))
+
+    imported = Post.objects.filter(checkpoint.get_imported_filter())
+    self.assertEqual(sorted(imported.values_list('title', flat=True)), [f'Old post {i}' for i in range(3)])
+    self.assertFalse(intruders[0].tags.exists())
+    for post in imported:
+      self.assertEqual(sorted(post.tags.values_list('name', flat=True)), sorted(['existing', f"new{int(post.title[-1]) % 2}"]))
+
+
+
+class ExportTests(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.staff = User.objects.create_user(username='ops', password='password123', is_staff=True)
+    self.author = User.objects.create_user(username='writer', password='password123')
+    self.reader = User.objects.create_user(username='reader', password='password123')
+    category = Category.objects.create(name='Exports')
+    self.posts = [
+      Post.objects.create(title=f'Post {i}', content=f'Body, "quoted" {i}\nsecond line', author=self.author, category=category, status='PB')
+      for i in range(5)
+    ]
+    self.other = Post.objects.create(title='Not mine', content='Body', author=self.reader, status='PB')
+    Comment.objects.create(post=self.posts[0], author=self.reader, content='Nice')
+    Comment.objects.create(post=self.other, author=self.author, content='Thanks')
+    self.posts[0].likes.add(self.reader)
+    Rating.objects.create(post=self.posts[1], user=self.reader, score=4)
+
+  def read(self, response):
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return b''.join(response.streaming_content).decode('utf-8')
+
+  def test_staff_ndjson_export(self):
+    self.client.force_authenticate(user=self.staff)
+    response = self.client.get(reverse('export', kwargs={'dataset': 'posts'}))
+    self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+    self.assertIn('X-Export-Started-At', response)
+    rows = [json.loads(line) for line in self.read(response).splitlines()]
+    self.assertEqual([row['id'] for row in rows], [post.pk for post in self.posts] + [self.other.pk])
+    self.assertEqual(rows[0]['author'], 'writer')
+    self.assertEqual(rows[0]['category'], 'Exports')
+    self.assertEqual(rows[0]['content'], self.posts[0].content)
+
+    likes = [json.loads(line) for line in self.read(self.client.get(reverse('export', kwargs={'dataset': 'likes'}))).splitlines()]
+    self.assertEqual([(row['post_id'], row['user']) for row in likes], [(self.posts[0].pk, 'reader')])
+
+  def test_csv_export(self):
+    self.client.force_authenticate(user=self.staff)
+    response = self.client.get(reverse('export', kwargs={'dataset': 'posts'}), {'output': 'csv'})
+    self.assertTrue(response['Content-Type'].startswith('text/csv'))
+    rows = list(csv.DictReader(StringIO(self.read(response))))
+    self.assertEqual(len(rows), 6)
+    #Commas, quotes and newlines in content survive the round trip
+    self.assertEqual(rows[0]['content'], self.posts[0].content)
+    self.assertEqual(rows[-1]['category'], '')
+
+  def test_author_export_is_scoped(self):
+    self.client.force_authenticate(user=self.author)
+    self.assertEqual(self.client.get(reverse('export', kwargs={'dataset': 'posts'})).status_code, status.HTTP_403_FORBIDDEN)
+
+    posts = [json.loads(line) for line in self.read(self.client.get(reverse('my-export', kwargs={'dataset': 'posts'}))).splitlines()]
+    self.assertEqual({row['id'] for row in posts}, {post.pk for post in self.posts})
+    comments = [json.loads(line) for line in self.read(self.client.get(reverse('my-export', kwargs={'dataset': 'comments'}))).splitlines()]
+    self.assertEqual([row['content'] for row in comments], ['Nice'])
+    #Who liked or rated is not shown to authors
+    ratings = [json.loads(line) for line in self.read(self.client.get(reverse('my-export', kwargs={'dataset': 'ratings'}))).splitlines()]
+    self.assertEqual(ratings, [{'id': ratings[0]['id'], 'post_id': self.posts[1].pk, 'score': 4}])
+
+  def test_since_and_errors(self):
+    self.client.force_authenticate(user=self.staff)
+    cutoff = timezone.now()
+    Post.objects.filter(pk=self.posts[2].pk).update(updated_at=cutoff + timedelta(seconds=1))
+    Post.objects.exclude(pk=self.posts[2].pk).update(updated_at=cutoff - timedelta(days=1))
+    response = self.client.get(reverse('export', kwargs={'dataset': 'posts'}), {'since': cutoff.isoformat()})
+    self.assertEqual([json.loads(line)['id'] for line in self.read(response).splitlines()], [self.posts[2].pk])
+
+    url = reverse('export', kwargs={'dataset': 'posts'})
+    self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(self.client.get(url, {'output': 'xml'}).status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(self.client.get(reverse('export', kwargs={'dataset': 'users'})).status_code, status.HTTP_404_NOT_FOUND)
+
+  def test_chunks_are_bounded_queries(self):
+    #Each chunk is one LIMITed query resuming after the last id; no model instances are built
+    with CaptureQueriesContext(connection) as ctx:
+      pieces = list(exports.export('posts', 'ndjson', chunk_size=2))
+    self.assertEqual(len(pieces), 3)
+    #The last, empty chunk ends the export
+    self.assertEqual(len(ctx.captured_queries), 4)
+    self.assertTrue(all('LIMIT 2' in query['sql'] for query in ctx.captured_queries))
+    self.assertEqual(sum(piece.count('\n') for piece in pieces), 6)
+
+  def test_command(self):
+    out = StringIO()
+    call_command('export_posts', 'comments', '--output', 'csv', '--author', 'writer', stdout=out, stderr=StringIO())
+    rows = list(csv.DictReader(StringIO(out.getvalue())))
+    self.assertEqual([row['author'] for row in rows], ['reader'])
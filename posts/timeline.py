@@ -0,0 +1,224 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from users.models import Follow
+from .models import Post, CategorySubscription, TimelineEntry
+
+
+#Authors/categories with a larger audience than this are not fanned out on
+#write; their posts are pulled into followers' feeds at read time instead.
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 5000)
+
+#How many recent posts a rebuilt timeline is seeded with
+REBUILD_DEPTH = getattr(settings, 'TIMELINE_REBUILD_DEPTH', 500)
+
+#Timelines are trimmed back to their newest MAX_LENGTH entries (see trim_timelines)
+MAX_LENGTH = getattr(settings, 'TIMELINE_MAX_LENGTH', 1000)
+
+BATCH_SIZE = 1000
+HOT_SOURCES_CACHE_KEY = 'timeline:hot-sources'
+HOT_SOURCES_TIMEOUT = 600
+
+
+def get_hot_sources():
+  """
+  Returns (author_ids, category_ids) whose audience exceeds FANOUT_LIMIT.
+  The result is small and changes slowly, so it is cached.
+  """
+  hot = cache.get(HOT_SOURCES_CACHE_KEY)
+  if hot is None:
+    authors = set(
+      Follow.objects.values('followed_user_id').annotate(n=Count('id'))
+      .filter(n__gt=FANOUT_LIMIT).values_list('followed_user_id', flat=True)
+    )
+    categories = set(
+      CategorySubscription.objects.values('category_id').annotate(n=Count('id'))
+      .filter(n__gt=FANOUT_LIMIT).values_list('category_id', flat=True)
+    )
+    hot = (authors, categories)
+    cache.set(HOT_SOURCES_CACHE_KEY, hot, HOT_SOURCES_TIMEOUT)
+  return hot
+
+
+def _write_entries(user_ids, post):
+  #Streams user ids into the timeline table in fixed-size batches
+  written = 0
+  batch = []
+  for user_id in user_ids:
+    batch.append(TimelineEntry(user_id=user_id, post_id=post.pk, published_at=post.published_at))
+    if len(batch) >= BATCH_SIZE:
+      TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+      written += len(batch)
+      batch = []
+  if batch:
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    written += len(batch)
+  return written
+
+
+def fan_out_post(post_id):
+  """
+  Delivers a published post to the timelines of the author's followers and the
+  category's subscribers. Hot sources are skipped (they are pulled on read).
+  Returns the number of audience rows processed.
+  """
+  post = Post.objects.filter(pk=post_id, status=Post.Status.PUBLISHED).first()
+  if post is None:
+    return 0
+
+  hot_authors, hot_categories = get_hot_sources()
+  audiences = []
+  if post.author_id not in hot_authors:
+    audiences.append(Follow.objects.filter(followed_user_id=post.author_id).values_list('follower_id'))
+  if post.category_id and post.category_id not in hot_categories:
+    audiences.append(CategorySubscription.objects.filter(category_id=post.category_id).values_list('user_id'))
+  if not audiences:
+    return 0
+
+  #UNION de-duplicates users who both follow the author and the category
+  audience = audiences[0].union(*audiences[1:]) if len(audiences) > 1 else audiences[0]
+  user_ids = (row[0] for row in audience.iterator(chunk_size=BATCH_SIZE) if row[0] != post.author_id)
+  return _write_entries(user_ids, post)
+
+
+def remove_post(post_id):
+  #Called when a post is unpublished; deleted posts cascade on their own
+  return TimelineEntry.objects.filter(post_id=post_id).delete()[0]
+
+
+def rebuild_timeline(user_id, depth=REBUILD_DEPTH):
+  """
+  Recomputes a user's timeline from their current follows and subscriptions,
+  seeding it with the most recent `depth` matching posts. Hot sources are left
+  out, as in fan_out_post(): the feed pulls their posts on read.
+  Used for backfills and after follow/unfollow or (un)subscribe.
+  """
+  hot_authors, hot_categories = get_hot_sources()
+  followed = list(
+    Follow.objects.filter(follower_id=user_id).exclude(followed_user_id__in=hot_authors).values_list('followed_user_id', flat=True)
+  )
+  subscribed = list(
+    CategorySubscription.objects.filter(user_id=user_id).exclude(category_id__in=hot_categories).values_list('category_id', flat=True)
+  )
+
+  recent = Post.objects.filter(
+    Q(author_id__in=followed) | Q(category_id__in=subscribed),
+    status=Post.Status.PUBLISHED,
+  ).exclude(author_id=user_id).order_by('-published_at', '-id').values_list('pk', 'published_at')[:depth]
+
+  entries = [TimelineEntry(user_id=user_id, post_id=pk, published_at=published_at) for pk, published_at in recent]
+
+  with transaction.atomic():
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+  return len(entries)
+
+
+def trim_timelines(max_length=MAX_LENGTH):
+  """
+  Deletes every entry beyond the newest `max_length` of each timeline, so a user's
+  timeline (and the index behind it) stops growing. Returns the number deleted.
+  """
+  long_timelines = (
+    TimelineEntry.objects.values('user_id').annotate(n=Count('id')).filter(n__gt=max_length).values_list('user_id', flat=True)
+  )
+  deleted = 0
+  for user_id in list(long_timelines):
+    entries = TimelineEntry.objects.filter(user_id=user_id)
+    #The oldest entry that is kept, found by walking timeline_user_recent
+    published_at, post_id = entries.order_by('-published_at', '-post_id').values_list('published_at', 'post_id')[max_length - 1]
+    deleted += entries.filter(older_than(('published_at', 'post_id'), (published_at, post_id))).delete()[0]
+  return deleted
+
+
+def older_than(fields, position):
+  #Rows strictly after `position` in (-published_at, -id) order
+  date_field, id_field = fields
+  published_at, pk = position
+  return Q(**{f'{date_field}__lt': published_at}) | Q(**{date_field: published_at, f'{id_field}__lt': pk})
+
+
+class TimelineFeed:
+  """
+  A user's home feed in (-published_at, -id) order: their timeline, read through the
+  timeline_user_recent index, merged with one index-ordered pull per hot author or
+  category they follow. Each source is read only as deep as the requested page, so
+  a page costs the same however many posts exist.
+
+  Page-number pagination uses count() and slicing; KeysetPagination uses after().
+  """
+  model = Post
+
+  def __init__(self, user, hot_authors=(), hot_categories=(), position=None):
+    self.user = user
+    self.hot_authors = list(hot_authors)
+    self.hot_categories = list(hot_categories)
+    self.position = position
+
+  def get_sources(self):
+    """
+    (queryset, post id field) per source. The sources never share a post, so their
+    counts add up and pages never repeat: the timeline can still hold posts of a
+    source fanned out before it turned hot, so the pulls skip posts already on it
+    (one lookup in unique_timeline_entry per row), and a hot category skips the
+    posts of the hot authors pulled beside it.
+    """
+    timeline = TimelineEntry.objects.filter(user_id=self.user.pk)
+    sources = [(timeline, 'post_id')]
+    published = Post.objects.filter(status=Post.Status.PUBLISHED).exclude(pk__in=timeline.values('post_id'))
+    sources += [(published.filter(author_id=author_id), 'id') for author_id in self.hot_authors]
+    sources += [
+      (published.filter(category_id=category_id).exclude(author_id__in=self.hot_authors), 'id')
+      for category_id in self.hot_categories
+    ]
+    return sources
+
+  def count(self):
+    return sum(queryset.count() for queryset, _ in self.get_sources())
+
+  def after(self, position):
+    return TimelineFeed(self.user, self.hot_authors, self.hot_categories, position)
+
+  def get_post_ids(self, limit):
+    streams = []
+    for queryset, id_field in self.get_sources():
+      if self.position is not None:
+        queryset = queryset.filter(older_than(('published_at', id_field), self.position))
+      streams.append(list(
+        queryset.order_by('-published_at', f'-{id_field}').values_list('published_at', id_field)[:limit]
+      ))
+
+    post_ids = []
+    seen = set()
+    for _, post_id in heapq.merge(*streams, reverse=True):
+      if post_id not in seen:
+        seen.add(post_id)
+        post_ids.append(post_id)
+        if len(post_ids) == limit:
+          break
+    return post_ids
+
+  def __getitem__(self, index):
+    if not isinstance(index, slice) or index.stop is None:
+      raise TypeError('TimelineFeed only supports bounded slices')
+    post_ids = self.get_post_ids(index.stop)[index.start or 0:]
+    posts = Post.objects.filter(status=Post.Status.PUBLISHED).select_related('author', 'category').prefetch_related('tags').in_bulk(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+def get_timeline_feed(user):
+  """
+  Home feed for a user: posts fanned out to their timeline, plus posts pulled at
+  read time from any hot authors/categories they follow.
+  """
+  hot_authors, hot_categories = get_hot_sources()
+  followed_hot = subscribed_hot = []
+  if hot_authors:
+    followed_hot = Follow.objects.filter(follower=user, followed_user_id__in=hot_authors).values_list('followed_user_id', flat=True)
+  if hot_categories:
+    subscribed_hot = CategorySubscription.objects.filter(user=user, category_id__in=hot_categories).values_list('category_id', flat=True)
+  return TimelineFeed(user, followed_hot, subscribed_hot)
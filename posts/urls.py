@@ -1,9 +1,18 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
-  PostListCreateView, PostDetailView, CommentListCreateView, CommentDetailView, LikePostView, RatePostView, TopPostsView, PostShareView, SubscribeCategoryView, UserFeedView, GlobalFeedView, CategoryListView, MyDraftListView, publish_post, CategoryPostListView, PostPublishView
+  PostListCreateView, PostDetailView, CommentListCreateView, CommentDetailView, LikePostView, RatePostView, TopPostsView, PostShareView, SubscribeCategoryView, UserFeedView, GlobalFeedView, CategoryListView, MyDraftListView, publish_post, CategoryPostListView, PostPublishView, BulkEngagementView,
+  ExportView, MyExportView
 )
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
+#Under ASGI the hot read endpoints are served by native async views (see posts.async_views)
+if settings.ASYNC_READ_VIEWS:
+  from .async_views import (
+    AsyncGlobalFeedView as GlobalFeedView, AsyncUserFeedView as UserFeedView,
+    AsyncPostDetailView as PostDetailView, AsyncCategoryPostListView as CategoryPostListView,
+  )
+
 urlpatterns = [
   #GET (List) and POST (Create)
   path('posts/', PostListCreateView.as_view(), name='post-list'),
@@ -17,6 +26,7 @@ urlpatterns = [
   #Engagements (Likes/Ratings)
   path('posts/<int:pk>/like/', LikePostView.as_view(), name='post-like'),
   path('posts/<int:pk>/rate/', RatePostView.as_view(), name='post-rate'),
+  path('posts/engagement/', BulkEngagementView.as_view(), name='post-engagement'),
   path('posts/top/', TopPostsView.as_view(), name='top-posts'),
   path('posts/<int:pk>/share/', PostShareView.as_view(), name='post-share'),
   path('posts/<int:pk>/publish/', PostPublishView.as_view(), name='post-publish'),
@@ -34,6 +44,10 @@ urlpatterns = [
   #Drafts
   path('drafts/', MyDraftListView.as_view(), name='my-drafts'),
 
+  #Exports (NDJSON/CSV streams)
+  path('exports/<str:dataset>/', ExportView.as_view(), name='export'),
+  path('my/exports/<str:dataset>/', MyExportView.as_view(), name='my-export'),
+
 
   #Documentation
   path('schema/', SpectacularAPIView.as_view(), name='schema'),
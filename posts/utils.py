@@ -8,4 +8,8 @@ def get_social_share_links(post_url, post_title):
     "X": f'https://x.com/intent/tweet?url={encoded_url}&text={encoded_title}',
     "facebook": f"https://www.facebook.com/sharer/sharer.php?u={encoded_url}",
     "linkedin": f"https://www.linkedin.com/shareArticle?mini=true&url={encoded_url}&title={encoded_title}"
-  }
\ No newline at end of file
+  }
+
+async def alist(queryset):
+  #Evaluates a queryset through the async ORM, without blocking the event loop
+  return [item async for item in queryset]
@@ -1,12 +1,13 @@
 from django.shortcuts import render, get_object_or_404
 from rest_framework import generics, permissions, status
-from .models import Post, Comment, Like, Rating, Category, CategorySubscription
-from .serializers import PostSerializer, CommentSerializer, RatingSerializer, CategorySerializer
+from .models import Post, Comment, Like, Rating, Category, CategorySubscription, LeaderboardEntry
+from .serializers import PostSerializer, PostSummarySerializer, CommentSerializer, RatingSerializer, CategorySerializer, BulkEngagementSerializer
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from .permissions import IsAuthorOrReadOnly
-from .filters import PostFilter
+from .filters import PostFilter, PostSearchFilter
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiResponse, inline_serializer, OpenApiParameter
 from rest_framework import generics
 from rest_framework import serializers
@@ -14,11 +15,23 @@ from django.db.models import Count, Avg, QuerySet
 from django.db.models.functions import Coalesce
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from rest_framework.decorators import action, api_view, permission_classes
-from .tasks import share_post_via_email
+from . import outbox
 from .utils import get_social_share_links
 from django.utils import timezone
+from django.db import transaction, IntegrityError
+from .counters import adjust_post_counters, get_rating_deltas
+from .pagination import FeedPagination
+from .timeline import get_timeline_feed
+from .leaderboards import get_leaderboard_queryset
+from .directory import get_category_directory, resolve_category_id
+from .engagement import apply_engagement
+from .conditional import PostValidatorsMixin, FeedValidatorsMixin, touch_post
+from .response_cache import AnonymousResponseCacheMixin
+from . import exports
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
 
 #A simple serializer for one-off messages
 MessageSerializer = inline_serializer(
@@ -34,7 +47,7 @@ MessageSerializer = inline_serializer(
   list=extend_schema(
     summary='List all posts.',
     responses={
-      201: PostSerializer, #Successful Creation
+      200: PostSummarySerializer,
       400: OpenApiResponse(description='Bad Request - Invalid data provided.'),
       401: OpenApiResponse(description='Unauthorized - Token is missing or invalid'),
     },
@@ -47,24 +60,25 @@ MessageSerializer = inline_serializer(
     tags=['Author Actions']
   ),
 )
-class PostListCreateView(generics.ListCreateAPIView):
+#Anonymous listings are served from the shared response cache
+class PostListCreateView(AnonymousResponseCacheMixin, generics.ListCreateAPIView):
   
   serializer_class = PostSerializer
   filterset_class = PostFilter
+  pagination_class = FeedPagination
+  cursor_ordering = ('-created_at', '-id')
 
   filter_backends = [
     DjangoFilterBackend,
-    filters.SearchFilter
+    PostSearchFilter #Inverted-index search over title, content, author and tags
   ]
 
-  search_fields = ['title', 'content', 'author__username', 'tags__name']
-
   def perform_create(self, serializer):
     serializer.save(author=self.request.user)
 
   def get_queryset(self): # type: ignore
     user = self.request.user
-    queryset = Post.objects.select_related('author', 'category').prefetch_related('tags', 'likes', 'ratings').all().order_by('-created_at') #Order by newest posts
+    queryset = Post.objects.select_related('author', 'category').prefetch_related('tags').all().order_by('-created_at', '-id') #Order by newest posts
 
     if user.is_authenticated:
       #Show all published posts OR drafts owned by the current user
@@ -75,6 +89,12 @@ class PostListCreateView(generics.ListCreateAPIView):
     #Anonymous users only see published posts
     return queryset.filter(status=Post.Status.PUBLISHED)
   
+  def get_serializer_class(self):
+    #Lists use the lean summary; creation accepts and returns the full post
+    if self.request.method == 'GET':
+      return PostSummarySerializer
+    return PostSerializer
+
   #Only Authenticated users can CREATE posts
   def get_permissions(self):
     if self.request.method == 'POST':
@@ -109,8 +129,12 @@ class PostListCreateView(generics.ListCreateAPIView):
   )
 )
 #View for retrieving a single post (Read) and updating/deleting 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
-  queryset = Post.objects.all().order_by('-created_at') #Order by newest first
+#GETs answer 304 Not Modified while the post's updated_at is unchanged
+class PostDetailView(PostValidatorsMixin, generics.RetrieveUpdateDestroyAPIView):
+  #Everything the full representation touches, including nested comments and their authors
+  queryset = Post.objects.select_related('author', 'category').prefetch_related(
+    'tags', Prefetch('comments', queryset=Comment.objects.select_related('author'))
+  )
   serializer_class = PostSerializer
   
   # 1. User must be logged in (IsAuthenticated) to attempt modification.
@@ -126,47 +150,70 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
   list=extend_schema(summary='List comments for a post', tags=['Comments']),
   create=extend_schema(summary='Add a comment to a post', tags=['Comments']),
 )
-class CommentListCreateView(generics.ListCreateAPIView):
+class CommentListCreateView(PostValidatorsMixin, generics.ListCreateAPIView):
   queryset = Comment.objects.none()
   serializer_class = CommentSerializer
   permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+  #Adding, editing or deleting a comment bumps the post's updated_at
+  post_url_kwarg = 'post_pk'
 
   def get_queryset(self) -> QuerySet[Comment]:  # type: ignore [override]
     #Only return comments for the post specified in the URL
-    return Comment.objects.filter(post_id=self.kwargs['post_pk']).order_by('-created_at')
+    return Comment.objects.filter(post_id=self.kwargs['post_pk']).select_related('author').order_by('-created_at')
   
   def perform_create(self, serializer):
     # Automatically assign author and post
     post = get_object_or_404(Post, pk=self.kwargs['post_pk'])
-    serializer.save(author=self.request.user, post=post)
+    with transaction.atomic():
+      serializer.save(author=self.request.user, post=post)
+      adjust_post_counters(post.pk, comment_count=1)
 
 @extend_schema_view(
   update=extend_schema(summary='Edit a comment', tags=['Comments']),
   destroy=extend_schema(summary='Delete a comment', tags=['Comments']),
 )
 class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
-  queryset = Comment.objects.all().order_by('-created_at')
+  queryset = Comment.objects.select_related('author').order_by('-created_at')
   serializer_class = CommentSerializer
   permission_classes = [IsAuthorOrReadOnly] #Reusing our custom permissions
 
-class TopPostsView(generics.ListAPIView):
-  """
-  Returns the top posts based on likes or average rating.
-  """
-  serializer_class = PostSerializer
+  def perform_update(self, serializer):
+    with transaction.atomic():
+      comment = serializer.save()
+      touch_post(comment.post_id)
 
-  @extend_schema(
-    summary='Get top rated/liked posts', 
+  def perform_destroy(self, instance):
+    with transaction.atomic():
+      post_id = instance.post_id
+      instance.delete()
+      adjust_post_counters(post_id, comment_count=-1)
+
+@extend_schema_view(
+  list=extend_schema(
+    summary='Get top rated/liked posts',
     parameters=[
-      OpenApiParameter(name='sort_by', type=str, description='Sort by "likes" or "rating"')
+      OpenApiParameter(name='sort_by', type=str, enum=LeaderboardEntry.Metric.values, description='Rank by "likes", "rating" or "comments" (default: likes)'),
+      OpenApiParameter(name='window', type=str, enum=LeaderboardEntry.Window.values, description='Time window: "day", "week", "month" or "all" (default: all)'),
     ]
   )
+)
+class TopPostsView(generics.ListAPIView):
+  """
+  Returns the top published posts based on likes, average rating or comments,
+  read from the precomputed leaderboards (see posts.leaderboards).
+  """
+  serializer_class = PostSummarySerializer
+
   def get_queryset(self) -> QuerySet[Post]:  # type: ignore [override]
-    
-  
-    return Post.objects.annotate(
-      likes_count=Count('likes')
-    ).order_by('-likes_count')[:10] #Get top 10
+    metric = self.request.query_params.get('sort_by', LeaderboardEntry.Metric.LIKES)
+    window = self.request.query_params.get('window', LeaderboardEntry.Window.ALL)
+
+    if metric not in LeaderboardEntry.Metric.values:
+      raise serializers.ValidationError({'sort_by': f"Must be one of: {', '.join(LeaderboardEntry.Metric.values)}"})
+    if window not in LeaderboardEntry.Window.values:
+      raise serializers.ValidationError({'window': f"Must be one of: {', '.join(LeaderboardEntry.Window.values)}"})
+
+    return get_leaderboard_queryset(window, metric).select_related('author', 'category').prefetch_related('tags')
     
 class LikePostView(APIView):
   permission_classes = [permissions.IsAuthenticated]
@@ -176,20 +223,31 @@ class LikePostView(APIView):
   def post(self, request, pk):
     post = get_object_or_404(Post, pk=pk)
     user = request.user
-
-    if post.likes.filter(pk=user.pk).exists():
-      post.likes.remove(user)
-      message = "Post Unliked"
-      status_code = status.HTTP_200_OK
-    else:
-      post.likes.add(user)
-      message = "Post Liked"
-      status_code = status.HTTP_201_CREATED
+    PostLike = Post.likes.through
+
+    with transaction.atomic():
+      #Deleting first tells us in one query whether the user had liked the post
+      removed, _ = PostLike.objects.filter(post_id=post.pk, user_id=user.pk).delete()
+
+      if removed:
+        adjust_post_counters(post.pk, like_count=-1)
+        has_liked = False
+        message = "Post Unliked"
+        status_code = status.HTTP_200_OK
+      else:
+        _, created = PostLike.objects.get_or_create(post_id=post.pk, user_id=user.pk)
+        if created:
+          adjust_post_counters(post.pk, like_count=1)
+        has_liked = True
+        message = "Post Liked"
+        status_code = status.HTTP_201_CREATED
+
+      current_total = Post.objects.values_list('like_count', flat=True).get(pk=post.pk)
 
     return Response({
       "message": message,
-      "current_total": post.likes.count(),
-      "has_liked": post.likes.filter(pk=user.pk).exists()
+      "current_total": current_total,
+      "has_liked": has_liked
     }, status=status_code)
   
 class RatePostView(generics.CreateAPIView):
@@ -200,12 +258,55 @@ class RatePostView(generics.CreateAPIView):
   serializer_class = RatingSerializer
 
   def post(self, request, pk):
-    score = request.data.get('score')
+    serializer = self.get_serializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    score = serializer.validated_data['score']
     post = get_object_or_404(Post, pk=pk)
-    rating, created = Rating.objects.update_or_create(
-      user=request.user, post=post, defaults={'score': score}
-    )
+
+    with transaction.atomic():
+      #Lock the existing rating (if any) so the old score used for the deltas is current
+      rating = Rating.objects.select_for_update().filter(user=request.user, post=post).first()
+      old_score = rating.score if rating else None
+
+      if rating is None:
+        try:
+          with transaction.atomic():
+            Rating.objects.create(user=request.user, post=post, score=score)
+        except IntegrityError:
+          #A concurrent request created it first; treat this one as an update
+          rating = Rating.objects.select_for_update().get(user=request.user, post=post)
+          old_score = rating.score
+
+      if rating is not None and old_score != score:
+        rating.score = score
+        rating.save(update_fields=['score'])
+
+      adjust_post_counters(post.pk, **get_rating_deltas(old_score, score))
+
     return Response({'message': 'Rating saved', 'score': score})
+
+class BulkEngagementView(generics.GenericAPIView):
+  """
+  Applies a batch of like/unlike/rate operations (e.g. synced from an offline client)
+  in one transaction with a fixed number of queries. Later operations on the same
+  post win; the response has one result per operation, in order, with its own outcome.
+  """
+  permission_classes = [permissions.IsAuthenticated]
+  serializer_class = BulkEngagementSerializer
+
+  @extend_schema(
+    summary='Apply likes, unlikes and ratings in bulk',
+    responses={200: inline_serializer(
+      name='BulkEngagementResponse',
+      fields={'results': serializers.ListField(child=serializers.DictField())}
+    )},
+    tags=['Social Actions']
+  )
+  def post(self, request):
+    serializer = self.get_serializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    results = apply_engagement(request.user, serializer.validated_data['operations'])
+    return Response({'results': results})
   
 class PostPublishView(APIView):
   permission_classes = [permissions.IsAuthenticated]
@@ -248,7 +349,8 @@ class PostShareView(APIView):
     sender = request.data.get('sender_name', 'A friend')
 
     if recipient:
-      share_post_via_email.delay(post.title, post_url, recipient, sender)  # type: ignore
+      #Sent by the outbox drainer, so the request never waits on the mail server
+      outbox.enqueue(outbox.POST_SHARE, post_title=post.title, post_url=post_url, recipient_email=recipient, sender_name=sender)
 
     #3. Return Social Links
     share_links = get_social_share_links(post_url, post.title)
@@ -299,8 +401,10 @@ class SubscribeCategoryView(APIView):
     )
   
 class UserFeedView(generics.ListAPIView):
-  serializer_class = PostSerializer
+  serializer_class = PostSummarySerializer
   permission_classes = [IsAuthenticated]
+  pagination_class = FeedPagination
+  cursor_ordering = ('-published_at', '-id')
 
   @extend_schema(
     summary="Get personalized feed",
@@ -314,45 +418,35 @@ class UserFeedView(generics.ListAPIView):
     user = self.request.user
 
     if user.is_superuser:
-      return Post.objects.filter(status='PB').order_by('-published_at')
+      return Post.objects.filter(status='PB').order_by('-published_at', '-id')
 
-    #1. Get IDs of authors the user follows
-    followed_authors = user.following.values_list('author_id', flat=True)  # type: ignore
-
-    #2. Get IDs of categories the user is subscribed to
-    subscribed_categories = user.category_subscriptions.values_list('category_id', flat=True)  # type: ignore
-
-    #3. Filter posts: (Author in list OR Category in list) AND Status is Published
-    return Post.objects.filter(
-      (Q(author_id__in=followed_authors) | Q(category_id__in=subscribed_categories)),
-      status= Post.Status.PUBLISHED
-    ).distinct().select_related('author', 'category').prefetch_related('tags').order_by('-published_at')
+    #Posts from followed authors and subscribed categories are fanned out to the
+    #user's timeline on publish; hot authors/categories are pulled at read time
+    return get_timeline_feed(user)  # type: ignore [return-value]
 
 
-class GlobalFeedView(generics.ListAPIView):
+class GlobalFeedView(FeedValidatorsMixin, AnonymousResponseCacheMixin, generics.ListAPIView):
   """
   Returns all published posts across the entire platform, 
   ordered by the most recently published.
+  Polls are answered with 304 Not Modified until the feed watermark moves,
+  and anonymous pages are served from the shared response cache.
   """
-  serializer_class = PostSerializer
+  serializer_class = PostSummarySerializer
   permission_classes = [permissions.AllowAny] #Public, so new users can see content
+  pagination_class = FeedPagination
+  cursor_ordering = ('-published_at', '-id')
   queryset = Post.objects.filter(status='PB').order_by('-published_at')
 
   #Filter Backends
-  filter_backends = [filters.SearchFilter]
-
-  #Fields that are searchable
-  #Implement "Search": Add a search bar so users can find specific posts by keywords?
-  search_fields = ['title', 'content', 'author__username', 'category__name']
+  #Search goes through the inverted index (title, content, author and tags)
+  filter_backends = [PostSearchFilter]
 
   #1. Exact Filtering (Category name or Author username)
   filterset_fields = ['category__name', 'author__username']
 
-  #2. Text Search (Partial matches)
-  search_fields = ['title', 'content', 'tags__name']
-
   #3. Ordering (By date or by popularity)
-  ordering_fields = ['published_at', 'likes_count']
+  ordering_fields = ['published_at', 'like_count']
   ordering = ['-published_at'] #Default ordering
 
   @extend_schema(
@@ -364,11 +458,11 @@ class GlobalFeedView(generics.ListAPIView):
 
     queryset = Post.objects.filter(status='PB').order_by('-published_at')
 
-    return Post.objects.filter(status=Post.Status.PUBLISHED).annotate(likes_count=Count('likes')).select_related('author', 'category').prefetch_related('tags')
+    return Post.objects.filter(status=Post.Status.PUBLISHED).select_related('author', 'category').prefetch_related('tags').order_by('-published_at', '-id')
   
 
 class CategoryListView(generics.ListCreateAPIView):
-  #Below calculated the count of post in the database before it even hits the serializer
+  #post_count is maintained on the row; the whole list is served from a versioned cache
   queryset = Category.objects.all()
   serializer_class = CategorySerializer
   permission_classes = [permissions.AllowAny()]
@@ -379,22 +473,34 @@ class CategoryListView(generics.ListCreateAPIView):
       return [permissions.IsAuthenticated()]
     
     return [permissions.AllowAny()]
+
+  def list(self, request, *args, **kwargs):
+    categories = get_category_directory()
+    page = self.paginate_queryset(categories)
+    if page is not None:
+      return self.get_paginated_response(page)
+    return Response(categories)
   
-class CategoryPostListView(generics.ListAPIView):
-  serializer_class = PostSerializer
+class CategoryPostListView(AnonymousResponseCacheMixin, generics.ListAPIView):
+  serializer_class = PostSummarySerializer
+  pagination_class = FeedPagination
+  cursor_ordering = ('-published_at', '-id')
   
 
   def get_queryset(self):
-    #Grab the category name from the URL
-    category_name = self.kwargs['category_name']
+    #Grab the category name from the URL and resolve it through the cached directory
+    category_id = resolve_category_id(self.kwargs['category_name'])
+    if category_id is None:
+      return Post.objects.none()
+
     #Filter posts by that category AND ensure they are published
     return Post.objects.filter(
-      category__name__iexact=category_name,
+      category_id=category_id,
       status='PB'
-    ).order_by('-published_at')
+    ).select_related('author', 'category').prefetch_related('tags').order_by('-published_at', '-id')
   
 class MyDraftListView(generics.ListAPIView):
-  serializer_class = PostSerializer
+  serializer_class = PostSummarySerializer
   permission_classes = [permissions.IsAuthenticated]
 
   def get_queryset(self):
@@ -402,7 +508,7 @@ class MyDraftListView(generics.ListAPIView):
     return Post.objects.filter(
       author=self.request.user,
       status = 'DF'
-    ).order_by('-created_at')
+    ).select_related('author', 'category').prefetch_related('tags').order_by('-created_at', '-id')
   
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated()])
@@ -417,4 +523,67 @@ def publish_post(request, pk):
 
     return Response({'status': 'Post published successfully!'}, status=200)
   except Post.DoesNotExist:
-    return Response({'error': 'Post not found or unauthorized.'}, status=404)
\ No newline at end of file
+    return Response({'error': 'Post not found or unauthorized.'}, status=404)
+
+
+EXPORT_PARAMETERS = [
+  OpenApiParameter(name='output', type=str, enum=exports.OUTPUTS, description='"ndjson" (default) or "csv"'),
+  OpenApiParameter(name='since', type=str, description='Only rows changed at or after this ISO 8601 time, for incremental exports'),
+]
+
+
+@extend_schema(
+  summary='Export a dataset',
+  parameters=EXPORT_PARAMETERS,
+  responses={
+    (200, 'application/x-ndjson'): OpenApiResponse(response=OpenApiTypes.STR, description='One JSON object per line'),
+    (200, 'text/csv'): OpenApiResponse(response=OpenApiTypes.STR, description='CSV with a header row'),
+    400: OpenApiResponse(description='Bad Request - Invalid output or since'),
+    404: OpenApiResponse(description='Not Found - Unknown dataset'),
+  },
+  description='Streams posts, comments, likes, ratings or tags. The X-Export-Started-At header is the `since` of the next incremental export.',
+  tags=['Exports']
+)
+class ExportView(APIView):
+  """
+  Staff export of a whole dataset, streamed as it is read.
+  """
+  permission_classes = [permissions.IsAdminUser]
+
+  def get_author(self):
+    return None
+
+  def get(self, request, dataset):
+    if dataset not in exports.DATASETS:
+      raise NotFound(f"Unknown dataset, use one of: {', '.join(exports.DATASETS)}")
+    output = request.query_params.get('output', 'ndjson')
+    if output not in exports.OUTPUTS:
+      raise serializers.ValidationError({'output': f"Must be one of: {', '.join(exports.OUTPUTS)}"})
+    since = request.query_params.get('since')
+    if since:
+      try:
+        since = exports.parse_since(since)
+      except ValueError as exc:
+        raise serializers.ValidationError({'since': str(exc)})
+
+    started = timezone.now()
+    #The rows are read after the middleware has returned, so the database is chosen now
+    using = exports.DATASETS[dataset].model._default_manager.db
+    rows = exports.export(dataset, output, author=self.get_author(), since=since or None, using=using)
+    response = StreamingHttpResponse(rows, content_type=exports.CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{output}"'
+    response['X-Export-Started-At'] = started.isoformat()
+    return response
+
+
+@extend_schema(
+  summary='Export my posts and their engagement',
+  parameters=EXPORT_PARAMETERS,
+  description='Like the staff export, limited to your own posts (drafts included) and the comments, likes, ratings and tags on them. Likes and ratings leave out who gave them.',
+  tags=['Author Actions']
+)
+class MyExportView(ExportView):
+  permission_classes = [permissions.IsAuthenticated]
+
+  def get_author(self):
+    return self.request.user
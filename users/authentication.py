@@ -0,0 +1,181 @@
+#Token authentication without a database round trip on the hot path.
+#A token resolves to a small snapshot of its user, cached in two tiers: a per-process
+#LRU (entries live LOCAL_TTL seconds) in front of the shared cache. Deleting or rotating
+#a token, and saving, deactivating or re-permissioning a user, drops the entries.
+#The shared tier is skipped when the cache is process-local: another process's
+#invalidation could never reach it, so only the short-lived LRU is used.
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from blogging_platform_api import caching
+
+
+CACHE_TIMEOUT = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 5 * 60)
+#Other processes learn about an invalidation from the shared cache once their local entry expires
+LOCAL_TTL = getattr(settings, 'TOKEN_LOCAL_CACHE_TTL', 10)
+LOCAL_SIZE = getattr(settings, 'TOKEN_LOCAL_CACHE_SIZE', 1024)
+#An invalidated key is blocked from being re-cached this long, so a request that read the
+#user just before the change cannot put the stale snapshot back
+TOMBSTONE_TIMEOUT = 30
+REVOKED = 'revoked'
+
+#The user fields a request needs; the rest are deferred and load on first access
+SNAPSHOT_FIELDS = [
+  field.attname for field in User._meta.concrete_fields
+  if field.attname in {'id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser'}
+]
+
+
+class LocalTokenCache:
+  """
+  Small thread-safe, process-local LRU whose entries expire after `ttl` seconds.
+  """
+  def __init__(self, maxsize=1024, ttl=10):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        return None
+      if entry[0] < time.monotonic():
+        del self._data[key]
+        return None
+      self._data.move_to_end(key)
+      return entry[1]
+
+  def set(self, key, value):
+    if self.ttl <= 0:
+      return
+    with self._lock:
+      self._data[key] = (time.monotonic() + self.ttl, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+
+local_cache = LocalTokenCache(maxsize=LOCAL_SIZE, ttl=LOCAL_TTL)
+
+
+def get_cache_key(token_key):
+  #Hashed, so raw tokens never sit in the shared cache's key space
+  return f"auth:token:{hashlib.sha256(token_key.encode('utf-8')).hexdigest()}"
+
+
+def make_snapshot(user):
+  return tuple(getattr(user, name) for name in SNAPSHOT_FIELDS)
+
+
+def build_user(snapshot):
+  #A fresh instance per request, loaded as if by .only(SNAPSHOT_FIELDS)
+  return User.from_db('default', SNAPSHOT_FIELDS, snapshot)
+
+
+def build_credentials(key, snapshot):
+  user = build_user(snapshot)
+  token = Token(key=key, user=user)
+  token._state.adding = False
+  return (user, token)
+
+
+def invalidate_token(token_key):
+  cache_key = get_cache_key(token_key)
+  local_cache.delete(cache_key)
+  cache.set(cache_key, REVOKED, TOMBSTONE_TIMEOUT)
+
+
+def invalidate_user_tokens(user_ids):
+  for token_key in Token.objects.filter(user_id__in=list(user_ids)).values_list('key', flat=True):
+    invalidate_token(token_key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+  """
+  TokenAuthentication that serves known tokens from the local LRU or the shared
+  cache, so resolving a token costs no queries. Only active users are cached.
+  """
+  def authenticate_credentials(self, key):
+    cache_key = get_cache_key(key)
+    snapshot = local_cache.get(cache_key)
+    if snapshot is None:
+      if not caching.is_shared_cache():
+        return self.load_credentials(key, cache_key, shared=False)
+      snapshot = cache.get(cache_key)
+      if snapshot is None or snapshot == REVOKED:
+        return self.load_credentials(key, cache_key, store=snapshot is None)
+      local_cache.set(cache_key, snapshot)
+
+    return build_credentials(key, snapshot)
+
+  async def aauthenticate(self, request):
+    """
+    authenticate() for async views. A token in the local LRU resolves right on the
+    event loop; anything else (shared cache, database, errors) runs on a worker thread.
+    """
+    auth = get_authorization_header(request).split()
+    if len(auth) == 2 and auth[0].lower() == self.keyword.lower().encode():
+      try:
+        key = auth[1].decode()
+      except UnicodeError:
+        key = None
+      snapshot = local_cache.get(get_cache_key(key)) if key else None
+      if snapshot is not None:
+        return build_credentials(key, snapshot)
+    return await sync_to_async(self.authenticate)(request)
+
+  def load_credentials(self, key, cache_key, store=True, shared=True):
+    user, token = super().authenticate_credentials(key)
+    if store:
+      snapshot = make_snapshot(user)
+      #add(), not set(): an invalidation tombstone written meanwhile wins
+      if not shared or cache.add(cache_key, snapshot, CACHE_TIMEOUT):
+        local_cache.set(cache_key, snapshot)
+    return (user, token)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+  #Covers logout and rotation (delete + create) as well as users being deleted
+  invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, created, **kwargs):
+  #Deactivation, staff/superuser changes and renames all go through save()
+  if not created:
+    invalidate_user_tokens([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_repermissioned_user(sender, instance, action, reverse, pk_set, **kwargs):
+  if not reverse:
+    if action.startswith('post_'):
+      invalidate_user_tokens([instance.pk])
+  elif action == 'pre_clear':
+    #clear() from the group/permission side names no users; read the members before they go
+    invalidate_user_tokens(instance.user_set.values_list('pk', flat=True))
+  elif action.startswith('post_') and pk_set:
+    invalidate_user_tokens(pk_set)
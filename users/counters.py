@@ -0,0 +1,37 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Profile, Follow
+
+
+def adjust_follow_counts(follower_id, followed_user_id, delta):
+  """
+  Applies a follow (+1) or unfollow (-1) to both profiles' counters with F()
+  expressions, so concurrent follows never lose an update.
+  """
+  Profile.objects.filter(user_id=followed_user_id).update(followers_count=F('followers_count') + delta)
+  Profile.objects.filter(user_id=follower_id).update(following_count=F('following_count') + delta)
+
+
+def reconcile_follow_counts(batch_size=1000):
+  """
+  Recomputes followers_count/following_count from the follow table and repairs
+  drift (e.g. follows removed by a cascade or in the admin).
+  Returns the number of repaired profiles.
+  """
+  followers = Follow.objects.filter(followed_user_id=OuterRef('user_id')).values('followed_user_id').annotate(c=Count('*')).values('c')
+  following = Follow.objects.filter(follower_id=OuterRef('user_id')).values('follower_id').annotate(c=Count('*')).values('c')
+
+  drifted = Profile.objects.annotate(
+    actual_followers=Coalesce(Subquery(followers), 0),
+    actual_following=Coalesce(Subquery(following), 0),
+  ).exclude(
+    followers_count=F('actual_followers'), following_count=F('actual_following')
+  ).values_list('pk', 'actual_followers', 'actual_following')
+
+  repaired = [
+    Profile(pk=pk, followers_count=followers_count, following_count=following_count)
+    for pk, followers_count, following_count in drifted.iterator(chunk_size=batch_size)
+  ]
+  Profile.objects.bulk_update(repaired, ['followers_count', 'following_count'], batch_size=batch_size)
+  return len(repaired)
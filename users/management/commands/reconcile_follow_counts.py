@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.counters import reconcile_follow_counts
+
+
+class Command(BaseCommand):
+  help = 'Repairs drift in the followers/following counts stored on profiles.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per UPDATE batch.')
+
+  def handle(self, *args, **options):
+    repaired = reconcile_follow_counts(batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(f"Repaired follow counts on {repaired} profile(s)."))
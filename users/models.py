@@ -18,6 +18,22 @@ class Profile(models.Model):
   bio = models.TextField(max_length=500, blank=True)
   profile_picture = models.ImageField(upload_to='profile_pics/', default='default.jpg')
   location = models.CharField(max_length=100, blank=True)
+  #Maintained by FollowUserView (see users.counters), so profiles never COUNT the follow table
+  followers_count = models.PositiveIntegerField(default=0, editable=False)
+  following_count = models.PositiveIntegerField(default=0, editable=False)
+
+  COUNTER_FIELDS = {'followers_count', 'following_count'}
+
+  def save(self, *args, **kwargs):
+    #The counters only change through F() updates. A full save of a loaded profile
+    #(every User save, profile edits) would write back stale values and undo
+    #concurrent follows, so saves of an existing row leave them out.
+    if not self._state.adding:
+      fields = kwargs.get('update_fields')
+      if fields is None:
+        fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key]
+      kwargs['update_fields'] = [name for name in fields if name not in self.COUNTER_FIELDS]
+    super().save(*args, **kwargs)
 
   def __str__(self):
     return f"{self.user.username}'s Profile"
@@ -31,4 +47,9 @@ class Follow(models.Model):
   class Meta:
     constraints = [
       models.UniqueConstraint(fields=['follower', 'followed_user'], name='unique_followers')
+    ]
+    #Follower/following lists are read newest first (see users.views)
+    indexes = [
+      models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_recent'),
+      models.Index(fields=['followed_user', '-created_at', '-id'], name='follow_followed_recent'),
     ]
\ No newline at end of file
@@ -1,8 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from posts.serializers import PostSerializer
-from .models import Profile
-from drf_spectacular.utils import extend_schema_field
+from .models import Profile, Follow
+from blogging_platform_api.instrumentation import TimedSerializerMixin
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
   password = serializers.CharField(write_only=True)
@@ -21,51 +20,40 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     return user
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
   class Meta:
     model = User
 
     fields = ('id', 'username', 'email', 'first_name', 'last_name')
     read_only_fields = ('username',)
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+  #Constant-size: posts and follow lists live under /profiles/<username>/posts|followers|following/
   username = serializers.ReadOnlyField(source='user.username')
-  #Include the user's posts directly in the profile
-  posts = PostSerializer(source='user.posts', many=True, read_only=True)
+  followers_count = serializers.IntegerField(read_only=True)
+  following_count = serializers.IntegerField(read_only=True)
 
-  followers = serializers.SlugRelatedField(
-    many=True,
-    read_only = True,
-    slug_field='follower__username',
-    source='user.followers'
-  )
-  following = serializers.SlugRelatedField(
-    many=True,
-    read_only=True,
-    slug_field='followed_user__username',
-    source='user.following'
-  )
-
-  followers_count = serializers.SerializerMethodField()
-  following_count = serializers.SerializerMethodField()
+  class Meta:
+    model = Profile
+    fields = ['id', 'username', 'bio', 'profile_picture', 'location', 'followers_count', 'following_count']
 
-  def get_followers_count(self, obj):
-    return obj.user.followers.count()
-  
-  def get_following_count(self, obj):
-    return obj.user.following.count()
+class FollowerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+  username = serializers.ReadOnlyField(source='follower.username')
+  followed_at = serializers.DateTimeField(source='created_at', read_only=True)
 
   class Meta:
-    model = Profile
-    fields = ['id', 'username', 'bio', 'profile_picture', 'location', 'posts', 'followers_count', 'following_count', 'followers', 'following']
+    model = Follow
+    fields = ['username', 'followed_at']
+
+class FollowingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+  username = serializers.ReadOnlyField(source='followed_user.username')
+  followed_at = serializers.DateTimeField(source='created_at', read_only=True)
 
-  @extend_schema_field(PostSerializer(many=True))
-  def get_posts(self, obj):
-    #Obj is the Profile instance
-    published_posts = obj.user.posts.filter(status='PB')
-    return PostSerializer(published_posts, many=True).data
+  class Meta:
+    model = Follow
+    fields = ['username', 'followed_at']
   
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
   #Include the profile bio we created earlier
   bio = serializers.CharField(source='profile.bio', read_only=True)
 
@@ -1,3 +1,162 @@
-from django.test import TestCase
+from unittest.mock import patch
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from posts.models import Post
+from posts.testing import SharedCacheTestMixin
+from blogging_platform_api import caching
+from .models import Profile, Follow
+from .counters import reconcile_follow_counts
+from .authentication import get_cache_key, local_cache
+
+
+class ProfileTests(APITestCase):
+  def setUp(self):
+    self.author = User.objects.create_user(username='author', password='password123')
+    self.readers = [User.objects.create_user(username=f'reader{i}', password='password123') for i in range(3)]
+
+  def follow(self, user, username):
+    self.client.force_authenticate(user=user)
+    response = self.client.post(reverse('user-follow', kwargs={'username': username}))
+    self.client.force_authenticate(user=None)
+    return response
+
+  def test_follow_toggle_maintains_counts(self):
+    for reader in self.readers:
+      self.assertEqual(self.follow(reader, 'author').status_code, status.HTTP_201_CREATED)
+    self.follow(self.readers[0], 'author') #Unfollow
+
+    self.assertEqual(Profile.objects.get(user=self.author).followers_count, 2)
+    self.assertEqual(Profile.objects.get(user=self.readers[0]).following_count, 0)
+    self.assertEqual(Profile.objects.get(user=self.readers[1]).following_count, 1)
+
+  def test_profile_is_constant_size(self):
+    for reader in self.readers:
+      self.follow(reader, 'author')
+    for i in range(5):
+      Post.objects.create(title=f'Post {i}', content='Body', author=self.author)
+
+    with CaptureQueriesContext(connection) as ctx:
+      response = self.client.get(reverse('profile-detail', kwargs={'username': 'author'}))
+    self.assertEqual(len(ctx.captured_queries), 1)
+    self.assertEqual(response.data['followers_count'], 3)  # type: ignore
+    self.assertNotIn('posts', response.data)  # type: ignore
+    self.assertNotIn('followers', response.data)  # type: ignore
+
+  def test_followers_are_cursor_paginated(self):
+    for reader in self.readers:
+      self.follow(reader, 'author')
+
+    url = reverse('profile-followers', kwargs={'username': 'author'})
+    names = []
+    pages = 0
+    with patch('posts.pagination.KeysetPagination.page_size', 2):
+      while url:
+        response = self.client.get(url)
+        names += [item['username'] for item in response.data['results']]  # type: ignore
+        url = response.data['next']  # type: ignore
+        pages += 1
+    self.assertEqual(pages, 2)
+    self.assertEqual(sorted(names), ['reader0', 'reader1', 'reader2'])
+
+    response = self.client.get(reverse('profile-following', kwargs={'username': 'reader0'}))
+    self.assertEqual([item['username'] for item in response.data['results']], ['author'])  # type: ignore
+    self.assertEqual(self.client.get(reverse('profile-posts', kwargs={'username': 'nobody'})).status_code, status.HTTP_404_NOT_FOUND)
+
+  def test_saving_a_stale_profile_keeps_the_counters(self):
+    profile = Profile.objects.get(user=self.author)
+    self.follow(self.readers[0], 'author')
+
+    #A User save (through the post_save handlers) and a profile edit, both holding the old counts
+    self.author.first_name = 'Renamed'
+    self.author.save()
+    profile.bio = 'Edited'
+    profile.save()
+    self.client.force_authenticate(user=self.author)
+    response = self.client.patch(reverse('profile-detail', kwargs={'username': 'author'}), {'location': 'Accra'})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    profile = Profile.objects.get(user=self.author)
+    self.assertEqual((profile.followers_count, profile.bio, profile.location), (1, 'Edited', 'Accra'))
+    self.assertEqual(Profile.objects.get(user=self.readers[0]).following_count, 1)
+
+  def test_reconcile_repairs_drift(self):
+    Follow.objects.create(follower=self.readers[0], followed_user=self.author)
+    self.assertEqual(reconcile_follow_counts(), 2)
+    self.assertEqual(Profile.objects.get(user=self.author).followers_count, 1)
+    self.assertEqual(reconcile_follow_counts(), 0)
+
+
+class CachedTokenAuthenticationTests(SharedCacheTestMixin, APITestCase):
+  def setUp(self):
+    cache.clear()
+    local_cache.clear()
+    self.user = User.objects.create_user(username='tokened', password='password123')
+    self.token = Token.objects.create(user=self.user)
+
+  def get_profile(self, key=None):
+    self.client.credentials(HTTP_AUTHORIZATION=f'Token {key or self.token.key}')
+    return self.client.get(reverse('user-profile'))
+
+  def token_queries(self, ctx):
+    return [query['sql'] for query in ctx.captured_queries if 'authtoken_token' in query['sql']]
+
+  def test_known_tokens_cost_no_queries(self):
+    with CaptureQueriesContext(connection) as ctx:
+      self.assertEqual(self.get_profile().status_code, status.HTTP_200_OK)
+    self.assertEqual(len(self.token_queries(ctx)), 1)
+
+    #Served from the local LRU, then from the shared cache
+    for clear_local in (False, True):
+      if clear_local:
+        local_cache.clear()
+      with CaptureQueriesContext(connection) as ctx:
+        response = self.get_profile()
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      self.assertEqual(response.data['username'], 'tokened')  # type: ignore
+      self.assertEqual(self.token_queries(ctx), [])
+
+  def test_deleted_and_rotated_tokens_stop_working(self):
+    self.get_profile()
+    old_key = self.token.key
+    self.token.delete()
+    self.assertEqual(self.get_profile(old_key).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    new_token = Token.objects.create(user=self.user)
+    self.assertEqual(self.get_profile(new_token.key).status_code, status.HTTP_200_OK)
+    self.assertEqual(self.get_profile(old_key).status_code, status.HTTP_401_UNAUTHORIZED)
+
+  def test_deactivated_users_are_rejected(self):
+    self.get_profile()
+    self.user.is_active = False
+    self.user.save()
+    self.assertEqual(self.get_profile().status_code, status.HTTP_401_UNAUTHORIZED)
+
+  def test_permission_changes_invalidate(self):
+    key = get_cache_key(self.token.key)
+    group = Group.objects.create(name='editors')
+    for change in (lambda: self.user.groups.add(group), lambda: group.user_set.clear()):
+      cache.delete(key) #Let the previous tombstone expire
+      self.get_profile()
+      self.assertIsNotNone(local_cache.get(key))
+      change()
+      self.assertIsNone(local_cache.get(key))
+      #Still accepted, read from the database until the tombstone expires
+      self.assertEqual(self.get_profile().status_code, status.HTTP_200_OK)
+      self.assertIsNone(local_cache.get(key))
+
+  def test_process_local_cache_is_not_shared(self):
+    #Another process could never see a revocation written to this process's memory
+    with patch.object(caching, 'is_shared_cache', return_value=False):
+      self.assertEqual(self.get_profile().status_code, status.HTTP_200_OK)
+      self.assertIsNone(cache.get(get_cache_key(self.token.key)))
+      self.assertIsNotNone(local_cache.get(get_cache_key(self.token.key)))
+      with CaptureQueriesContext(connection) as ctx:
+        self.assertEqual(self.get_profile().status_code, status.HTTP_200_OK)
+      self.assertEqual(self.token_queries(ctx), [])
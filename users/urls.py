@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
-from .views import RegisterView, UserProfileView, ProfileDetailView, UserListView, FollowUserView
+from .views import RegisterView, UserProfileView, ProfileDetailView, UserListView, FollowUserView, ProfilePostListView, ProfileFollowerListView, ProfileFollowingListView
 
 
 urlpatterns = [
@@ -10,5 +10,8 @@ urlpatterns = [
     #Profile endpoint using the username as a lookup
     path('profiles/<str:username>/', ProfileDetailView.as_view(), name='profile-detail'),
     path('profiles/<str:username>/follow/', FollowUserView.as_view(), name='user-follow'),
+    path('profiles/<str:username>/posts/', ProfilePostListView.as_view(), name='profile-posts'),
+    path('profiles/<str:username>/followers/', ProfileFollowerListView.as_view(), name='profile-followers'),
+    path('profiles/<str:username>/following/', ProfileFollowingListView.as_view(), name='profile-following'),
     path('users/', UserListView.as_view(), name='user-list'),
 ]
@@ -1,12 +1,18 @@
 from django.shortcuts import render
 from rest_framework import generics, permissions, serializers
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
 from .serializers import UserRegistrationSerializer
 from django.contrib.auth.models import User
 from rest_framework.permissions import IsAuthenticated
-from .serializers import UserProfileSerializer, ProfileSerializer, UserSerializer
+from .serializers import UserProfileSerializer, ProfileSerializer, UserSerializer, FollowerSerializer, FollowingSerializer
 from .models import Profile, Follow
+from .counters import adjust_follow_counts
 from django.core import exceptions
+from django.db import transaction
+from posts.models import Post
+from posts.serializers import PostSummarySerializer
+from posts.pagination import KeysetPagination
 
 
 
@@ -31,7 +37,7 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
   
 class ProfileDetailView(generics.RetrieveUpdateAPIView):
   
-  queryset = Profile.objects.all()
+  queryset = Profile.objects.select_related('user')
   serializer_class = ProfileSerializer
 
   lookup_field = 'user__username'
@@ -48,8 +54,42 @@ class ProfileDetailView(generics.RetrieveUpdateAPIView):
       raise exceptions.PermissionDenied("You cannot edit someone else's profile.")
     serializer.save()
 
+class ProfileSubresourceView(generics.ListAPIView):
+  #Base for the cursor-paginated lists under /profiles/<username>/
+  permission_classes = [permissions.AllowAny]
+  pagination_class = KeysetPagination
+
+  def get_profile_user_id(self):
+    user_id = User.objects.filter(username=self.kwargs['username']).values_list('pk', flat=True).first()
+    if user_id is None:
+      raise NotFound("User not found.")
+    return user_id
+
+class ProfilePostListView(ProfileSubresourceView):
+  serializer_class = PostSummarySerializer
+  cursor_ordering = ('-published_at', '-id')
+
+  def get_queryset(self):
+    return Post.objects.filter(
+      author_id=self.get_profile_user_id(), status=Post.Status.PUBLISHED
+    ).select_related('author', 'category').prefetch_related('tags')
+
+class ProfileFollowerListView(ProfileSubresourceView):
+  serializer_class = FollowerSerializer
+  cursor_ordering = ('-created_at', '-id')
+
+  def get_queryset(self):
+    return Follow.objects.filter(followed_user_id=self.get_profile_user_id()).select_related('follower')
+
+class ProfileFollowingListView(ProfileSubresourceView):
+  serializer_class = FollowingSerializer
+  cursor_ordering = ('-created_at', '-id')
+
+  def get_queryset(self):
+    return Follow.objects.filter(follower_id=self.get_profile_user_id()).select_related('followed_user')
+
 class UserListView(generics.ListAPIView):
-  queryset = User.objects.all()
+  queryset = User.objects.select_related('profile').order_by('pk')
   serializer_class = UserSerializer
   permission_classes = [permissions.AllowAny] #Anyone can see the author list
 
@@ -66,11 +106,16 @@ class FollowUserView(generics.GenericAPIView):
     if target_user == request.user:
       return Response({"error": "You cannot follow yourself."}, status=400)
     
-    follow, created = Follow.objects.get_or_create(follower=request.user, followed_user=target_user)
+    with transaction.atomic():
+      #Delete first: only the request that actually removed the row decrements the counts
+      deleted, _ = Follow.objects.filter(follower=request.user, followed_user=target_user).delete()
+      if deleted:
+        adjust_follow_counts(request.user.pk, target_user.pk, -1)
+        return Response({"message": f"Unfollowed {username}"})
+
+      follow, created = Follow.objects.get_or_create(follower=request.user, followed_user=target_user)
+      if created:
+        adjust_follow_counts(request.user.pk, target_user.pk, 1)
 
-    if not created:
-      follow.delete()
-      return Response({"message": f"Unfollowed {username}"})
-    
     return Response({"message": f"Following {username}"}, status=201)
   